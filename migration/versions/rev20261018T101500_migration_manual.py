@@ -0,0 +1,28 @@
+"""migration_manual
+
+Revision ID: rev20261018T101500
+Revises: rev20250914T193527
+Create Date: 2026-10-18 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'rev20261018T101500'
+down_revision: Union[str, None] = 'rev20250914T193527'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('channels', sa.Column('hwm_post_id', sa.String(), nullable=True))
+    op.add_column('channels', sa.Column('hwm_pb_date', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('channels', 'hwm_pb_date')
+    op.drop_column('channels', 'hwm_post_id')
@@ -0,0 +1,260 @@
+import logging
+import math
+import statistics
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Final
+
+from celery import Task as CeleryTask
+from celery.signals import task_postrun, task_prerun
+from pydantic import BaseModel
+from redis import Redis
+
+from src.app_celery import dispatcher_state
+from src.app_celery.main import INTERACTIVE_FETCH_QUEUE, app
+from src.common.rate_limit import take_response_counts
+from src.dto.redis_models import RedisTask
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+rds = Redis()
+
+# one bucket of upstream answers per minute, the throttle rate is read over AUTOSCALE_WINDOW_SECONDS
+BUCKET_SECONDS: Final = 60
+
+
+@dataclass(frozen=True, slots=True)
+class Signals:
+    backlog: int
+    # started crawls, claimed slots of tasks still waiting in the broker don't count
+    running: int
+    # processes of the workers consuming the fetch queues, None when no worker answered
+    capacity: int | None
+    # stage -> median run time, seconds
+    latency: dict[str, float]
+    # upstream host -> share of 429/5xx answers
+    throttle: dict[str, float]
+
+
+class Decision(BaseModel):
+    at: datetime
+    workers: int
+    target: int
+    reason: str
+    backlog: int
+    running: int
+    capacity: int | None = None
+    latency: dict[str, float]
+    throttle: dict[str, float]
+
+
+def stage_latency(stage: str) -> str:
+    return f"autoscale$latency${stage}"
+
+
+def response_bucket(bucket: int) -> str:
+    return f"autoscale$responses${bucket}"
+
+
+def decide(
+    workers: int,
+    signals: Signals,
+    *,
+    min_workers: int,
+    max_workers: int,
+    throttle_rate: float,
+    latency_max: dict[str, float],
+    decrease: float,
+) -> tuple[int, str]:
+    """
+    AIMD on the count of concurrent crawls, like the host limiters do on the request rate:
+    halved when an upstream throttles, -1 when a stage runs slower than its bound, +1 while a backlog waits on slots
+    that are all crawling. Never above the processes that can run the crawls, nor above the last known value without them
+    """
+    if signals.capacity is not None:
+        max_workers = min(max_workers, max(min_workers, signals.capacity))
+    else:
+        max_workers = min(max_workers, max(min_workers, workers))
+    throttled = {host: rate for host, rate in signals.throttle.items() if rate > throttle_rate}
+    slow = {stage: seconds for stage, seconds in signals.latency.items() if seconds > latency_max.get(stage, math.inf)}
+    if throttled:
+        target = math.floor(workers * decrease)
+        reason = "throttled: " + ", ".join(f"{host} {rate:.0%}" for host, rate in sorted(throttled.items()))
+    elif slow:
+        target = workers - 1
+        reason = "slow: " + ", ".join(f"{stage} {seconds:.0f}s" for stage, seconds in sorted(slow.items()))
+    elif signals.backlog > 0 and signals.running >= workers:
+        target = workers + 1
+        reason = f"backlog: {signals.backlog} windows"
+    elif signals.backlog == 0 and signals.running < workers:
+        target = workers - 1
+        reason = "idle"
+    else:
+        target = workers
+        reason = "hold"
+    return min(max_workers, max(min_workers, target)), reason
+
+
+def flush_response_counts(now: float) -> None:
+    """Adds the upstream answers counted in this process to the shared bucket of the current minute"""
+    counts = take_response_counts()
+    if not counts:
+        return
+    key = response_bucket(int(now // BUCKET_SECONDS))
+    with rds.pipeline(transaction=False) as pipe:
+        for host, (total, throttled) in counts.items():
+            pipe.hincrby(key, host, total)
+            pipe.hincrby(key, f"{host}$throttled", throttled)
+        pipe.expire(key, int(settings.AUTOSCALE_WINDOW_SECONDS) + BUCKET_SECONDS)
+        pipe.execute()
+
+
+def _throttle_rates(now: float) -> dict[str, float]:
+    last = int(now // BUCKET_SECONDS)
+    buckets = range(last - max(1, int(settings.AUTOSCALE_WINDOW_SECONDS // BUCKET_SECONDS)) + 1, last + 1)
+    with rds.pipeline(transaction=False) as pipe:
+        for bucket in buckets:
+            pipe.hgetall(response_bucket(bucket))
+        answers = pipe.execute()
+    totals: dict[str, int] = {}
+    for fields in answers:
+        for field, count in fields.items():
+            name = field.decode("utf-8")
+            totals[name] = totals.get(name, 0) + int(count)
+    # a handful of answers says nothing about the upstream
+    return {
+        host: totals.get(f"{host}$throttled", 0) / total
+        for host, total in totals.items()
+        if not host.endswith("$throttled") and total >= settings.AUTOSCALE_MIN_RESPONSES
+    }
+
+
+def _latencies() -> dict[str, float]:
+    stages = sorted({route["queue"] for route in app.conf.task_routes.values()})
+    with rds.pipeline(transaction=False) as pipe:
+        for stage in stages:
+            pipe.lrange(stage_latency(stage), 0, -1)
+        samples = pipe.execute()
+    return {stage: statistics.median(float(s) for s in values) for stage, values in zip(stages, samples, strict=True) if values}
+
+
+def _backlog() -> int:
+    """Windows and parts of split windows waiting for a slot"""
+    queues = dispatcher_state.queued_channels()
+    with rds.pipeline(transaction=False) as pipe:
+        for queue in queues:
+            pipe.llen(queue)
+            pipe.llen(dispatcher_state.channel_incremental(queue))
+            pipe.llen(dispatcher_state.channel_parts(queue))
+        lengths = pipe.execute()
+    # a window is two list items, a part one
+    return sum(windows // 2 + incremental // 2 + parts for windows, incremental, parts in zip(*[iter(lengths)] * 3, strict=True))
+
+
+def _fetch_capacity() -> int | None:
+    """Sum of the pool sizes of the workers that consume a fetch queue"""
+    inspect = app.control.inspect(timeout=1.0)
+    stats, queues = inspect.stats(), inspect.active_queues()
+    if not stats or not queues:
+        return None
+    fetch_queues = {"fetch", INTERACTIVE_FETCH_QUEUE}
+    return sum(
+        stat.get("pool", {}).get("max-concurrency", 0)
+        for worker, stat in stats.items()
+        if any(queue.get("name") in fetch_queues for queue in queues.get(worker, []))
+    )
+
+
+def read_signals(now: float) -> Signals:
+    running = dispatcher_state.running_tasks()
+    started = dispatcher_state.started_tasks()
+    return Signals(
+        backlog=_backlog(),
+        running=sum(1 for tid in running if tid in started),
+        capacity=_fetch_capacity(),
+        latency=_latencies(),
+        throttle=_throttle_rates(now),
+    )
+
+
+def counter_of_workers() -> int:
+    raw = rds.get(str(RedisTask.counter_of_workers.value))
+    try:
+        return int(raw) if raw is not None else dispatcher_state.DEFAULT_COUNTER_OF_WORKERS
+    except ValueError:
+        return dispatcher_state.DEFAULT_COUNTER_OF_WORKERS
+
+
+def autoscale(now: datetime) -> Decision | None:
+    """
+    Sets counter_of_workers from the backlog, the stage latencies and the upstream throttle rates,
+    at most once per AUTOSCALE_INTERVAL_SECONDS whatever the count of sweeping workers.
+    Lowering it never stops running crawls, the claims just wait until enough of them end
+    """
+    if not rds.set(str(RedisTask.autoscale_lock.value), now.isoformat(), nx=True, ex=max(1, int(settings.AUTOSCALE_INTERVAL_SECONDS))):
+        return None
+    flush_response_counts(now.timestamp())
+    workers = counter_of_workers()
+    signals = read_signals(now.timestamp())
+    target, reason = decide(
+        workers,
+        signals,
+        min_workers=settings.AUTOSCALE_MIN_WORKERS,
+        max_workers=settings.AUTOSCALE_MAX_WORKERS,
+        throttle_rate=settings.AUTOSCALE_THROTTLE_RATE,
+        latency_max=settings.AUTOSCALE_STAGE_LATENCY_MAX,
+        decrease=settings.AUTOSCALE_DECREASE,
+    )
+    decision = Decision(
+        at=now,
+        workers=workers,
+        target=target,
+        reason=reason,
+        backlog=signals.backlog,
+        running=signals.running,
+        capacity=signals.capacity,
+        latency=signals.latency,
+        throttle=signals.throttle,
+    )
+    with rds.pipeline() as pipe:
+        if target != workers:
+            pipe.set(str(RedisTask.counter_of_workers.value), target)
+        pipe.lpush(str(RedisTask.autoscale_decisions.value), decision.model_dump_json())
+        pipe.ltrim(str(RedisTask.autoscale_decisions.value), 0, settings.AUTOSCALE_DECISIONS_KEPT - 1)
+        pipe.execute()
+    if target != workers:
+        logger.info(f"autoscale :: workers {workers} -> {target} ({reason})")
+    return decision
+
+
+def recent_decisions(count: int) -> list[Decision]:
+    return [Decision.model_validate_json(raw) for raw in rds.lrange(str(RedisTask.autoscale_decisions.value), 0, count - 1)]
+
+
+# run time of the ingestion stages, measured in the worker that runs them
+_started: dict[str, float] = {}
+
+
+@task_prerun.connect
+def on_stage_start(task_id: str | None = None, task: CeleryTask | None = None, **kwargs: object) -> None:
+    if task_id is not None and task is not None and task.name in app.conf.task_routes:
+        _started[task_id] = time.monotonic()
+
+
+@task_postrun.connect
+def on_stage_end(task_id: str | None = None, task: CeleryTask | None = None, **kwargs: object) -> None:
+    started = _started.pop(task_id, None) if task_id is not None else None
+    if started is None or task is None:
+        return
+    key = stage_latency(app.conf.task_routes[task.name]["queue"])
+    try:
+        with rds.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, time.monotonic() - started)
+            pipe.ltrim(key, 0, settings.AUTOSCALE_LATENCY_SAMPLES - 1)
+            pipe.execute()
+        # the crawls count the answers of t.me, the summaries the ones of the llm api
+        flush_response_counts(time.time())
+    except Exception as e:
+        logger.warning(f"autoscale :: stage metrics of {task.name} were not saved: {e!s}")
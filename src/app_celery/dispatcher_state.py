@@ -0,0 +1,473 @@
+import itertools
+import logging
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from enum import Enum, unique
+from typing import Final
+
+from pydantic import BaseModel
+from redis import Redis
+
+from src.app_celery.scheduler import ChannelState, Priority, source_of
+from src.common.moment import END_OF_EPOCH, START_OF_EPOCH, as_utc
+from src.dto.feed_rec_info import Source, Task
+from src.dto.redis_models import RedisTask
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+DEFAULT_COUNTER_OF_WORKERS: Final = 3
+
+# KEYS: channel queue, channel lease, running tasks, counter of workers, channel incremental queue
+# ARGV: task id, channel queue name, lease ttl, default counter of workers, extra slots
+# a free slot, no lease on the channel and a whole window in its queue: the window is popped,
+# the channel leased to the task and the task counted as running in one step, incremental windows go first
+_CLAIM_WINDOW: Final = """
+local cow = tonumber(redis.call('GET', KEYS[4]) or ARGV[4]) or tonumber(ARGV[4])
+if redis.call('HLEN', KEYS[3]) >= cow + tonumber(ARGV[5]) then
+    return -1
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return nil
+end
+local queue, incremental = KEYS[5], 1
+if redis.call('LLEN', queue) < 2 then
+    queue, incremental = KEYS[1], 0
+    if redis.call('LLEN', queue) < 2 then
+        return nil
+    end
+end
+local dt_from = redis.call('LPOP', queue)
+local dt_to = redis.call('LPOP', queue)
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[3])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+return {dt_from, dt_to, incremental}
+"""
+
+# KEYS: channel parts, running tasks, counter of workers, split parts, channel lease
+# ARGV: task id, channel queue name, lease ttl, default counter of workers, extra slots
+# parts of a split window run side by side, the channel stays leased to the split (the parent id) until the last one ends,
+# a part waits while the channel is leased to another window
+_CLAIM_PART: Final = """
+local cow = tonumber(redis.call('GET', KEYS[3]) or ARGV[4]) or tonumber(ARGV[4])
+if redis.call('HLEN', KEYS[2]) >= cow + tonumber(ARGV[5]) then
+    return -1
+end
+local part = redis.call('LINDEX', KEYS[1], 0)
+if not part then
+    return nil
+end
+local parent = cjson.decode(part)['parent']
+local holder = redis.call('GET', KEYS[5])
+if holder and holder ~= parent then
+    return nil
+end
+redis.call('LPOP', KEYS[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[4], ARGV[1], part)
+redis.call('SET', KEYS[5], parent, 'EX', ARGV[3])
+return part
+"""
+
+# KEYS: channel lease, running tasks, started tasks ; ARGV: lease holder, lease ttl, task id, start time or ''
+# 1: renewed, 0: the task was released meanwhile, -1: the channel is leased to another window
+_RENEW_LEASE: Final = """
+if redis.call('HEXISTS', KEYS[2], ARGV[3]) == 0 then
+    return 0
+end
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return -1
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if ARGV[4] ~= '' then
+    redis.call('HSET', KEYS[3], ARGV[3], ARGV[4])
+end
+return 1
+"""
+
+# KEYS: channel lease, running tasks, split parts, channel progress, started tasks, sent tasks ; ARGV: task id
+# the channel is freed with the last part of a split, or with its only window, every part index is counted once
+_RELEASE: Final = """
+if redis.call('HDEL', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('HDEL', KEYS[6], ARGV[1])
+local holder = ARGV[1]
+local index = 0
+local part = redis.call('HGET', KEYS[3], ARGV[1])
+if part then
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    local decoded = cjson.decode(part)
+    holder = decoded['parent']
+    index = decoded['index']
+end
+redis.call('HSET', KEYS[4], 'p' .. index, 100)
+local done = tonumber(redis.call('HGET', KEYS[4], 'done') or 0)
+if redis.call('HSETNX', KEYS[4], 'd' .. index, 1) == 1 then
+    done = redis.call('HINCRBY', KEYS[4], 'done', 1)
+end
+if done < tonumber(redis.call('HGET', KEYS[4], 'parts') or 1) then
+    return 0
+end
+if redis.call('GET', KEYS[1]) == holder then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+rds = Redis()
+_claim_window = rds.register_script(_CLAIM_WINDOW)
+_claim_part = rds.register_script(_CLAIM_PART)
+_renew_lease = rds.register_script(_RENEW_LEASE)
+_release = rds.register_script(_RELEASE)
+
+
+@unique
+class Claim(Enum):
+    CLAIMED = "claimed"
+    SKIPPED = "skipped"
+    NO_SLOTS = "no_slots"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class WindowPart(BaseModel):
+    parent: str
+    index: int
+    dt_from: datetime
+    dt_to: datetime
+    incremental: bool = False
+
+    def task(self, queue: str) -> Task:
+        source, channel_name = queue.split("$", maxsplit=1)
+        return Task(source=Source(source), channel_name=channel_name, dt_from=self.dt_from, dt_to=self.dt_to, incremental=self.incremental)
+
+
+def channel_queue(source: Source, channel_name: str) -> str:
+    return f"{source.value}${channel_name}"
+
+
+def channel_lease(queue: str) -> str:
+    return f"{queue}$lease"
+
+
+def channel_incremental(queue: str) -> str:
+    return f"{queue}$incremental"
+
+
+def channel_parts(queue: str) -> str:
+    return f"{queue}$parts"
+
+
+def channel_progress(queue: str) -> str:
+    return f"{queue}$progress"
+
+
+def split_window(dt_from: datetime, dt_to: datetime, *, now: datetime, span: timedelta, max_parts: int) -> list[tuple[datetime, datetime]]:
+    """
+    Adjacent (dt_from, dt_to) parts of a window wider than span, newest first: cut at month starts, a few months per part
+    when there would be more than max_parts, nothing is cut past now
+    """
+    dt_from, dt_to = as_utc(dt_from), as_utc(dt_to)
+    end = min(dt_to, as_utc(now))
+    if end - dt_from <= span:
+        return [(dt_from, dt_to)]
+    cuts = [dt_from]
+    month = datetime(dt_from.year, dt_from.month, 1, tzinfo=timezone.utc)
+    while True:
+        month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+        if month >= end:
+            break
+        cuts.append(month)
+    step = -(-len(cuts) // max_parts)
+    cuts = [*cuts[::step], dt_to]
+    return list(reversed(list(itertools.pairwise(cuts))))
+
+
+def running_tasks() -> dict[str, str]:
+    """task id -> channel queue of the parse tasks holding a slot"""
+    return {tid.decode("utf-8"): queue.decode("utf-8") for tid, queue in rds.hgetall(str(RedisTask.running_tasks.value)).items()}
+
+
+def queued_channels() -> list[str]:
+    return [queue.decode("utf-8") for queue in rds.smembers(str(RedisTask.channel_tasks.value))]
+
+
+def claim_window(queue: str, task_id: str, *, extra_slots: int = 0) -> tuple[Claim, Task | None]:
+    """
+    Atomically takes a slot, the channel lease and the next (dt_from, dt_to) of the queue for task_id,
+    extra_slots lets a refresh run past counter_of_workers
+    """
+    claimed = _claim_window(
+        keys=[
+            queue,
+            channel_lease(queue),
+            str(RedisTask.running_tasks.value),
+            str(RedisTask.counter_of_workers.value),
+            channel_incremental(queue),
+        ],
+        args=[task_id, queue, settings.DISPATCH_LEASE_TTL, DEFAULT_COUNTER_OF_WORKERS, extra_slots],
+    )
+    if claimed == -1:
+        return Claim.NO_SLOTS, None
+    if not claimed:
+        return Claim.SKIPPED, None
+    dt_from, dt_to = (value.decode("utf-8") for value in claimed[:2])
+    source, channel_name = queue.split("$", maxsplit=1)
+    try:
+        return Claim.CLAIMED, Task(
+            source=Source(source),
+            channel_name=channel_name,
+            dt_from=datetime.fromisoformat(dt_from),
+            dt_to=datetime.fromisoformat(dt_to),
+            incremental=bool(claimed[2]),
+        )
+    except ValueError:
+        logger.warning(f"Invalid Task parameters of {queue}: {dt_from} {dt_to}")
+        release(task_id, queue)
+        return Claim.SKIPPED, None
+
+
+def claim_part(queue: str, task_id: str, *, extra_slots: int = 0) -> tuple[Claim, Task | None]:
+    """Atomically takes a slot and the next waiting part of a split window of the queue for task_id"""
+    claimed = _claim_part(
+        keys=[
+            channel_parts(queue),
+            str(RedisTask.running_tasks.value),
+            str(RedisTask.counter_of_workers.value),
+            str(RedisTask.split_parts.value),
+            channel_lease(queue),
+        ],
+        args=[task_id, queue, settings.DISPATCH_LEASE_TTL, DEFAULT_COUNTER_OF_WORKERS, extra_slots],
+    )
+    if claimed == -1:
+        return Claim.NO_SLOTS, None
+    if not claimed:
+        return Claim.SKIPPED, None
+    return Claim.CLAIMED, WindowPart.model_validate_json(claimed).task(queue)
+
+
+def start_window(queue: str, task_id: str, task: Task) -> None:
+    """A window that runs whole is the single part 0 of itself, so it can be put back like any part"""
+    part = WindowPart(parent=task_id, index=0, dt_from=task.dt_from, dt_to=task.dt_to, incremental=task.incremental)
+    with rds.pipeline() as pipe:
+        pipe.hset(str(RedisTask.split_parts.value), task_id, part.model_dump_json())
+        pipe.delete(channel_progress(queue))
+        pipe.hset(channel_progress(queue), mapping={"dt_from": str(task.dt_from), "dt_to": str(task.dt_to), "parts": 1, "done": 0, "p0": 0})
+        pipe.execute()
+
+
+def start_split(queue: str, task_id: str, task: Task, windows: list[tuple[datetime, datetime]]) -> None:
+    """
+    Turns the claimed window into waiting parts: task_id gives its slot back and only names the split,
+    the channel lease stays with it until the last part ends
+    """
+    parts = [
+        WindowPart(parent=task_id, index=index, dt_from=dt_from, dt_to=dt_to, incremental=task.incremental) for index, (dt_from, dt_to) in enumerate(windows)
+    ]
+    with rds.pipeline() as pipe:
+        pipe.hdel(str(RedisTask.running_tasks.value), task_id)
+        pipe.delete(channel_progress(queue))
+        pipe.hset(channel_progress(queue), mapping={"dt_from": str(task.dt_from), "dt_to": str(task.dt_to), "parts": len(parts), "done": 0})
+        pipe.rpush(channel_parts(queue), *(part.model_dump_json() for part in parts))
+        pipe.execute()
+    logger.debug(f"split {queue} {task.dt_from}..{task.dt_to} into {len(parts)} parts")
+
+
+def part_of(task_id: str) -> WindowPart | None:
+    raw = rds.hget(str(RedisTask.split_parts.value), task_id)
+    return WindowPart.model_validate_json(raw) if raw is not None else None
+
+
+def lease_holder_of(task_id: str) -> str:
+    """Who holds the channel for a running task: the split for a part, the task itself otherwise"""
+    part = part_of(task_id)
+    return part.parent if part is not None else task_id
+
+
+def report_progress(queue: str, index: int, percent: int) -> None:
+    rds.hset(channel_progress(queue), f"p{index}", max(0, min(100, percent)))
+
+
+def window_progress(queue: str) -> int:
+    """Progress of the channel window in percent, merged over its parts, -1 without a window"""
+    raw = {key.decode("utf-8"): value.decode("utf-8") for key, value in rds.hgetall(channel_progress(queue)).items()}
+    if "parts" not in raw:
+        return -1
+    parts = int(raw["parts"])
+    return sum(int(raw.get(f"p{index}", 0)) for index in range(parts)) // parts
+
+
+def unclaim(queue: str, task_id: str) -> None:
+    """Puts the claimed part back at the head of its queue, for a task that could not be sent or started"""
+    part = part_of(task_id)
+    with rds.pipeline() as pipe:
+        if part is not None:
+            pipe.lpush(channel_parts(queue), part.model_dump_json())
+        for key in (RedisTask.split_parts, RedisTask.running_tasks, RedisTask.started_tasks, RedisTask.sent_tasks):
+            pipe.hdel(str(key.value), task_id)
+        pipe.execute()
+
+
+def mark_sent(task_id: str, now: datetime) -> None:
+    rds.hset(str(RedisTask.sent_tasks.value), task_id, now.timestamp())
+
+
+def _timestamps(key: RedisTask) -> dict[str, datetime]:
+    return {tid.decode("utf-8"): datetime.fromtimestamp(float(ts), tz=timezone.utc) for tid, ts in rds.hgetall(str(key.value)).items()}
+
+
+def started_tasks() -> dict[str, datetime]:
+    """task id -> start time of the parse tasks a worker picked up"""
+    return _timestamps(RedisTask.started_tasks)
+
+
+def sent_tasks() -> dict[str, datetime]:
+    """task id -> send time, a sent task that has not started waits in the broker"""
+    return _timestamps(RedisTask.sent_tasks)
+
+
+def release(task_id: str, queue: str | None = None) -> None:
+    """The task ended: its slot is freed and its part counted as done"""
+    if queue is None:
+        raw = rds.hget(str(RedisTask.running_tasks.value), task_id)
+        if raw is None:
+            return
+        queue = raw.decode("utf-8")
+    _release(
+        keys=[
+            channel_lease(queue),
+            str(RedisTask.running_tasks.value),
+            str(RedisTask.split_parts.value),
+            channel_progress(queue),
+            str(RedisTask.started_tasks.value),
+            str(RedisTask.sent_tasks.value),
+        ],
+        args=[task_id],
+    )
+
+
+def enqueue_window(source: Source, channel_name: str, dt_from: datetime, dt_to: datetime, *, incremental: bool = False) -> str:
+    """Queues a window of the channel, an incremental one is crawled since the high water mark only and goes first"""
+    queue = channel_queue(source, channel_name)
+    with rds.pipeline() as pipe:
+        pipe.sadd(str(RedisTask.channel_tasks.value), queue)
+        pipe.rpush(channel_incremental(queue) if incremental else queue, str(dt_from), str(dt_to))
+        pipe.execute()
+    return queue
+
+
+def request_refresh(source: Source, channel_name: str) -> str:
+    """Refresh now: an incremental window from the head of the channel, dispatched as interactive"""
+    queue = channel_queue(source, channel_name)
+    with rds.pipeline() as pipe:
+        pipe.sadd(str(RedisTask.channel_tasks.value), queue)
+        pipe.lpush(channel_incremental(queue), str(END_OF_EPOCH), str(START_OF_EPOCH))
+        pipe.sadd(str(RedisTask.refresh_requests.value), queue)
+        pipe.execute()
+    return queue
+
+
+def set_priority(source: Source, channel_name: str, priority: Priority) -> None:
+    rds.hset(str(RedisTask.channel_priority.value), channel_queue(source, channel_name), priority.value)
+
+
+def get_priority(source: Source, channel_name: str) -> Priority:
+    raw = rds.hget(str(RedisTask.channel_priority.value), channel_queue(source, channel_name))
+    return Priority(raw.decode("utf-8")) if raw is not None else Priority.NORMAL
+
+
+def load_channel_states(queues: list[str], now: datetime) -> list[ChannelState]:
+    """Scheduling state of the queued channels, a refresh request makes a channel interactive until it is started"""
+    with rds.pipeline(transaction=False) as pipe:
+        pipe.hmget(str(RedisTask.channel_priority.value), queues)
+        pipe.hmget(str(RedisTask.channel_deficit.value), queues)
+        pipe.hmget(str(RedisTask.channel_waiting_since.value), queues)
+        pipe.smembers(str(RedisTask.refresh_requests.value))
+        priorities, deficits, waiting, refresh = pipe.execute()
+    refresh = {queue.decode("utf-8") for queue in refresh}
+    states: list[ChannelState] = []
+    for queue, priority, deficit, waiting_since in zip(queues, priorities, deficits, waiting, strict=True):
+        source = source_of(queue)
+        states.append(
+            ChannelState(
+                queue=queue,
+                priority=Priority.INTERACTIVE if queue in refresh else Priority(priority.decode("utf-8")) if priority else Priority.NORMAL,
+                weight=settings.SCHEDULER_SOURCE_WEIGHTS.get(source.value, 1.0) if source is not None else 1.0,
+                deficit=float(deficit) if deficit else 0.0,
+                waiting_since=datetime.fromtimestamp(float(waiting_since), tz=timezone.utc) if waiting_since else now,
+            )
+        )
+    return states
+
+
+def save_channel_states(states: list[ChannelState], started: set[str]) -> None:
+    if not states:
+        return
+    with rds.pipeline(transaction=False) as pipe:
+        pipe.hset(str(RedisTask.channel_deficit.value), mapping={state.queue: state.deficit for state in states})
+        pipe.hset(str(RedisTask.channel_waiting_since.value), mapping={state.queue: state.waiting_since.timestamp() for state in states})
+        if started:
+            pipe.srem(str(RedisTask.refresh_requests.value), *started)
+        pipe.execute()
+
+
+def lease_holder(queue: str) -> str | None:
+    raw = rds.get(channel_lease(queue))
+    return raw.decode("utf-8") if raw is not None else None
+
+
+def renew_lease(queue: str, task_id: str, holder: str, *, started_at: datetime | None = None) -> int:
+    """1 when renewed, 0 when the task was released meanwhile, -1 when the channel is leased to another window"""
+    return int(
+        _renew_lease(
+            keys=[channel_lease(queue), str(RedisTask.running_tasks.value), str(RedisTask.started_tasks.value)],
+            args=[holder, settings.DISPATCH_LEASE_TTL, task_id, started_at.timestamp() if started_at is not None else ""],
+        )
+    )
+
+
+def hold_lease(queue: str, task_id: str) -> int:
+    """Keeps the channel of a task waiting in the broker, its lease is renewed by the task itself once it starts"""
+    return renew_lease(queue, task_id, lease_holder_of(task_id))
+
+
+@contextmanager
+def keep_lease(queue: str, task_id: str, now: datetime) -> Iterator[threading.Event]:
+    """
+    Holds the channel lease while the task runs, renewed every third of its ttl: an expired lease frees the channel of a dead worker.
+    A task whose channel went to another window is put back and not started, the event is set when the lease is lost midway
+    """
+    holder = lease_holder_of(task_id)
+    match renew_lease(queue, task_id, holder, started_at=now):
+        case 0:
+            raise LeaseLost(f"{task_id} was released before it started")
+        case -1:
+            unclaim(queue, task_id)
+            raise LeaseLost(f"{queue} is leased to another window, {task_id} is queued again")
+    lost = threading.Event()
+    stopped = threading.Event()
+
+    def renew() -> None:
+        while not stopped.wait(settings.DISPATCH_LEASE_TTL / 3):
+            try:
+                if renew_lease(queue, task_id, holder) != 1:
+                    logger.warning(f"lease of {queue} is lost by {task_id}")
+                    lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"lease of {queue} :: renew failed: {e!s}")
+
+    renewer = threading.Thread(target=renew, name=f"lease-{queue}", daemon=True)
+    renewer.start()
+    try:
+        yield lost
+    finally:
+        stopped.set()
+        renewer.join()
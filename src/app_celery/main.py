@@ -5,7 +5,25 @@ app = Celery("main", broker="redis://localhost:6379/0", backend="redis://localho
 app.conf.beat_schedule = {}
 app.conf.timezone = "UTC"
 
-app.autodiscover_tasks(["src.app_celery.worker_of_parsing", "src.app_celery.worker_of_download", "src.app_celery.worker_of_transcript", "src.app_celery.manager"])
+app.autodiscover_tasks([
+    "src.app_celery.worker_of_parsing",
+    "src.app_celery.worker_of_download",
+    "src.app_celery.worker_of_transcript",
+    "src.app_celery.manager",
+])
+
+# refresh requests skip the backfills waiting in fetch
+INTERACTIVE_FETCH_QUEUE = "fetch_interactive"
+# ingestion stages, each queue gets its own worker pool: celery worker -Q <queue> -c <concurrency>
+app.conf.task_routes = {
+    "src.app_celery.worker_of_parsing.parse_api": {"queue": "fetch"},
+    "src.app_celery.worker_of_parsing.persist_posts": {"queue": "persist"},
+    "src.app_celery.worker_of_parsing.archive_posts": {"queue": "archive"},
+    "src.app_celery.worker_of_parsing.summarize_posts": {"queue": "summarize"},
+    "src.app_celery.worker_of_parsing.embed_posts": {"queue": "embed"},
+    # one process is enough, the downloads run side by side in its event loop
+    "src.app_celery.worker_of_download.download_media": {"queue": "download"},
+}
 
 app.conf.beat_schedule = {
     "run-manager-every-minute": {
@@ -1,99 +1,138 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from celery.result import AsyncResult
-from redis import Redis
+from celery.signals import task_failure, task_revoked, task_success
+from celery.utils import uuid
 
-from src.app_celery.main import app
+from src.app_celery import autoscaler, dispatcher_state
+from src.app_celery.main import INTERACTIVE_FETCH_QUEUE, app
+from src.app_celery.scheduler import DeficitRoundRobin, Priority
 from src.app_celery.worker_of_parsing import parse_api
-from src.dto.feed_rec_info import Source, Task
+from src.common.moment import utcnow
+from src.dto.feed_rec_info import Task
 from src.dto.redis_models import RedisTask
+from src.env import settings
 
-rds = Redis()
-rds.set(str(RedisTask.counter_of_workers.value), 3)
-
-running_tasks = {}
-running_channels = {}
+# the dashboard owns the value, workers only set the default
+dispatcher_state.rds.setnx(str(RedisTask.counter_of_workers.value), dispatcher_state.DEFAULT_COUNTER_OF_WORKERS)
 
 logger = logging.getLogger(__name__)
 
 
-class InvalidTelegramTask(Exception):
-    pass
-
-
-def serialize_channel_task(task_name: str) -> Task | None:
-    try:
-        tsk = rds.lrange(task_name, 0, 1)
-        if len(tsk) < 2:
-            return None
-        source, channel_name = task_name.split("$", maxsplit=1)
-        match source:
-            case "TELEGRAM":
-                source_S = Source.TELEGRAM
-            case _:
-                source_S = Source.TELEGRAM
-        tg_task = Task(
-            source=source_S,
-            channel_name=channel_name,
-            dt_from=datetime.fromisoformat(tsk[0].decode("utf-8")),
-            dt_to=datetime.fromisoformat(tsk[1].decode("utf-8")),
+def _claim_next(queue: str, *, extra_slots: int) -> tuple[dispatcher_state.Claim, str, Task | None]:
+    """
+    Waiting parts of a split window go first, a window wider than DISPATCH_SPLIT_SPAN_DAYS is split into parts,
+    incremental windows stop at the high water mark and are never split
+    """
+    # claimed before the task is sent, so a fast task can't finish before it is tracked
+    task_id = uuid()
+    claim, tsk = dispatcher_state.claim_part(queue, task_id, extra_slots=extra_slots)
+    if claim is not dispatcher_state.Claim.SKIPPED:
+        return claim, task_id, tsk
+    claim, tsk = dispatcher_state.claim_window(queue, task_id, extra_slots=extra_slots)
+    if tsk is None:
+        return claim, task_id, tsk
+    windows = (
+        [(tsk.dt_from, tsk.dt_to)]
+        if tsk.incremental
+        else dispatcher_state.split_window(
+            tsk.dt_from,
+            tsk.dt_to,
+            now=utcnow(),
+            span=timedelta(days=settings.DISPATCH_SPLIT_SPAN_DAYS),
+            max_parts=settings.DISPATCH_SPLIT_MAX_PARTS,
         )
-        rds.lrem(task_name, 1, tsk[1])
-        rds.lrem(task_name, 1, tsk[0])
-        return tg_task
-    except InvalidTelegramTask:
-        logger.warning("Invalid Task parameters")
+    )
+    if len(windows) == 1:
+        dispatcher_state.start_window(queue, task_id, tsk)
+        return claim, task_id, tsk
+    dispatcher_state.start_split(queue, task_id, tsk, windows)
+    return _claim_next(queue, extra_slots=extra_slots)
+
+
+def dispatch() -> int:
+    """
+    Starts the next queued windows and parts while there are free slots, returns how many were started.
+    Channels are served by priority class, then by deficit round robin on their source weights, see scheduler.
+    Refresh requests may use SCHEDULER_INTERACTIVE_SLOTS past counter_of_workers and go to their own fetch queue.
+    Every claim is one atomic script, so any number of dispatchers can run at once
+    """
+    now = utcnow()
+    states = dispatcher_state.load_channel_states(dispatcher_state.queued_channels(), now)
+    drr = DeficitRoundRobin(states, now=now, aging_seconds=settings.SCHEDULER_AGING_SECONDS)
+    started: set[str] = set()
+    count = 0
+    while (state := drr.pick()) is not None:
+        interactive = state.priority is Priority.INTERACTIVE
+        claim, task_id, tsk = _claim_next(state.queue, extra_slots=settings.SCHEDULER_INTERACTIVE_SLOTS if interactive else 0)
+        if claim is dispatcher_state.Claim.NO_SLOTS:
+            break
+        if tsk is None:
+            drr.drop(state.queue)
+            continue
+        try:
+            parse_api.apply_async((tsk.channel_name, tsk.model_dump_json()), task_id=task_id, queue=INTERACTIVE_FETCH_QUEUE if interactive else None)
+        except Exception:
+            dispatcher_state.unclaim(state.queue, task_id)
+            raise
+        dispatcher_state.mark_sent(task_id, now)
+        drr.served(state.queue)
+        started.add(state.queue)
+        count += 1
+        logger.debug(f"Running new task: {task_id} :: {state.queue} {tsk.dt_from}..{tsk.dt_to} ({state.priority.value})")
+    dispatcher_state.save_channel_states(states, started)
+    return count
+
+
+def _on_parse_finished(task_id: str | None) -> None:
+    if task_id is None:
+        return
+    dispatcher_state.release(task_id)
+    logger.debug(f"task finished {task_id}")
+    dispatch()
 
 
-def running_new_task_worker(tsk: Task):
-    global running_tasks, running_channels
+@task_success.connect(sender=parse_api)
+def on_parse_success(sender: object = None, **kwargs: object) -> None:
+    _on_parse_finished(getattr(getattr(sender, "request", None), "id", None))
 
-    result = parse_api.delay(tsk.channel_name, tsk.model_dump_json())
-    running_tasks[result.id] = result
-    running_channels[result.id] = tsk.channel_name
 
-    return result
+@task_failure.connect(sender=parse_api)
+def on_parse_failure(sender: object = None, task_id: str | None = None, **kwargs: object) -> None:
+    _on_parse_finished(task_id)
 
 
-@app.task
-def manager_task():
-    global running_tasks, running_channels
+@task_revoked.connect(sender=parse_api)
+def on_parse_revoked(sender: object = None, request: object = None, **kwargs: object) -> None:
+    _on_parse_finished(getattr(request, "id", None))
 
-    logger.debug(f"[{datetime.now()}] Manager is running")
-    cow_redis = rds.get(str(RedisTask.counter_of_workers.value))
-    if isinstance(cow_redis.decode("utf-8"), str):
-        cow = int(cow_redis.decode("utf-8"))
-    else:
-        cow = 3
-    byte_tasks = rds.smembers(str(RedisTask.channel_tasks.value))
-    if not byte_tasks:
-        logger.debug(f"[{datetime.now()}] tasks finished")
-        return
-    tasks = [task.decode("utf-8") for task in byte_tasks]
 
-    finished = [tid for tid, r in running_tasks.items() if AsyncResult(tid).ready()]
-
-    for tid in finished:
-        logger.debug(f"task finished {tid}")
-        running_tasks.pop(tid)
-        task_name = running_channels.pop(tid)
-        tsk = serialize_channel_task(task_name)
-        if not tsk:
-            continue
-        result = running_new_task_worker(tsk)
-        logger.debug(f"Running new task: {result.id} :: {tsk.channel_name}")
-
-    for i in range(cow - len(running_tasks.items())):
-        for item in running_channels.items():
-            if str(item) not in tasks:
-                continue
-            tasks.remove(str(item))
-        if not tasks:
-            return
-        task = tasks.pop()
-        tsk = serialize_channel_task(task)
-        if not tsk:
-            continue
-        result = running_new_task_worker(tsk)
-        logger.debug(f"Running new task: {result.id} :: {task}")
+@app.task
+def manager_task() -> None:
+    """
+    Safety sweep on the beat, windows are started by the task signals as soon as a slot frees up:
+    forgets started tasks whose signal was lost or whose lease expired (killed worker), keeps the channels
+    of the tasks waiting in the broker, rescales the count of workers and fills the free slots
+    """
+    logger.debug(f"[{datetime.now()}] Manager is running")
+    now = utcnow()
+    started = dispatcher_state.started_tasks()
+    sent = dispatcher_state.sent_tasks()
+    for tid, queue in dispatcher_state.running_tasks().items():
+        if AsyncResult(tid).ready():
+            logger.debug(f"task finished without signal {tid}")
+            dispatcher_state.release(tid, queue)
+        elif tid in started:
+            if dispatcher_state.lease_holder(queue) != dispatcher_state.lease_holder_of(tid):
+                logger.debug(f"task lost its lease {tid}")
+                dispatcher_state.release(tid, queue)
+        elif tid in sent and now - sent[tid] > timedelta(seconds=settings.DISPATCH_START_TIMEOUT):
+            logger.warning(f"task did not start within {settings.DISPATCH_START_TIMEOUT}s, its window is queued again {tid}")
+            dispatcher_state.unclaim(queue, tid)
+            app.control.revoke(tid)
+        else:
+            dispatcher_state.hold_lease(queue, tid)
+    if settings.AUTOSCALE_ENABLED:
+        autoscaler.autoscale(now)
+    dispatch()
@@ -0,0 +1,105 @@
+import logging
+from typing import Final
+
+from pydantic import BaseModel
+from redis import Redis
+
+from src.dto import redis_models
+from src.dto.feed_rec_info import HighWaterMark, Post, Source
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+rds = Redis()
+
+
+class PostBatchRef(BaseModel):
+    """What the ingestion stages pass each other: the posts themselves wait in redis until the last stage"""
+
+    source: Source
+    channel_name: str
+    post_ids: list[str]
+    # task id of the crawl the posts come from, the staged payloads are the crawl's own:
+    # an overlapping crawl that finds the posts already in the db drops its copies, not these
+    crawl_id: str | None = None
+
+
+def _keys(ref: PostBatchRef, kind: str) -> list[str]:
+    return [redis_models.source_channel_name_post_stage(ref.source, ref.channel_name, post_id, kind, ref.crawl_id) for post_id in ref.post_ids]
+
+
+def _put(ref: PostBatchRef, kind: str, values: list[str]) -> None:
+    with rds.pipeline(transaction=False) as pipe:
+        for key, value in zip(_keys(ref, kind), values, strict=True):
+            pipe.set(key, value, ex=settings.INGEST_STAGE_TTL)
+        pipe.execute()
+
+
+def stage_posts(posts: list[Post], *, crawl_id: str | None = None) -> PostBatchRef:
+    ref = PostBatchRef(source=posts[0].source, channel_name=posts[0].channel_name, post_ids=[post.post_id for post in posts], crawl_id=crawl_id)
+    _put(ref, "post", [post.model_dump_json() for post in posts])
+    if crawl_id is not None:
+        key = redis_models.crawl_batches(crawl_id)
+        with rds.pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, "handed", 1)
+            pipe.expire(key, settings.INGEST_STAGE_TTL)
+            pipe.execute()
+    return ref
+
+
+def _mark_when_persisted(fields: dict[bytes, bytes]) -> HighWaterMark | None:
+    hwm = fields.get(b"hwm")
+    if hwm is None or int(fields.get(b"persisted", 0)) < int(fields.get(b"handed", 0)):
+        return None
+    return HighWaterMark.model_validate_json(hwm)
+
+
+def crawl_completed(crawl_id: str, hwm: HighWaterMark) -> HighWaterMark | None:
+    """
+    Keeps the high water mark of a crawl that got to its end, until all its batches are persisted.
+    Returns it when they already are, otherwise batch_persisted returns it for the last one
+    """
+    key = redis_models.crawl_batches(crawl_id)
+    with rds.pipeline() as pipe:
+        pipe.hset(key, "hwm", hwm.model_dump_json())
+        pipe.expire(key, settings.INGEST_STAGE_TTL)
+        pipe.hgetall(key)
+        *_, fields = pipe.execute()
+    return _mark_when_persisted(fields)
+
+
+def batch_persisted(ref: PostBatchRef) -> HighWaterMark | None:
+    """Counts the batch as committed, returns the high water mark of its crawl once the crawl ended and all its batches are"""
+    if ref.crawl_id is None:
+        return None
+    key = redis_models.crawl_batches(ref.crawl_id)
+    with rds.pipeline() as pipe:
+        pipe.hincrby(key, "persisted", 1)
+        pipe.hgetall(key)
+        _, fields = pipe.execute()
+    return _mark_when_persisted(fields)
+
+
+def load_posts(ref: PostBatchRef) -> list[Post]:
+    """Staged posts of the batch, the expired ones are left out"""
+    posts = [Post.model_validate_json(raw) for raw in rds.mget(_keys(ref, "post")) if raw is not None]
+    if len(posts) < len(ref.post_ids):
+        logger.warning(f"load_posts({ref.channel_name}) :: {len(ref.post_ids) - len(posts)} of {len(ref.post_ids)} staged posts expired")
+    return posts
+
+
+def stage_summaries(ref: PostBatchRef, summaries: dict[str, str]) -> PostBatchRef:
+    summarized = ref.model_copy(update={"post_ids": list(summaries)})
+    _put(summarized, "summary", list(summaries.values()))
+    return summarized
+
+
+def load_summaries(ref: PostBatchRef) -> dict[str, str]:
+    return {post_id: raw.decode("utf-8") for post_id, raw in zip(ref.post_ids, rds.mget(_keys(ref, "summary")), strict=True) if raw is not None}
+
+
+def drop(ref: PostBatchRef) -> None:
+    """Frees the staged posts and summaries of the batch, once they went through the last stage or were left out"""
+    if not ref.post_ids:
+        return
+    rds.delete(*_keys(ref, "post"), *_keys(ref, "summary"))
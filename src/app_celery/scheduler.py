@@ -0,0 +1,85 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum, unique
+from typing import Final
+
+from src.dto.feed_rec_info import Source
+
+logger: Final = logging.getLogger(__name__)
+
+
+@unique
+class Priority(Enum):
+    INTERACTIVE = "interactive"
+    NORMAL = "normal"
+    BACKFILL = "backfill"
+
+    @property
+    def rank(self) -> int:
+        """0 is served first"""
+        return _RANKS[self]
+
+
+_RANKS: Final = {Priority.INTERACTIVE: 0, Priority.NORMAL: 1, Priority.BACKFILL: 2}
+
+
+@dataclass
+class ChannelState:
+    queue: str
+    priority: Priority
+    weight: float
+    deficit: float
+    waiting_since: datetime
+
+
+def effective_rank(state: ChannelState, now: datetime, aging_seconds: float) -> int:
+    """Waiting lifts a channel one class per aging_seconds, up to normal: only refresh requests are interactive"""
+    if state.priority is Priority.INTERACTIVE:
+        return Priority.INTERACTIVE.rank
+    lifted = int((now - state.waiting_since).total_seconds() // aging_seconds) if aging_seconds > 0 else 0
+    return max(Priority.NORMAL.rank, state.priority.rank - lifted)
+
+
+def source_of(queue: str) -> Source | None:
+    try:
+        return Source(queue.split("$", maxsplit=1)[0])
+    except ValueError:
+        return None
+
+
+class DeficitRoundRobin:
+    """
+    Strict priority between classes, deficit round robin inside a class: every round a channel earns its source weight,
+    a started task costs 1, so a source with weight 2 gets twice the slots of a source with weight 1 under load.
+    """
+
+    def __init__(self, states: list[ChannelState], *, now: datetime, aging_seconds: float) -> None:
+        self.states = {state.queue: state for state in states}
+        self.now = now
+        self.aging_seconds = aging_seconds
+
+    def pick(self) -> ChannelState | None:
+        if not self.states:
+            return None
+        top = min(effective_rank(state, self.now, self.aging_seconds) for state in self.states.values())
+        contenders = [state for state in self.states.values() if effective_rank(state, self.now, self.aging_seconds) == top]
+        ready = [state for state in contenders if state.deficit >= 1]
+        if not ready:
+            # as many rounds as the closest channel needs to afford a task
+            rounds = min((1 - state.deficit) / state.weight for state in contenders)
+            for state in contenders:
+                state.deficit += rounds * state.weight
+            ready = [state for state in contenders if state.deficit >= 1 - 1e-9]
+        return max(ready, key=lambda state: (state.deficit, -state.waiting_since.timestamp()))
+
+    def served(self, queue: str) -> None:
+        state = self.states[queue]
+        state.deficit = max(0.0, state.deficit - 1)
+        state.waiting_since = self.now
+
+    def drop(self, queue: str) -> ChannelState:
+        """The channel has nothing to start, an idle channel keeps no deficit"""
+        state = self.states.pop(queue)
+        state.deficit = 0.0
+        return state
@@ -0,0 +1,77 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+from typing import Final
+
+import httpx
+
+from src.cli_scrapper import scrapy_manager
+from src.dto.feed_rec_info import CrawlEnd, CrawlWindow, Post, Task
+from src.env import ScraperTransport, settings
+from src.parser_app_api.models.request_models.feed_rec_request_info import ParsingParametersApiMdl
+
+logger: Final = logging.getLogger(__name__)
+
+
+class ScraperClient(ABC):
+    @abstractmethod
+    def iter_batches(self, task: Task, window: CrawlWindow, *, log_extra: dict[str, str]) -> AsyncGenerator[list[Post], None]:
+        """Posts of the crawl in batches, newest first, window.completed is set when the crawl got to its end"""
+
+
+class InProcessScraperClient(ScraperClient):
+    """Crawls on the event loop of the worker, posts are handed over as they are parsed"""
+
+    async def iter_batches(self, task: Task, window: CrawlWindow, *, log_extra: dict[str, str]) -> AsyncGenerator[list[Post], None]:
+        batches = scrapy_manager.stream_parsing(ParsingParametersApiMdl.model_validate(task.model_dump()), window=window, log_extra=log_extra)
+        async with aclosing(batches):
+            async for batch in batches:
+                yield batch
+
+
+class RemoteScraperClient(ScraperClient):
+    """Reads the NDJSON stream of the parser api, for workers deployed apart from the scraper"""
+
+    def __init__(self, base_url: str, *, batch_size: int) -> None:
+        self.base_url = base_url
+        self.batch_size = batch_size
+
+    async def iter_batches(self, task: Task, window: CrawlWindow, *, log_extra: dict[str, str]) -> AsyncGenerator[list[Post], None]:
+        async with (
+            httpx.AsyncClient(base_url=self.base_url) as client,
+            client.stream(
+                "POST",
+                "/start_parser",
+                params={"stream": "true"},
+                content=task.model_dump_json(),
+                headers={"Content-Type": "application/json"},
+                timeout=httpx.Timeout(10000, connect=10),
+            ) as response,
+        ):
+            if response.status_code != 200:
+                logger.warning(f"iter_batches({task.channel_name}) :: scraper responded {response.status_code}", extra=log_extra)
+                return
+            batch: list[Post] = []
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "completed" in record:
+                    window.completed = CrawlEnd.model_validate(record).completed
+                    continue
+                batch.append(Post.model_validate(record))
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+
+def get_scraper_client(transport: ScraperTransport | None = None) -> ScraperClient:
+    match transport or settings.SCRAPER_TRANSPORT:
+        case ScraperTransport.IN_PROCESS:
+            return InProcessScraperClient()
+        case ScraperTransport.REMOTE:
+            return RemoteScraperClient(settings.SCRAPER_API_URL, batch_size=settings.STREAM_BATCH_SIZE)
@@ -0,0 +1,46 @@
+from src.app_celery.autoscaler import Signals, decide
+
+LATENCY_MAX = {"summarize": 300.0, "embed": 120.0}
+
+
+def _decide(workers: int, signals: Signals) -> tuple[int, str]:
+    return decide(workers, signals, min_workers=1, max_workers=8, throttle_rate=0.05, latency_max=LATENCY_MAX, decrease=0.5)
+
+
+def _signals(
+    *, backlog: int = 0, running: int = 0, capacity: int | None = 16, latency: dict[str, float] | None = None, throttle: dict[str, float] | None = None
+) -> Signals:
+    return Signals(backlog=backlog, running=running, capacity=capacity, latency=latency or {}, throttle=throttle or {})
+
+
+def test_grows_by_one_while_backlog_waits_on_full_slots() -> None:
+    assert _decide(4, _signals(backlog=10, running=4)) == (5, "backlog: 10 windows")
+    assert _decide(8, _signals(backlog=10, running=8))[0] == 8
+    # free slots left: the backlog is waiting on channel leases, not on workers
+    assert _decide(4, _signals(backlog=10, running=2)) == (4, "hold")
+
+
+def test_halves_when_an_upstream_throttles() -> None:
+    target, reason = _decide(6, _signals(backlog=10, running=6, throttle={"t.me": 0.2, "api.deepseek.com": 0.01}))
+    assert target == 3
+    assert reason == "throttled: t.me 20%"
+    assert _decide(1, _signals(throttle={"t.me": 1.0}))[0] == 1
+
+
+def test_backs_off_when_a_stage_is_slow_and_shrinks_when_idle() -> None:
+    assert _decide(4, _signals(backlog=10, running=4, latency={"summarize": 400.0, "fetch": 3600.0})) == (3, "slow: summarize 400s")
+    assert _decide(4, _signals(running=1)) == (3, "idle")
+    # a value set by hand outside the bounds is brought back into them
+    assert _decide(20, _signals(running=20, backlog=1))[0] == 8
+
+
+def test_claimed_tasks_waiting_in_the_broker_do_not_grow_the_count() -> None:
+    # 4 slots claimed, 1 process crawling: the others wait in the broker, more slots would only grow that queue
+    assert _decide(4, _signals(backlog=10, running=1)) == (4, "hold")
+
+
+def test_never_above_the_worker_capacity() -> None:
+    assert _decide(4, _signals(backlog=10, running=4, capacity=4))[0] == 4
+    assert _decide(6, _signals(backlog=10, running=1, capacity=2)) == (2, "hold")
+    # no worker answered: the count may shrink but not grow
+    assert _decide(4, _signals(backlog=10, running=4, capacity=None))[0] == 4
@@ -0,0 +1,39 @@
+import itertools
+from datetime import datetime, timedelta, timezone
+
+from src.app_celery.dispatcher_state import WindowPart, split_window
+from src.dto.feed_rec_info import Source
+
+
+def _utc(*args: int) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_split_window_cuts_at_month_starts_newest_first() -> None:
+    parts = split_window(datetime(2024, 11, 15), datetime(2025, 2, 10), now=_utc(2025, 6, 1), span=timedelta(days=31), max_parts=48)
+    assert parts == [
+        (_utc(2025, 2, 1), _utc(2025, 2, 10)),
+        (_utc(2025, 1, 1), _utc(2025, 2, 1)),
+        (_utc(2024, 12, 1), _utc(2025, 1, 1)),
+        (_utc(2024, 11, 15), _utc(2024, 12, 1)),
+    ]
+    narrow = split_window(_utc(2025, 1, 1), _utc(2025, 1, 20), now=_utc(2025, 6, 1), span=timedelta(days=31), max_parts=48)
+    assert narrow == [(_utc(2025, 1, 1), _utc(2025, 1, 20))]
+
+
+def test_split_window_bounds_the_parts_of_a_whole_history() -> None:
+    parts = split_window(_utc(2000, 1, 1), _utc(2100, 1, 1), now=_utc(2025, 6, 10), span=timedelta(days=31), max_parts=48)
+    assert len(parts) <= 48
+    # adjacent and covering, nothing is cut in the future
+    assert parts[0][1] == _utc(2100, 1, 1)
+    assert parts[0][0] <= _utc(2025, 6, 10)
+    assert parts[-1][0] == _utc(2000, 1, 1)
+    assert all(newer[0] == older[1] for newer, older in itertools.pairwise(parts))
+
+
+def test_window_part_task() -> None:
+    part = WindowPart(parent="parent", index=2, dt_from=_utc(2025, 1, 1), dt_to=_utc(2025, 2, 1))
+    task = WindowPart.model_validate_json(part.model_dump_json()).task(f"{Source.TELEGRAM.value}$some$channel")
+    assert task.source is Source.TELEGRAM
+    assert task.channel_name == "some$channel"
+    assert (task.dt_from, task.dt_to) == (part.dt_from, part.dt_to)
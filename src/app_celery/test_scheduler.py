@@ -0,0 +1,59 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from src.app_celery.scheduler import ChannelState, DeficitRoundRobin, Priority, effective_rank
+from src.env import AppName, Settings
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+def _state(queue: str, *, priority: Priority = Priority.NORMAL, weight: float = 1.0, waiting: float = 0.0) -> ChannelState:
+    return ChannelState(queue=queue, priority=priority, weight=weight, deficit=0.0, waiting_since=NOW - timedelta(seconds=waiting))
+
+
+def _serve(drr: DeficitRoundRobin, n: int) -> list[str]:
+    picked = []
+    for _ in range(n):
+        state = drr.pick()
+        assert state is not None
+        drr.served(state.queue)
+        picked.append(state.queue)
+    return picked
+
+
+def test_weights_share_slots_in_proportion() -> None:
+    drr = DeficitRoundRobin([_state("youtube$a", weight=2.0), _state("telegram$b", weight=1.0)], now=NOW, aging_seconds=600)
+    assert Counter(_serve(drr, 30)) == {"youtube$a": 20, "telegram$b": 10}
+
+
+def test_higher_class_goes_first_until_dropped() -> None:
+    drr = DeficitRoundRobin(
+        [_state("telegram$backfill", priority=Priority.BACKFILL), _state("telegram$normal"), _state("telegram$refresh", priority=Priority.INTERACTIVE)],
+        now=NOW,
+        aging_seconds=600,
+    )
+    assert _serve(drr, 2) == ["telegram$refresh", "telegram$refresh"]
+    drr.drop("telegram$refresh")
+    assert _serve(drr, 2) == ["telegram$normal", "telegram$normal"]
+    drr.drop("telegram$normal")
+    assert _serve(drr, 1) == ["telegram$backfill"]
+    drr.drop("telegram$backfill")
+    assert drr.pick() is None
+
+
+def test_aging_lifts_backfill_up_to_normal_only() -> None:
+    assert effective_rank(_state("q", priority=Priority.BACKFILL, waiting=599), NOW, 600) == Priority.BACKFILL.rank
+    assert effective_rank(_state("q", priority=Priority.BACKFILL, waiting=600), NOW, 600) == Priority.NORMAL.rank
+    assert effective_rank(_state("q", priority=Priority.BACKFILL, waiting=6000), NOW, 600) == Priority.NORMAL.rank
+    assert effective_rank(_state("q", priority=Priority.NORMAL, waiting=6000), NOW, 600) == Priority.NORMAL.rank
+
+    drr = DeficitRoundRobin([_state("telegram$old", priority=Priority.BACKFILL, waiting=1200), _state("telegram$new")], now=NOW, aging_seconds=600)
+    assert set(_serve(drr, 2)) == {"telegram$old", "telegram$new"}
+
+
+def test_source_weights_must_be_positive() -> None:
+    with pytest.raises(ValidationError):
+        Settings(app=AppName.app_celery, SCHEDULER_SOURCE_WEIGHTS={"telegram": 1.0, "youtube": 0.0})
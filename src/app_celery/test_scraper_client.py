@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+import pytest
+from aiohttp import web
+from pydantic import HttpUrl
+
+from src.app_celery.scraper_client import RemoteScraperClient
+from src.dto.feed_rec_info import CrawlEnd, CrawlWindow, Post, Source, Task
+
+
+def _post(post_id: int) -> Post:
+    return Post(
+        source=Source.TELEGRAM,
+        channel_name="channel",
+        post_id=str(post_id),
+        title=None,
+        description=None,
+        content=f"post {post_id}",
+        pb_date=datetime(2025, 1, 1, tzinfo=timezone.utc),
+        link=HttpUrl(f"https://t.me/channel/{post_id}"),
+        media=None,
+    )
+
+
+@pytest.mark.parametrize("cut_short", [False, True])
+async def test_remote_scraper_client_reads_ndjson_stream(cut_short: bool) -> None:
+    posts = [_post(post_id) for post_id in range(7, 0, -1)]
+    requests: list[Task] = []
+
+    async def start_parser(request: web.Request) -> web.StreamResponse:
+        assert request.query["stream"] == "true"
+        requests.append(Task.model_validate_json(await request.read()))
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for post in posts:
+            await response.write(f"{post.model_dump_json()}\n".encode())
+        if not cut_short:
+            await response.write(f"{CrawlEnd(completed=True).model_dump_json()}\n".encode())
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/start_parser", start_parser)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        host, port = runner.addresses[0][:2]
+        task = Task(
+            source=Source.TELEGRAM, channel_name="channel", dt_to=datetime(2025, 2, 1, tzinfo=timezone.utc), dt_from=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+        window = CrawlWindow(dt_to=task.dt_to, dt_from=task.dt_from)
+        client = RemoteScraperClient(f"http://{host}:{port}", batch_size=3)
+        batches = [batch async for batch in client.iter_batches(task, window, log_extra={})]
+    finally:
+        await runner.cleanup()
+    assert requests == [task]
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [post for batch in batches for post in batch] == posts
+    # a stream without its end line was cut short
+    assert window.completed is not cut_short
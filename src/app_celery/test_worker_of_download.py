@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from pydantic import HttpUrl
+
+from src.app_celery import worker_of_download
+from src.app_celery.worker_of_download import TmpListTgPost, media_path, record_downloads
+from src.dto.feed_rec_info import MediaFormat, MediaResolution, Post, RawPostMedia, RawPostMediaExt, Source
+
+
+def _post(post_id: str) -> Post:
+    url = HttpUrl(f"https://media.example/{post_id}")
+    preview = RawPostMedia(url=url, resolution=MediaResolution.AUDIO_ONLY, audio_ext=MediaFormat.WEBM, downloaded_file=None)
+    return Post(
+        source=Source.YOUTUBE,
+        channel_name="channel",
+        post_id=post_id,
+        title=None,
+        description=None,
+        content=None,
+        pb_date=datetime(2025, 3, 1, tzinfo=timezone.utc),
+        link=HttpUrl(f"https://www.youtube.com/watch?v={post_id}"),
+        media=RawPostMediaExt(preview=preview, transcription=[]),
+    )
+
+
+def test_downloads_are_recorded_in_the_month_json(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(worker_of_download, "SCRAPPER_RESULTS_DIR", tmp_path)
+    year_dir = tmp_path / "youtube" / "channel" / "2025"
+    year_dir.mkdir(parents=True)
+    month_file = year_dir / "channel__3.json"
+    month_file.write_text(TmpListTgPost(posts=[_post("a"), _post("b")]).model_dump_json(indent=4))
+
+    downloaded = _post("a")
+    dst = media_path(downloaded, downloaded.media.preview)
+    # next to the month json files the archive stage writes
+    assert dst.parent == year_dir / "media"
+    preview = downloaded.media.preview.model_copy(update={"downloaded_file": dst})
+    record_downloads([downloaded.model_copy(update={"media": downloaded.media.model_copy(update={"preview": preview})}), _post("b")])
+
+    files = {post.post_id: post.media.preview.downloaded_file for post in TmpListTgPost.model_validate_json(month_file.read_text()).posts}
+    assert files == {"a": dst, "b": None}
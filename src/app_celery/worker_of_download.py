@@ -1,159 +1,110 @@
-import json
+import asyncio
 import logging
-from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Final
 
-import httpx
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel
+from redis import Redis
 
-from src.app_api.dependencies import get_db_main_for_celery
 from src.app_celery.main import app
 from src.common.async_utils import run_on_loop
-from src.db_main.cruds import post_crud
-from src.db_main.models.post import PostDbMdl
-from src.dto.feed_rec_info import Post, Source
-from src.env import SCRAPPER_RESULTS_DIR
-from src.service_chat_bot import manager_chat
+from src.common.http_utils import get_http_session
+from src.common.range_download import DownloadError, RangeDownloader
+from src.dto import redis_models
+from src.dto.feed_rec_info import Post, RawPostMedia
+from src.env import SCRAPPER_RESULTS_DIR, settings
 
-logger = logging.getLogger(__name__)
+logger: Final = logging.getLogger(__name__)
 
-
-class InvalidDataException(Exception):
-    pass
+rds = Redis()
 
 
 class TmpListTgPost(BaseModel):
     posts: list[Post]
 
 
-def posts_dbmdl_to_posts(all_posts: list[Post], posts_dbmdl: list[PostDbMdl]) -> list[Post]:
-    posts: list[Post] = []
-    ids_posts_dbmdl = [post_dbmdl.post_id for post_dbmdl in posts_dbmdl]
-    for post in all_posts:
-        if post.post_id in ids_posts_dbmdl:
-            posts.append(post)
-    return posts
-
-
-def parse_data(source: Source, channel_name: str, posts: list[dict[str, str]]) -> list[Post]:
-    tg_posts: list[Post] = []
-    try:
-        for post in posts:
-            tg_posts.append(
-                Post(
-                    source=source,
-                    channel_name=post["channel_name"],
-                    post_id=post["post_id"],
-                    content=post["content"],
-                    pb_date=datetime.fromisoformat(post["pb_date"]),
-                    link=HttpUrl(post["link"]),
-                    # media=post["media"],
-                    media=None,
-                )
-            )
-    except InvalidDataException as e:
-        logger.warning(f"CELERY WORKER :: invalid response data for channel -- {channel_name} -- {e}")
-    return tg_posts
-
-
-def heapify(arr: list[Post], n: int, i: int):
-    largest = i  # Initialize largest as root
-    l = 2 * i + 1  # left = 2*i + 1
-    r = 2 * i + 2  # right = 2*i + 2
-
-    # Проверяем существует ли левый дочерний элемент больший, чем корень
-
-    if l < n and arr[i].pb_date < arr[l].pb_date:
-        largest = l
-
-    # Проверяем существует ли правый дочерний элемент больший, чем корень
-
-    if r < n and arr[largest].pb_date < arr[r].pb_date:
-        largest = r
-
-    # Заменяем корень, если нужно
-    if largest != i:
-        arr[i], arr[largest] = arr[largest], arr[i]  # свап
-
-        # Применяем heapify к корню.
-        heapify(arr, n, largest)
-
-
-def heap_sort(arr: list[Post]):
-    n = len(arr)
-
-    # Построение max-heap.
-    for i in range(n, -1, -1):
-        heapify(arr, n, i)
-
-    # Один за другим извлекаем элементы
-    for i in range(n - 1, 0, -1):
-        arr[i], arr[0] = arr[0], arr[i]
-        heapify(arr, i, 0)
-
-
-def _save_to_file_and_to_qdrant(tmp_post: Post, month_posts: list[Post]):
-    tmp = ""
-
-    scrapper_path: Path = SCRAPPER_RESULTS_DIR / tmp_post.channel_name / f"{tmp_post.pb_date.year}"
-    scrapper_path_file: Path = scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json"
-    parse_text_parse = month_posts
-    if (scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").exists():
-        text = json.load((scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").open())
-        text_posts = text["posts"]
-        if not isinstance(text_posts, list):
-            return
-        parse_text_posts = parse_data(tmp_post.source, tmp_post.channel_name, text_posts)
-        ids_text_posts = [post.post_id for post in parse_text_posts]
-        for post in month_posts:
-            if post.post_id not in ids_text_posts:
-                parse_text_posts.append(post)
-        tmp = "TMP"
-        heap_sort(parse_text_posts)
-
-    scrapper_path.mkdir(parents=True, exist_ok=True)
-    (scrapper_path / f"{tmp}{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").write_text(TmpListTgPost(posts=parse_text_parse).model_dump_json(indent=4))
-    if tmp == "TMP":
-        (scrapper_path / f"{tmp}{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").rename(
-            scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json"
-        )
-    manager_chat.add_post_to_qdrant(scrapper_path_file)
-
-
-def save_post(posts: list[Post]) -> None:
-    tmp_posts: list[Post] = []
+def _year_dir(post: Post) -> Path:
+    """<source>/<channel>/<year>, where the archive stage keeps the month json files"""
+    return SCRAPPER_RESULTS_DIR / post.source.value / post.channel_name / f"{post.pb_date.year}"
+
+
+def media_path(post: Post, media: RawPostMedia) -> Path:
+    """<source>/<channel>/<year>/media/<channel>__<month>__<post id>.<ext>, next to the month json files, unless the post names its own file"""
+    if isinstance(media.downloaded_file, Path):
+        return media.downloaded_file
+    file_name = f"{post.channel_name}__{post.pb_date.month}__{post.post_id}.{media.audio_ext.value}"
+    return _year_dir(post) / "media" / file_name
+
+
+def record_downloads(posts: list[Post]) -> None:
+    """Sets downloaded_file of the downloaded posts in their month json files, the archive stage wrote them before the download"""
+    downloaded: dict[Path, dict[str, Path]] = {}
     for post in posts:
-        try:
-            tmp_post = tmp_posts[-1]
-        except IndexError:
-            tmp_posts.append(post)
+        if post.media is not None and post.media.preview is not None and isinstance(post.media.preview.downloaded_file, Path):
+            month_file = _year_dir(post) / f"{post.channel_name}__{post.pb_date.month}.json"
+            downloaded.setdefault(month_file, {})[post.post_id] = post.media.preview.downloaded_file
+    for month_file, files in downloaded.items():
+        if not month_file.exists():
+            logger.warning(f"record_downloads :: {month_file} is missing, {len(files)} downloads not recorded")
             continue
-        if tmp_post.pb_date.month == post.pb_date.month:
-            tmp_posts.append(post)
-            continue
-        # save
-        _save_to_file_and_to_qdrant(tmp_post, tmp_posts)
-        tmp_posts.clear()
-        tmp_posts.append(post)
-    try:
-        _save_to_file_and_to_qdrant(tmp_posts[-1], tmp_posts)
-    except IndexError:
-        pass
-
-
-@app.task(bind=True)
-def download_content(self, file_name: str, task: dict[str, Any]) -> None:
-    # file_name = f"{src}" / f"{channel_name}" / f"{year}" / media /f"{channel_name}__{month}__{post_id}"
-    with httpx.Client() as client:
-        response = client.post("http://localhost:50001/start_parser", data=task, timeout=10000)
-        logger.debug(response.status_code)
-        if response.status_code != 200:
-            return
-    text = response.json()
-    if not isinstance(text, list):
-        return
-    posts = parse_data(Source.TELEGRAM, channel_name, text)  # ошибка тут
-    db = run_on_loop(get_db_main_for_celery())
-    unique_posts = run_on_loop(post_crud.create_posts(db, posts))
-    save_post(posts_dbmdl_to_posts(posts, unique_posts))
+        month = TmpListTgPost.model_validate_json(month_file.read_text())
+        for i, post in enumerate(month.posts):
+            if post.post_id in files and post.media is not None and post.media.preview is not None:
+                preview = post.media.preview.model_copy(update={"downloaded_file": files[post.post_id]})
+                month.posts[i] = post.model_copy(update={"media": post.media.model_copy(update={"preview": preview})})
+        tmp_file = month_file.with_name(f"TMP{month_file.name}")
+        tmp_file.write_text(month.model_dump_json(indent=4))
+        tmp_file.rename(month_file)
+
+
+def _report(post: Post, **fields: str | int) -> None:
+    key = redis_models.source_channel_name_post_download(post.source, post.channel_name, post.post_id)
+    with rds.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, settings.MEDIA_DOWNLOAD_PROGRESS_TTL)
+        pipe.execute()
+
+
+async def _download_post(downloader: RangeDownloader, files: asyncio.Semaphore, post: Post) -> Post:
+    media = post.media.preview if post.media is not None else None
+    if media is None:
+        return post
+    dst = media_path(post, media)
+    async with files:
+        _report(post, status="running", path=str(dst))
+        try:
+            size = await downloader.download(str(media.url), dst, on_progress=lambda done, total: _report(post, done=done, total=total))
+        except (DownloadError, OSError) as e:
+            logger.warning(f"download_media({post.channel_name}/{post.post_id}) :: {e!s}")
+            _report(post, status="failed", error=str(e))
+            return post
+    _report(post, status="done", done=size, total=size)
+    preview = media.model_copy(update={"downloaded_file": dst})
+    return post.model_copy(update={"media": post.media.model_copy(update={"preview": preview})})
+
+
+async def _download_posts(posts: list[Post]) -> list[Post]:
+    downloader = RangeDownloader(
+        get_http_session(),
+        chunk_size=settings.MEDIA_DOWNLOAD_CHUNK_MB * 2**20,
+        chunks_per_file=settings.MEDIA_DOWNLOAD_CHUNKS_PER_FILE,
+        connections=settings.MEDIA_DOWNLOAD_CONNECTIONS,
+        bytes_per_second=settings.MEDIA_DOWNLOAD_MAX_MB_PER_SECOND * 2**20,
+        max_retries=settings.HTTP_MAX_RETRIES,
+    )
+    files = asyncio.Semaphore(settings.MEDIA_DOWNLOAD_FILES)
+    return list(await asyncio.gather(*(_download_post(downloader, files, post) for post in posts)))
+
+
+@app.task
+def download_media(posts: str) -> str:
+    """
+    Download stage: the audio of the posts goes to disk in parallel range chunks, see RangeDownloader.
+    The caps hold per worker process, the download queue runs with -c 1 and all the parallelism is in its event loop.
+    Files already on disk are skipped, the .part of a failed one is resumed by the next run.
+    Progress is kept in redis per post, the files that made it are recorded as downloaded_file in the month json files
+    """
+    batch = TmpListTgPost.model_validate_json(posts)
+    downloaded = run_on_loop(_download_posts(batch.posts))
+    record_downloads(downloaded)
+    return TmpListTgPost(posts=downloaded).model_dump_json()
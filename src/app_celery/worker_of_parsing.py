@@ -1,19 +1,26 @@
 import json
 import logging
+from collections.abc import AsyncGenerator, Callable
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 
-import httpx
 from pydantic import BaseModel, HttpUrl
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.app_api.dependencies import get_db_main_for_celery
+from src.app_celery import dispatcher_state, post_stage
 from src.app_celery.main import app
+from src.app_celery.post_stage import PostBatchRef
+from src.app_celery.scraper_client import get_scraper_client
+from src.app_celery.worker_of_download import download_media
+from src.cli_scrapper import high_water_mark
 from src.common.async_utils import run_on_loop
-from src.db_main.cruds import post_crud
+from src.common.moment import as_utc, utcnow
+from src.db_main.cruds import channel_crud, post_crud
 from src.db_main.models.post import PostDbMdl
-from src.dto.feed_rec_info import Post, Source
-from src.env import SCRAPPER_RESULTS_DIR
+from src.dto.feed_rec_info import CrawlWindow, HighWaterMark, Post, Source, Task
+from src.env import SCRAPPER_RESULTS_DIR, settings
 from src.service_chat_bot import manager_chat
 
 logger = logging.getLogger(__name__)
@@ -93,11 +100,10 @@ def heap_sort(arr: list[Post]):
         heapify(arr, i, 0)
 
 
-def _save_to_file_and_to_qdrant(tmp_post: Post, month_posts: list[Post]):
+def _save_to_file(tmp_post: Post, month_posts: list[Post]):
     tmp = ""
 
     scrapper_path: Path = SCRAPPER_RESULTS_DIR / tmp_post.source.value / tmp_post.channel_name / f"{tmp_post.pb_date.year}"
-    scrapper_path_file: Path = scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json"
     parse_text_parse = month_posts
     if (scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").exists():
         text = json.load((scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").open())
@@ -111,6 +117,7 @@ def _save_to_file_and_to_qdrant(tmp_post: Post, month_posts: list[Post]):
                 parse_text_posts.append(post)
         tmp = "TMP"
         heap_sort(parse_text_posts)
+        parse_text_parse = parse_text_posts
 
     scrapper_path.mkdir(parents=True, exist_ok=True)
     (scrapper_path / f"{tmp}{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").write_text(TmpListTgPost(posts=parse_text_parse).model_dump_json(indent=4))
@@ -118,7 +125,6 @@ def _save_to_file_and_to_qdrant(tmp_post: Post, month_posts: list[Post]):
         (scrapper_path / f"{tmp}{tmp_post.channel_name}__{tmp_post.pb_date.month}.json").rename(
             scrapper_path / f"{tmp_post.channel_name}__{tmp_post.pb_date.month}.json"
         )
-    manager_chat.add_post_to_qdrant(scrapper_path_file)
 
 
 def save_post(posts: list[Post]) -> None:
@@ -133,26 +139,169 @@ def save_post(posts: list[Post]) -> None:
             tmp_posts.append(post)
             continue
         # save
-        _save_to_file_and_to_qdrant(tmp_post, tmp_posts)
+        _save_to_file(tmp_post, tmp_posts)
         tmp_posts.clear()
         tmp_posts.append(post)
     try:
-        _save_to_file_and_to_qdrant(tmp_posts[-1], tmp_posts)
+        _save_to_file(tmp_posts[-1], tmp_posts)
     except IndexError:
         pass
 
 
+def _restore_high_water_mark(db: AsyncSession, tsk: Task) -> None:
+    if run_on_loop(high_water_mark.get_high_water_mark(tsk.source, tsk.channel_name)) is not None:
+        return
+    hwm = run_on_loop(channel_crud.get_channel_hwm(db, tsk.source, tsk.channel_name))
+    if hwm is not None:
+        run_on_loop(high_water_mark.set_high_water_mark(tsk.source, tsk.channel_name, hwm))
+
+
+def _update_high_water_mark(db: AsyncSession, source: Source, channel_name: str, hwm: HighWaterMark) -> None:
+    if run_on_loop(high_water_mark.set_high_water_mark(source, channel_name, hwm)):
+        run_on_loop(channel_crud.update_channel_hwm(db, source, channel_name, hwm))
+
+
+def _hand_over_batch(crawl_id: str, posts: list[Post]) -> None:
+    persist_posts.delay(post_stage.stage_posts(posts, crawl_id=crawl_id).model_dump_json())
+
+
+def _window_percent(tsk: Task, oldest: Post) -> int:
+    """How far the crawl got into its window, crawls go from dt_to back to dt_from"""
+    dt_to, dt_from = as_utc(tsk.dt_to), as_utc(tsk.dt_from)
+    if dt_to <= dt_from:
+        return 0
+    return int((dt_to - min(dt_to, as_utc(oldest.pb_date))) * 100 / (dt_to - dt_from))
+
+
+def _read_batches(
+    db: AsyncSession,
+    crawl_id: str,
+    window: CrawlWindow,
+    started_at: datetime,
+    batches: AsyncGenerator[list[Post], None],
+    on_batch: Callable[[list[Post]], None],
+) -> None:
+    newest: list[Post] = []
+    batch: list[Post] = []
+    try:
+        while (posts := run_on_loop(anext(batches, None))) is not None:
+            if not posts:
+                continue
+            on_batch(posts)
+            if not newest:
+                # crawls go newest first
+                newest.append(posts[0])
+            batch.extend(posts)
+            if len(batch) >= settings.STREAM_BATCH_SIZE:
+                _hand_over_batch(crawl_id, batch)
+                batch = []
+    finally:
+        run_on_loop(batches.aclose())
+    if batch:
+        _hand_over_batch(crawl_id, batch)
+    hwm = high_water_mark.from_posts(newest)
+    if hwm is None:
+        return
+    if not window.completed:
+        logger.warning(f"parse_api({newest[0].channel_name}) :: crawl ended early, high water mark stays at the last complete crawl")
+        return
+    current = run_on_loop(high_water_mark.get_high_water_mark(newest[0].source, newest[0].channel_name))
+    if not high_water_mark.leaves_no_gap(window, started_at, current):
+        logger.info(f"parse_api({newest[0].channel_name}) :: window is off the head or short of the mark, high water mark stays")
+        return
+    # posts above the old mark may still wait for persist_posts, the mark moves once they are committed
+    if (ready := post_stage.crawl_completed(crawl_id, hwm)) is not None:
+        _update_high_water_mark(db, newest[0].source, newest[0].channel_name, ready)
+
+
 @app.task(bind=True)
 def parse_api(self, channel_name: str, task: dict[str, Any]) -> None:
-    with httpx.Client() as client:
-        response = client.post("http://localhost:50001/start_parser", data=task, timeout=10000)
-        logger.debug(response.status_code)
-        if response.status_code != 200:
-            return
-    text = response.json()
-    if not isinstance(text, list):
+    """
+    Fetch stage: posts come from the scraper client (in process by default), every STREAM_BATCH_SIZE posts are staged
+    and handed over to persist_posts, the high water mark moves only once the crawl got to its end and all its posts are committed.
+    A part of a split window reports its progress as its part of the channel window
+    """
+    tsk = Task.model_validate_json(task) if isinstance(task, str | bytes) else Task.model_validate(task)
+    log_extra = {"req_id": str(self.request.id)}
+    db = run_on_loop(get_db_main_for_celery())
+    started_at = utcnow()
+    # every crawl checks its window against the mark, not only the incremental ones
+    _restore_high_water_mark(db, tsk)
+    if tsk.source is Source.YOUTUBE:
+        # a youtube crawl extracts every listed video, the ones already in the db are left out of the listing
+        known_post_ids = run_on_loop(post_crud.get_post_ids_in_window(db, tsk.source, tsk.channel_name, tsk.dt_from, tsk.dt_to))
+        tsk = tsk.model_copy(update={"known_post_ids": known_post_ids})
+    window = CrawlWindow(dt_to=tsk.dt_to, dt_from=tsk.dt_from)
+    batches = get_scraper_client().iter_batches(tsk, window, log_extra=log_extra)
+    queue = dispatcher_state.channel_queue(tsk.source, tsk.channel_name)
+    part = dispatcher_state.part_of(str(self.request.id))
+    index = part.index if part is not None else 0
+
+    with dispatcher_state.keep_lease(queue, str(self.request.id), utcnow()) as lease_lost:
+
+        def report_progress(posts: list[Post]) -> None:
+            if lease_lost.is_set():
+                raise dispatcher_state.LeaseLost(f"{queue} :: lease lost by {self.request.id}, the crawl stops")
+            dispatcher_state.report_progress(queue, index, _window_percent(tsk, posts[-1]))
+
+        _read_batches(db, str(self.request.id), window, started_at, batches, report_progress)
+
+
+@app.task
+def persist_posts(batch: str) -> None:
+    """Dedup/persist stage: only the posts new to the db go on"""
+    ref = PostBatchRef.model_validate_json(batch)
+    posts = post_stage.load_posts(ref)
+    if not posts:
         return
-    posts = parse_data(Source.TELEGRAM, channel_name, text)  # ошибка тут
     db = run_on_loop(get_db_main_for_celery())
-    unique_posts = run_on_loop(post_crud.create_posts(db, posts))
-    save_post(posts_dbmdl_to_posts(posts, unique_posts))
+    new_posts = posts_dbmdl_to_posts(posts, run_on_loop(post_crud.create_posts(db, posts)))
+    if (hwm := post_stage.batch_persisted(ref)) is not None:
+        _update_high_water_mark(db, ref.source, ref.channel_name, hwm)
+    new_ids = {post.post_id for post in new_posts}
+    post_stage.drop(ref.model_copy(update={"post_ids": [post_id for post_id in ref.post_ids if post_id not in new_ids]}))
+    if new_posts:
+        archive_posts.delay(ref.model_copy(update={"post_ids": [post.post_id for post in new_posts]}).model_dump_json())
+
+
+@app.task
+def archive_posts(batch: str) -> None:
+    """Archive stage: merges the posts into the month json files, the audio of youtube posts goes to the download queue"""
+    posts = post_stage.load_posts(PostBatchRef.model_validate_json(batch))
+    save_post(posts)
+    with_media = [post for post in posts if post.media is not None and post.media.preview is not None]
+    if settings.MEDIA_DOWNLOAD_ENABLED and with_media:
+        download_media.delay(TmpListTgPost(posts=with_media).model_dump_json())
+    summarize_posts.delay(batch)
+
+
+@app.task
+def summarize_posts(batch: str, attempt: int = 0) -> None:
+    """
+    Summarize stage: one llm prompt per post with text, the summarized posts go on to embed.
+    The posts whose prompt failed are summarized again later, up to HTTP_MAX_RETRIES times
+    """
+    ref = PostBatchRef.model_validate_json(batch)
+    posts = [post for post in post_stage.load_posts(ref) if isinstance(post.content, str)]
+    with_text = {post.post_id for post in posts}
+    # posts without text go no further, neither do their staged payloads
+    post_stage.drop(ref.model_copy(update={"post_ids": [post_id for post_id in ref.post_ids if post_id not in with_text]}))
+    if not posts:
+        return
+    summaries = run_on_loop(manager_chat.summarize_posts(posts))
+    failed = ref.model_copy(update={"post_ids": [post.post_id for post in posts if post.post_id not in summaries]})
+    if failed.post_ids and attempt < settings.HTTP_MAX_RETRIES:
+        summarize_posts.apply_async((failed.model_dump_json(),), {"attempt": attempt + 1}, countdown=2**attempt)
+    elif failed.post_ids:
+        logger.warning(f"summarize_posts({ref.channel_name}) :: {len(failed.post_ids)} posts left unsummarized after {attempt} retries")
+        post_stage.drop(failed)
+    if summaries:
+        embed_posts.delay(post_stage.stage_summaries(ref, summaries).model_dump_json())
+
+
+@app.task
+def embed_posts(batch: str) -> None:
+    """Embed/upsert stage: the posts and their chunks go to qdrant, the staged batch is dropped"""
+    ref = PostBatchRef.model_validate_json(batch)
+    manager_chat.upsert_posts(post_stage.load_posts(ref), post_stage.load_summaries(ref))
+    post_stage.drop(ref)
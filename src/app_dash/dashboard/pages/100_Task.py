@@ -6,9 +6,10 @@ import streamlit as st
 from redis.asyncio import Redis
 
 from src import log
+from src.app_celery import dispatcher_state
+from src.app_celery.scheduler import Priority
 from src.app_dash.utils.streamlit import st_no_top_borders
 from src.common.moment import END_OF_EPOCH, START_OF_EPOCH
-from src.dto.redis_models import RedisTask
 
 logger = logging.getLogger(__name__)
 
@@ -31,15 +32,22 @@ async def main(*, log_extra: dict[str, str]) -> None:
         source = st.selectbox("Source", (Source.YOUTUBE, Source.TELEGRAM))
         channel_name = st.text_input("Channel name", help="t.me/CHANNEL_NAME")
         time_period = st.date_input("Select time period", (START_OF_EPOCH, END_OF_EPOCH), START_OF_EPOCH, END_OF_EPOCH, format="MM.DD.YYYY")
-        if not st.form_submit_button("find"):
+        priority = st.selectbox("Priority", (Priority.NORMAL, Priority.BACKFILL), format_func=lambda p: p.value)
+        incremental = st.checkbox("Incremental", help="since the last crawled post only")
+        refresh = st.form_submit_button("refresh now")
+        if not st.form_submit_button("find") and not refresh:
             return
     with st.spinner("wait few seconds..."):
+        dispatcher_state.set_priority(source, channel_name, priority)
+        if refresh:
+            queue = dispatcher_state.request_refresh(source, channel_name)
+            st.write(await rds.lrange(dispatcher_state.channel_incremental(queue), 0, -1))
+            return
         if isinstance(time_period, tuple) and len(time_period) == 2:
             start_of_epoch = datetime(time_period[0].year, time_period[0].month, time_period[0].day)
             end_of_epoch = datetime(time_period[-1].year, time_period[-1].month, time_period[-1].day)
-            await rds.sadd(str(RedisTask.channel_tasks.value), channel_name)
-            await rds.rpush(f"{source.value}${channel_name}", str(start_of_epoch), str(end_of_epoch))
-            st.write(await rds.lrange(f"{source.value}${channel_name}", 0, -1))
+            queue = dispatcher_state.enqueue_window(source, channel_name, start_of_epoch, end_of_epoch, incremental=incremental)
+            st.write(await rds.lrange(dispatcher_state.channel_incremental(queue) if incremental else queue, 0, -1))
 
         else:
             st.write("WARNING: time period is invalid")
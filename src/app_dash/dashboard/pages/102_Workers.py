@@ -1,12 +1,15 @@
 import asyncio
 import logging
+from collections import Counter
 
 import streamlit as st
 from redis.asyncio import Redis
 
 from src import log
+from src.app_celery import autoscaler, dispatcher_state
 from src.app_dash.utils.streamlit import st_no_top_borders
 from src.dto.redis_models import RedisTask
+from src.env import settings
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +25,37 @@ async def main(*, log_extra: dict[str, str]) -> None:
     st_no_top_borders()
 
     st.header("TELEGRAM WORKER")
+    running = Counter(dispatcher_state.running_tasks().values())
+    if running:
+        st.dataframe(
+            [{"channel": queue, "tasks running": count, "progress, %": dispatcher_state.window_progress(queue)} for queue, count in sorted(running.items())],
+            hide_index=True,
+        )
+    st.subheader("Autoscaler")
+    if settings.AUTOSCALE_ENABLED:
+        st.write(f"count of workers: {autoscaler.counter_of_workers()}, autoscaled within {settings.AUTOSCALE_MIN_WORKERS}..{settings.AUTOSCALE_MAX_WORKERS}")
+    else:
+        st.write(f"count of workers: {autoscaler.counter_of_workers()}, autoscaling is off")
+    decisions = autoscaler.recent_decisions(settings.AUTOSCALE_DECISIONS_KEPT)
+    if decisions:
+        st.dataframe(
+            [
+                {
+                    "at": decision.at,
+                    "workers": f"{decision.workers} -> {decision.target}",
+                    "reason": decision.reason,
+                    "backlog": decision.backlog,
+                    "running": decision.running,
+                    "capacity": decision.capacity,
+                    "stage latency, s": ", ".join(f"{stage} {seconds:.1f}" for stage, seconds in sorted(decision.latency.items())),
+                    "throttled": ", ".join(f"{host} {rate:.0%}" for host, rate in sorted(decision.throttle.items())),
+                }
+                for decision in decisions
+            ],
+            hide_index=True,
+        )
     with st.form("POST"):
-        cow = st.text_input("count of workers", help="t.me/CHANNEL_NAME")
+        cow = st.text_input("count of workers", help="the autoscaler goes on from this value")
         if not st.form_submit_button("find"):
             return
         await rds.set(RedisTask.counter_of_workers.value, cow)
@@ -5,11 +5,12 @@ import streamlit as st
 from redis.asyncio import Redis
 
 from src.app_api.dependencies import DBM
+from src.app_celery import dispatcher_state
+from src.app_celery.scheduler import Priority
 from src.app_dash.run_dash_page import run_dash_page
 from src.app_dash.utils.streamlit import st_no_top_borders
 from src.common.moment import END_OF_EPOCH, START_OF_EPOCH
 from src.dto.feed_rec_info import Source
-from src.dto.redis_models import RedisTask
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +39,8 @@ async def main(dbm: DBM, log_extra: dict[str, str]) -> None:
                 source = st.selectbox("Source", (Source.YOUTUBE, Source.TELEGRAM))
         channel_name = st.text_input("Channel name", help="t.me/CHANNEL_NAME", value=default_channel_name)
         time_period = st.date_input("Select time period", (START_OF_EPOCH, END_OF_EPOCH), START_OF_EPOCH, END_OF_EPOCH, format="MM.DD.YYYY")
+        priority = st.selectbox("Priority", (Priority.NORMAL, Priority.BACKFILL), format_func=lambda p: p.value)
+        incremental = st.checkbox("Incremental", help="since the last crawled post only")
         if not st.form_submit_button("CREATE"):
             return
 
@@ -45,9 +48,9 @@ async def main(dbm: DBM, log_extra: dict[str, str]) -> None:
         if isinstance(time_period, tuple) and len(time_period) == 2:
             start_of_epoch = datetime(time_period[0].year, time_period[0].month, time_period[0].day)
             end_of_epoch = datetime(time_period[-1].year, time_period[-1].month, time_period[-1].day)
-            await rds.sadd(str(RedisTask.channel_tasks.value), f"{source.value}${channel_name}")
-            await rds.rpush(f"{source.value}${channel_name}", str(start_of_epoch), str(end_of_epoch))
-            st.write(await rds.lrange(f"{source.value}${channel_name}", 0, -1))
+            dispatcher_state.set_priority(source, channel_name, priority)
+            queue = dispatcher_state.enqueue_window(source, channel_name, start_of_epoch, end_of_epoch, incremental=incremental)
+            st.write(await rds.lrange(dispatcher_state.channel_incremental(queue) if incremental else queue, 0, -1))
 
         else:
             st.write("WARNING: time period is invalid")
@@ -0,0 +1,59 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import AsyncIterator
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from src.dto import redis_models
+from src.dto.feed_rec_info import CrawlWindow, Source
+
+logger = logging.getLogger(__name__)
+
+rds = Redis(host="localhost", port=60379)
+
+STOP_MESSAGE = b"stop"
+
+
+async def publish_window(source: Source, channel_name: str, window: CrawlWindow) -> None:
+    await rds.publish(redis_models.source_channel_name_control(source, channel_name), window.model_dump_json())
+
+
+async def publish_stop(source: Source, channel_name: str) -> None:
+    await rds.publish(redis_models.source_channel_name_control(source, channel_name), STOP_MESSAGE)
+
+
+async def _listen(pubsub: PubSub, window: CrawlWindow, *, log_extra: dict[str, str]) -> None:
+    async for message in pubsub.listen():
+        if message["type"] != "message":
+            continue
+        if message["data"] == STOP_MESSAGE:
+            window.stopped = True
+            logger.debug("crawl stop received", extra=log_extra)
+            continue
+        try:
+            new_window = CrawlWindow.model_validate_json(message["data"])
+        except ValueError as e:
+            logger.warning(f"invalid crawl window message: {e}", extra=log_extra)
+            continue
+        window.dt_to = new_window.dt_to
+        window.dt_from = new_window.dt_from
+        logger.debug(f"crawl window changed to {window.dt_from} .. {window.dt_to}", extra=log_extra)
+
+
+@contextlib.asynccontextmanager
+async def watch_window(source: Source, channel_name: str, window: CrawlWindow, *, log_extra: dict[str, str]) -> AsyncIterator[CrawlWindow]:
+    """Keeps the in-memory window of a running crawl in sync with change/stop requests."""
+    control_channel = redis_models.source_channel_name_control(source, channel_name)
+    pubsub = rds.pubsub()
+    await pubsub.subscribe(control_channel)
+    listener = asyncio.create_task(_listen(pubsub, window, log_extra=log_extra))
+    try:
+        yield window
+    finally:
+        listener.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await listener
+        await pubsub.unsubscribe(control_channel)
+        await pubsub.aclose()
@@ -0,0 +1,68 @@
+import logging
+from datetime import datetime
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from src.common.moment import as_utc
+from src.dto import redis_models
+from src.dto.feed_rec_info import CrawlWindow, HighWaterMark, Post, Source
+
+logger = logging.getLogger(__name__)
+
+rds = Redis(host="localhost", port=60379)
+
+
+def is_after(a: HighWaterMark, b: HighWaterMark) -> bool:
+    if a.pb_date != b.pb_date:
+        return a.pb_date > b.pb_date
+    if a.post_id.isdigit() and b.post_id.isdigit():
+        return int(a.post_id) > int(b.post_id)
+    return False
+
+
+def from_posts(posts: list[Post]) -> HighWaterMark | None:
+    hwm: HighWaterMark | None = None
+    for post in posts:
+        candidate = HighWaterMark(post_id=post.post_id, pb_date=post.pb_date)
+        if hwm is None or is_after(candidate, hwm):
+            hwm = candidate
+    return hwm
+
+
+def leaves_no_gap(window: CrawlWindow, started_at: datetime, current: HighWaterMark | None) -> bool:
+    """
+    A crawl may move the mark to its newest post only when its window starts at the head of the channel
+    and reaches back to the current mark, otherwise the posts between the window and the mark were never crawled
+    """
+    if as_utc(window.dt_to) < as_utc(started_at):
+        return False
+    return current is None or as_utc(window.dt_from) <= as_utc(current.pb_date)
+
+
+async def get_high_water_mark(source: Source, channel_name: str) -> HighWaterMark | None:
+    raw = await rds.get(redis_models.source_channel_name_hwm(source, channel_name))
+    if not raw:
+        return None
+    return HighWaterMark.model_validate_json(raw)
+
+
+async def set_high_water_mark(source: Source, channel_name: str, hwm: HighWaterMark) -> bool:
+    """
+    Moves the mark forward only, returns False when the stored mark is already newer.
+    The compare and the set run under WATCH, a mark written in between makes the compare run again
+    """
+    key = redis_models.source_channel_name_hwm(source, channel_name)
+
+    async def compare_and_set(pipe: Pipeline) -> bool:
+        raw = await pipe.get(key)
+        if raw and not is_after(hwm, HighWaterMark.model_validate_json(raw)):
+            return False
+        pipe.multi()
+        pipe.set(key, hwm.model_dump_json())
+        return True
+
+    if not await rds.transaction(compare_and_set, key, value_from_callable=True):
+        return False
+    logger.debug(f"high water mark of {source.value}/{channel_name} -> {hwm.post_id} ({hwm.pb_date})")
+    return True
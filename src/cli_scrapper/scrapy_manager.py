@@ -1,11 +1,18 @@
+import asyncio
 import logging
+import weakref
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 from datetime import datetime, timezone
+from functools import partial
 
 from redis.asyncio import Redis
 
+from src.cli_scrapper import crawl_control, high_water_mark
 from src.common.moment import as_utc
 from src.dto import redis_models
-from src.dto.feed_rec_info import Channel, Post, Source, TaskStatus
+from src.dto.feed_rec_info import Channel, CrawlWindow, HighWaterMark, Post, Source, TaskStatus
+from src.env import settings
 from src.external_telegram import telegram_scrapy
 from src.external_youtube import youtube_scrapy
 from src.parser_app_api.models.request_models.feed_rec_request_info import InfoParsingParametersApiMdl, ParsingParametersApiMdl
@@ -42,28 +49,135 @@ async def get_progress_parsing(info_parsing_parameters: InfoParsingParametersApi
     return int(((utc_dt_to - utc_dt_now) * 100) / (utc_dt_to - utc_dt_from))
 
 
-async def start_parsing(parsing_parameters: ParsingParametersApiMdl, *, log_extra: dict[str, str]) -> list[Post] | None:
+_RunningCrawls = dict[tuple[Source, str], tuple[ParsingParametersApiMdl, asyncio.Task[list[Post] | None]]]
+
+# the slots and the running crawls are bound to their event loop, every celery task runs its own loop
+_crawl_slots: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+_running_crawls: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _RunningCrawls] = weakref.WeakKeyDictionary()
+
+
+def _get_crawl_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _crawl_slots.get(loop)
+    if slots is None:
+        slots = _crawl_slots[loop] = asyncio.Semaphore(settings.CRAWL_MAX_CHANNELS)
+    return slots
+
+
+def _get_running_crawls() -> _RunningCrawls:
+    return _running_crawls.setdefault(asyncio.get_running_loop(), {})
+
+
+async def _get_high_water_mark(parsing_parameters: ParsingParametersApiMdl, *, log_extra: dict[str, str]) -> HighWaterMark | None:
+    if not parsing_parameters.incremental:
+        return None
+    hwm = await high_water_mark.get_high_water_mark(parsing_parameters.source, parsing_parameters.channel_name)
+    logger.debug(f"start_parsing({parsing_parameters.channel_name}) :: since last crawl, high water mark {hwm}", extra=log_extra)
+    return hwm
+
+
+def _stop_post_id(hwm: HighWaterMark | None) -> int | None:
+    return int(hwm.post_id) if hwm is not None and hwm.post_id.isdigit() else None
+
+
+async def _crawl(parsing_parameters: ParsingParametersApiMdl, *, log_extra: dict[str, str]) -> list[Post] | None:
     await rds.set(redis_models.source_channel_name_dt_to(parsing_parameters.source, parsing_parameters.channel_name), str(parsing_parameters.dt_to))
     await rds.set(redis_models.source_channel_name_dt_from(parsing_parameters.source, parsing_parameters.channel_name), str(parsing_parameters.dt_from))
-    match parsing_parameters.source:
-        case Source.YOUTUBE:
-            posts = await youtube_scrapy.get_channel_posts_list(parsing_parameters.channel_name, log_extra=log_extra)
-        case Source.TELEGRAM:
-            posts = await telegram_scrapy.get_channel_messages(parsing_parameters.channel_name, log_extra=log_extra)
-        case _:
-            return None
+    hwm = await _get_high_water_mark(parsing_parameters, log_extra=log_extra)
+    window = CrawlWindow(dt_to=parsing_parameters.dt_to, dt_from=parsing_parameters.dt_from)
+    async with _get_crawl_slots(), crawl_control.watch_window(parsing_parameters.source, parsing_parameters.channel_name, window, log_extra=log_extra):
+        match parsing_parameters.source:
+            case Source.YOUTUBE:
+                posts = await youtube_scrapy.get_channel_posts_list(parsing_parameters.channel_name, window, hwm=hwm, log_extra=log_extra)
+            case Source.TELEGRAM:
+                posts = await telegram_scrapy.get_channel_messages(
+                    parsing_parameters.channel_name, window, stop_post_id=_stop_post_id(hwm), log_extra=log_extra
+                )
+            case _:
+                return None
     if not isinstance(posts, list):
         return None
     await rds.set(redis_models.source_channel_name_status(parsing_parameters.source, parsing_parameters.channel_name), TaskStatus.free.value)
     return posts
 
 
+async def _iter_crawl(
+    parsing_parameters: ParsingParametersApiMdl, window: CrawlWindow, hwm: HighWaterMark | None, *, log_extra: dict[str, str]
+) -> AsyncIterator[list[Post]]:
+    match parsing_parameters.source:
+        case Source.YOUTUBE:
+            batches = youtube_scrapy.iter_channel_posts_list(
+                parsing_parameters.channel_name, window, hwm=hwm, known_post_ids=frozenset(parsing_parameters.known_post_ids), log_extra=log_extra
+            )
+        case Source.TELEGRAM:
+            batches = telegram_scrapy.iter_channel_messages(parsing_parameters.channel_name, window, stop_post_id=_stop_post_id(hwm), log_extra=log_extra)
+        case _:
+            return
+    async with aclosing(batches):
+        async for batch in batches:
+            yield batch
+
+
+async def stream_parsing(
+    parsing_parameters: ParsingParametersApiMdl, *, window: CrawlWindow | None = None, log_extra: dict[str, str]
+) -> AsyncIterator[list[Post]]:
+    """
+    Same crawl as start_parsing, but posts are handed over page by page instead of being collected.
+    The crawl runs in the given window, once the batches are read window.completed says whether it got to its end
+    """
+    await rds.set(redis_models.source_channel_name_dt_to(parsing_parameters.source, parsing_parameters.channel_name), str(parsing_parameters.dt_to))
+    await rds.set(redis_models.source_channel_name_dt_from(parsing_parameters.source, parsing_parameters.channel_name), str(parsing_parameters.dt_from))
+    hwm = await _get_high_water_mark(parsing_parameters, log_extra=log_extra)
+    if window is None:
+        window = CrawlWindow(dt_to=parsing_parameters.dt_to, dt_from=parsing_parameters.dt_from)
+    try:
+        async with _get_crawl_slots(), crawl_control.watch_window(parsing_parameters.source, parsing_parameters.channel_name, window, log_extra=log_extra):
+            batches = _iter_crawl(parsing_parameters, window, hwm, log_extra=log_extra)
+            async with aclosing(batches):
+                async for batch in batches:
+                    yield batch
+    finally:
+        await rds.set(redis_models.source_channel_name_status(parsing_parameters.source, parsing_parameters.channel_name), TaskStatus.free.value)
+
+
+def _forget_crawl(running_crawls: _RunningCrawls, key: tuple[Source, str], crawl: asyncio.Task[list[Post] | None]) -> None:
+    if key in running_crawls and running_crawls[key][1] is crawl:
+        del running_crawls[key]
+
+
+async def start_parsing(parsing_parameters: ParsingParametersApiMdl, *, log_extra: dict[str, str]) -> list[Post] | None:
+    """
+    Crawls of all channels share the event loop: at most CRAWL_MAX_CHANNELS run at once,
+    requests to one host go through its shared rate limiter, a second request for a running channel joins that crawl
+    when it asks for the same window, otherwise it waits for the crawl to end and starts its own.
+    """
+    key = (parsing_parameters.source, parsing_parameters.channel_name)
+    running_crawls = _get_running_crawls()
+    while (running := running_crawls.get(key)) is not None and running[0] != parsing_parameters:
+        logger.debug(f"start_parsing({parsing_parameters.channel_name}) :: waits for the running crawl of another window", extra=log_extra)
+        await asyncio.wait([running[1]])
+    if running is None:
+        crawl = asyncio.create_task(_crawl(parsing_parameters, log_extra=log_extra))
+        running_crawls[key] = (parsing_parameters, crawl)
+        crawl.add_done_callback(partial(_forget_crawl, running_crawls, key))
+    else:
+        logger.debug(f"start_parsing({parsing_parameters.channel_name}) :: joined running crawl", extra=log_extra)
+        crawl = running[1]
+    return await asyncio.shield(crawl)
+
+
 async def stop_parsing(info_parsing_parameters: InfoParsingParametersApiMdl) -> None:
     await rds.delete(redis_models.source_channel_name_dt_to(info_parsing_parameters.source, info_parsing_parameters.channel_name))
     await rds.delete(redis_models.source_channel_name_dt_from(info_parsing_parameters.source, info_parsing_parameters.channel_name))
-    await rds.set(info_parsing_parameters.channel_name, TaskStatus.free.value)
+    await rds.set(redis_models.source_channel_name_status(info_parsing_parameters.source, info_parsing_parameters.channel_name), TaskStatus.free.value)
+    await crawl_control.publish_stop(info_parsing_parameters.source, info_parsing_parameters.channel_name)
 
 
 async def change_params_parsing(parsing_parameters: ParsingParametersApiMdl) -> None:
     await rds.set(redis_models.source_channel_name_dt_to(parsing_parameters.source, parsing_parameters.channel_name), str(parsing_parameters.dt_to))
     await rds.set(redis_models.source_channel_name_dt_from(parsing_parameters.source, parsing_parameters.channel_name), str(parsing_parameters.dt_from))
+    await crawl_control.publish_window(
+        parsing_parameters.source,
+        parsing_parameters.channel_name,
+        CrawlWindow(dt_to=parsing_parameters.dt_to, dt_from=parsing_parameters.dt_from),
+    )
@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from src.cli_scrapper.high_water_mark import leaves_no_gap
+from src.common.moment import END_OF_EPOCH
+from src.dto.feed_rec_info import CrawlWindow, HighWaterMark
+
+NOW = datetime(2025, 6, 15, tzinfo=timezone.utc)
+MARK = HighWaterMark(post_id="100", pb_date=datetime(2025, 3, 10, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize(
+    ("dt_from", "dt_to", "moves"),
+    [
+        # from the head back past the mark
+        (datetime(2025, 3, 1, tzinfo=timezone.utc), END_OF_EPOCH, True),
+        # from the head, but short of the mark: march 10 .. may stays uncrawled
+        (datetime(2025, 5, 1, tzinfo=timezone.utc), END_OF_EPOCH, False),
+        # a month window after the mark that ends before the head
+        (datetime(2025, 4, 1, tzinfo=timezone.utc), datetime(2025, 5, 1, tzinfo=timezone.utc), False),
+        # up to the time the crawl started is still the head
+        (datetime(2025, 1, 1, tzinfo=timezone.utc), NOW, True),
+    ],
+)
+def test_a_window_that_leaves_a_gap_keeps_the_mark(dt_from: datetime, dt_to: datetime, moves: bool) -> None:
+    assert leaves_no_gap(CrawlWindow(dt_to=dt_to, dt_from=dt_from), NOW, MARK) is moves
+
+
+def test_the_first_crawl_from_the_head_sets_the_mark() -> None:
+    assert leaves_no_gap(CrawlWindow(dt_to=END_OF_EPOCH, dt_from=datetime(2025, 5, 1, tzinfo=timezone.utc)), NOW, None)
+    assert not leaves_no_gap(CrawlWindow(dt_to=datetime(2025, 5, 1, tzinfo=timezone.utc), dt_from=datetime(2025, 4, 1, tzinfo=timezone.utc)), NOW, None)
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from src.cli_scrapper import scrapy_manager
+from src.dto.feed_rec_info import Post, Source
+from src.parser_app_api.models.request_models.feed_rec_request_info import ParsingParametersApiMdl
+
+
+def _parameters(month: int) -> ParsingParametersApiMdl:
+    return ParsingParametersApiMdl(
+        source=Source.TELEGRAM,
+        channel_name="channel",
+        dt_to=datetime(2025, month + 1, 1, tzinfo=timezone.utc),
+        dt_from=datetime(2025, month, 1, tzinfo=timezone.utc),
+    )
+
+
+async def test_a_request_for_another_window_waits_for_the_running_crawl(monkeypatch: pytest.MonkeyPatch) -> None:
+    crawls: list[tuple[int, str]] = []
+    release = asyncio.Event()
+
+    async def crawl(parsing_parameters: ParsingParametersApiMdl, *, log_extra: dict[str, str]) -> list[Post] | None:
+        crawls.append((parsing_parameters.dt_from.month, "start"))
+        await release.wait()
+        crawls.append((parsing_parameters.dt_from.month, "end"))
+        return []
+
+    monkeypatch.setattr(scrapy_manager, "_crawl", crawl)
+    first = asyncio.create_task(scrapy_manager.start_parsing(_parameters(1), log_extra={}))
+    joined = asyncio.create_task(scrapy_manager.start_parsing(_parameters(1), log_extra={}))
+    other = asyncio.create_task(scrapy_manager.start_parsing(_parameters(2), log_extra={}))
+    await asyncio.sleep(0.01)
+    # the same window joins, another window doesn't start next to it
+    assert crawls == [(1, "start")]
+    release.set()
+    await asyncio.gather(first, joined, other)
+    assert crawls == [(1, "start"), (1, "end"), (2, "start"), (2, "end")]
+    assert not scrapy_manager._get_running_crawls()  # noqa: SLF001
+
+
+def test_every_event_loop_keeps_its_own_crawl_slots() -> None:
+    loop_a, loop_b = asyncio.new_event_loop(), asyncio.new_event_loop()
+
+    async def slots() -> asyncio.Semaphore:
+        slots = scrapy_manager._get_crawl_slots()  # noqa: SLF001
+        async with slots:
+            return slots
+
+    try:
+        slots_a = loop_a.run_until_complete(slots())
+        # a semaphore used on one loop can't be waited on from another
+        assert loop_b.run_until_complete(slots()) is not slots_a
+        assert loop_a.run_until_complete(slots()) is slots_a
+    finally:
+        loop_a.close()
+        loop_b.close()
@@ -2,10 +2,12 @@ import asyncio
 import logging
 from collections.abc import Callable, Coroutine
 from functools import partial, wraps
-from typing import Any, Final, TypeVar
+from typing import Any, Final, TypeVar, overload
 
 from typing_extensions import ParamSpec
 
+from src.common.executors import ExecutorProfile, run_in_profile
+
 logger: Final = logging.getLogger(__name__)
 
 _T = TypeVar("_T")
@@ -15,15 +17,30 @@ _TR = TypeVar("_TR")
 TR = TypeVar("TR")
 
 
-def sync_to_async(func: Callable[_P, _T]) -> Callable[_P, Coroutine[Any, Any, _T]]:
-    """Creates a coroutine from a synchronous function."""
+@overload
+def sync_to_async(func: Callable[_P, _T], /) -> Callable[_P, Coroutine[Any, Any, _T]]: ...
+
+
+@overload
+def sync_to_async(*, profile: ExecutorProfile) -> Callable[[Callable[_P, _T]], Callable[_P, Coroutine[Any, Any, _T]]]: ...
+
+
+def sync_to_async(
+    func: Callable[_P, _T] | None = None, /, *, profile: ExecutorProfile = ExecutorProfile.IO_THREADS
+) -> Callable[_P, Coroutine[Any, Any, _T]] | Callable[[Callable[_P, _T]], Callable[_P, Coroutine[Any, Any, _T]]]:
+    """
+    Creates a coroutine from a synchronous function, run on the executor of the profile (io-threads by default).
+    Decorated functions can't be pickled, call run_in_profile with a plain function for cpu-processes.
+    """
+
+    def decorate(f: Callable[_P, _T]) -> Callable[_P, Coroutine[Any, Any, _T]]:
+        @wraps(f)
+        async def _sync_to_async(*args: _P.args, **kwargs: _P.kwargs) -> _T:
+            return await run_in_profile(profile, partial(f, *args, **kwargs))
 
-    @wraps(func)
-    async def _sync_to_async(*args: _P.args, **kwargs: _P.kwargs) -> _T:
-        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+        return _sync_to_async
 
-    return _sync_to_async
+    return decorate if func is None else decorate(func)
 
 
 async def run_list(tasks: list[Coroutine[None, None, TR]], size: int) -> list[TR]:
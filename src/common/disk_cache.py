@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Final
+
+logger: Final = logging.getLogger(__name__)
+
+_HEADER: Final = struct.Struct("!d")
+
+
+class DiskCache:
+    """
+    zlib compressed values in one file per key under root, safe to share between processes.
+    The expiry is kept in the file header and the recency in the file mtime: hits touch the file,
+    and a write past max_bytes evicts the least recently used files down to evict_to of the limit.
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int, evict_to: float = 0.9, compress_level: int = 6) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.compress_level = compress_level
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            (expires_at,) = _HEADER.unpack_from(raw)
+            value = zlib.decompress(raw[_HEADER.size :]) if expires_at >= time.time() else None
+        except (struct.error, zlib.error):
+            logger.warning(f"corrupted cache entry {path}, dropping it")
+            self.delete(key)
+            return None
+        if value is None:
+            self.delete(key)
+            return None
+        try:
+            # touch() would bring back a file another process evicted in between, as an empty one
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        raw = _HEADER.pack(time.time() + ttl) + zlib.compress(value, self.compress_level)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(raw)
+        old_size = path.stat().st_size if path.exists() else 0
+        tmp.replace(path)
+        with self._lock:
+            self._size = self._current_size() + len(raw) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries: list[tuple[float, int, Path]] = []
+        for path in self.root.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _current_size(self) -> int:
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * self.evict_to)
+        evicted = 0
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+            evicted += 1
+        self._size = size
+        logger.debug(f"cache {self.root}: evicted {evicted} entries, {size} bytes left")
@@ -0,0 +1,159 @@
+import asyncio
+import bisect
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum, unique
+from functools import partial
+from typing import Any, Final, TypeVar
+
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+# seconds, the last bucket catches everything above
+HISTOGRAM_BUCKETS: Final = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+@unique
+class ExecutorProfile(Enum):
+    IO_THREADS = "io-threads"
+    CPU_PROCESSES = "cpu-processes"
+    LLM_THREADS = "llm-threads"
+
+    @property
+    def size(self) -> int:
+        match self:
+            case ExecutorProfile.IO_THREADS:
+                return settings.EXECUTOR_IO_THREADS
+            case ExecutorProfile.CPU_PROCESSES:
+                return settings.EXECUTOR_CPU_PROCESSES
+            case ExecutorProfile.LLM_THREADS:
+                return settings.EXECUTOR_LLM_THREADS
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> dict[str, Any]:
+        # cumulative like prometheus buckets
+        cumulative, total = {}, 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, self.counts, strict=True):
+            total += count
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = total
+        return {"buckets": cumulative, "count": total, "sum": round(self.sum, 6)}
+
+
+def _timed_call(func: Callable[..., _T], *args: Any) -> tuple[float, float, _T]:
+    """Runs in the worker (thread or process), wall clock times are comparable between processes of one host"""
+    started_at = time.time()
+    result = func(*args)
+    return started_at, time.time(), result
+
+
+class InstrumentedExecutor:
+    """
+    Executor of one profile with its metrics: calls in flight beyond the pool size wait in its queue,
+    wait time is submit to start, run time is start to finish
+    """
+
+    def __init__(self, profile: ExecutorProfile) -> None:
+        self.profile = profile
+        self.size = profile.size
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self._executor: Executor | None = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            # a daemonic process (a celery prefork child) may not start children, its cpu work goes to threads
+            if self.profile is ExecutorProfile.CPU_PROCESSES and not multiprocessing.current_process().daemon:
+                self._executor = ProcessPoolExecutor(max_workers=self.size, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=self.profile.value)
+        return self._executor
+
+    @property
+    def active(self) -> int:
+        return min(self.in_flight, self.size)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.size)
+
+    async def run(self, func: Callable[..., _T], *args: Any) -> _T:
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+        self.in_flight += 1
+        try:
+            started_at, finished_at, result = await loop.run_in_executor(self._get_executor(), partial(_timed_call, func, *args))
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.wait_time.observe(max(0.0, started_at - submitted_at))
+        self.run_time.observe(finished_at - started_at)
+        return result
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "size": self.size,
+            "queue_depth": self.queue_depth,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_time": self.wait_time.snapshot(),
+            "run_time": self.run_time.snapshot(),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+
+_executors: dict[ExecutorProfile, InstrumentedExecutor] = {}
+
+
+# pools of the parent are of no use in a forked child, it builds its own on first use
+os.register_at_fork(after_in_child=_executors.clear)
+
+
+def get_executor(profile: ExecutorProfile) -> InstrumentedExecutor:
+    executor = _executors.get(profile)
+    if executor is None:
+        executor = InstrumentedExecutor(profile)
+        _executors[profile] = executor
+    return executor
+
+
+async def run_in_profile(profile: ExecutorProfile, func: Callable[..., _T], *args: Any) -> _T:
+    """func and args must be picklable for cpu-processes"""
+    return await get_executor(profile).run(func, *args)
+
+
+def executors_snapshot() -> dict[str, dict[str, Any]]:
+    return {profile.value: get_executor(profile).snapshot() for profile in ExecutorProfile}
+
+
+def shutdown_executors() -> None:
+    for executor in _executors.values():
+        executor.shutdown()
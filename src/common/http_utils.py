@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Final
+
+import aiohttp
+from aiohttp.compression_utils import HAS_BROTLI
+
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+ACCEPT_ENCODING: Final = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+
+def create_http_session(*, trace_configs: list[aiohttp.TraceConfig] | None = None) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_LIMIT,
+        limit_per_host=settings.HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.HTTP_TIMEOUT_TOTAL,
+        connect=settings.HTTP_TIMEOUT_CONNECT,
+        sock_read=settings.HTTP_TIMEOUT_SOCK_READ,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"Accept-Encoding": ACCEPT_ENCODING}, trace_configs=trace_configs)
+
+
+_sessions: dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Session shared by all scrapers on the running loop, must be called inside it.
+    A session is bound to its loop, so every loop gets its own, each closed by close_http_session on that loop
+    """
+    loop = asyncio.get_running_loop()
+    for other in [other for other in _sessions if other.is_closed()]:
+        logger.warning("http session of a closed event loop was never closed")
+        del _sessions[other]
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _sessions[loop] = create_http_session()
+    return session
+
+
+async def close_http_session() -> None:
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
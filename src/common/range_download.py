@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Final, TypeVar
+
+import aiohttp
+from pydantic import BaseModel
+from yarl import URL
+
+from src.common.rate_limit import get_host_limiter, is_throttle_status
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+_TR = TypeVar("_TR")
+
+READ_BYTES: Final = 64 * 1024
+
+_re_content_range = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _Interrupted(Exception):
+    """A request that may succeed when sent again: throttled, cut short or answered with other bytes than asked for"""
+
+
+class BandwidthLimiter:
+    """Token bucket over bytes shared by every download of a RangeDownloader, a rate of 0 is unlimited"""
+
+    def __init__(self, rate: float, *, burst: float | None = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, size: int) -> None:
+        if self.rate <= 0:
+            return
+        # waiters sleep off their debt one after another, in the order they came
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= size
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
+
+
+class PartState(BaseModel):
+    """Kept next to a .part file, so a failed download goes on from the bytes already on disk"""
+
+    size: int
+    chunk_size: int
+    # bytes written of every chunk
+    written: list[int]
+
+
+def _retry_after(response: aiohttp.ClientResponse) -> float | None:
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else None
+
+
+def _request_timeout() -> aiohttp.ClientTimeout:
+    # a chunk takes as long as the bandwidth cap says, only a stalled read fails it
+    return aiohttp.ClientTimeout(total=None, connect=settings.HTTP_TIMEOUT_CONNECT, sock_read=settings.HTTP_TIMEOUT_SOCK_READ)
+
+
+class RangeDownloader:
+    """
+    Streams files to disk in parallel http range chunks: up to chunks_per_file chunks of a file and up to connections
+    requests overall at a time, every byte through one bandwidth limiter. A chunk that fails is retried from its
+    last written byte, a download that fails for good leaves <dst>.part and <dst>.part.json behind to be resumed.
+    Servers without range support get one plain request, restarted from the first byte.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        *,
+        chunk_size: int,
+        chunks_per_file: int,
+        connections: int,
+        bytes_per_second: float,
+        max_retries: int,
+        base_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+    ) -> None:
+        self.session = session
+        self.chunk_size = chunk_size
+        self.chunks_per_file = chunks_per_file
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.bandwidth = BandwidthLimiter(bytes_per_second)
+        self._connections = asyncio.Semaphore(connections)
+
+    async def download(self, url: str, dst: Path, *, on_progress: Callable[[int, int], None] | None = None) -> int:
+        """Downloads url into dst and returns its size, a dst that exists is taken as downloaded"""
+        if dst.exists():
+            return dst.stat().st_size
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        part = dst.with_name(f"{dst.name}.part")
+        state_path = dst.with_name(f"{dst.name}.part.json")
+        size, ranges = await self._retrying(url, lambda: self._probe(url))
+        if ranges and size is not None:
+            await self._download_chunks(url, part, state_path, size, on_progress)
+        else:
+            size = await self._retrying(url, lambda: self._download_whole(url, part))
+            if on_progress is not None:
+                on_progress(size, size)
+        part.replace(dst)
+        state_path.unlink(missing_ok=True)
+        return size
+
+    async def _retrying(self, url: str, attempt: Callable[[], Awaitable[_TR]]) -> _TR:
+        retries = 0
+        while True:
+            try:
+                return await attempt()
+            except (aiohttp.ClientError, TimeoutError, _Interrupted) as e:
+                if retries >= self.max_retries:
+                    raise DownloadError(f"{url} :: gave up after {retries} retries: {e!s}") from e
+                retries += 1
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (retries - 1)) * (1 + random.random() / 2)
+                logger.warning(f"{URL(url).host} :: retry {retries} in {backoff:.1f}s: {e!s}")
+                await asyncio.sleep(backoff)
+
+    async def _get(self, url: str, byte_range: str) -> aiohttp.ClientResponse:
+        limiter = get_host_limiter(URL(url).host or "")
+        await limiter.acquire(URL(url).path)
+        response = await self.session.get(url, headers={"Range": f"bytes={byte_range}", "Accept-Encoding": "identity"}, timeout=_request_timeout())
+        limiter.on_response(response.status, _retry_after(response))
+        if is_throttle_status(response.status):
+            response.release()
+            raise _Interrupted(f"answered {response.status}")
+        return response
+
+    async def _probe(self, url: str) -> tuple[int | None, bool]:
+        """(size, whether ranges are served), from the answer to the first byte"""
+        async with self._connections:
+            response = await self._get(url, "0-0")
+            async with response:
+                if response.status == 206:
+                    match = _re_content_range.fullmatch(response.headers.get("Content-Range", ""))
+                    if match is not None and match[3] != "*":
+                        return int(match[3]), True
+                    return None, False
+                if response.status == 200:
+                    return response.content_length, False
+                if response.status == 416:
+                    # an empty file has no first byte
+                    return 0, True
+                raise DownloadError(f"{url} :: answered {response.status}")
+
+    def _load_state(self, part: Path, state_path: Path, size: int) -> PartState | None:
+        if not part.exists() or not state_path.exists():
+            return None
+        try:
+            state = PartState.model_validate_json(state_path.read_bytes())
+        except ValueError:
+            return None
+        if state.size != size or state.chunk_size != self.chunk_size:
+            # the file changed upstream, or the chunks were cut differently
+            return None
+        return state
+
+    @staticmethod
+    def _chunk_len(state: PartState, index: int) -> int:
+        return min(state.chunk_size, state.size - index * state.chunk_size)
+
+    @staticmethod
+    def _save_state(state_path: Path, state: PartState) -> None:
+        tmp = state_path.with_name(f"{state_path.name}.tmp")
+        tmp.write_text(state.model_dump_json())
+        tmp.replace(state_path)
+
+    async def _fetch_chunk(self, url: str, fd: int, state: PartState, index: int) -> None:
+        start, length = index * state.chunk_size, self._chunk_len(state, index)
+        async with self._connections:
+            response = await self._get(url, f"{start + state.written[index]}-{start + length - 1}")
+            async with response:
+                if response.status >= 400:
+                    raise DownloadError(f"{url} :: answered {response.status} for chunk {index}")
+                match = _re_content_range.fullmatch(response.headers.get("Content-Range", ""))
+                if response.status != 206 or match is None or int(match[1]) != start + state.written[index]:
+                    raise _Interrupted(f"answered {response.status} {response.headers.get('Content-Range')} for chunk {index}")
+                async for data in response.content.iter_chunked(READ_BYTES):
+                    data = data[: length - state.written[index]]
+                    await self.bandwidth.acquire(len(data))
+                    os.pwrite(fd, data, start + state.written[index])
+                    state.written[index] += len(data)
+        if state.written[index] < length:
+            raise _Interrupted(f"chunk {index} ended at {state.written[index]} of {length} bytes")
+
+    async def _download_chunks(self, url: str, part: Path, state_path: Path, size: int, on_progress: Callable[[int, int], None] | None) -> None:
+        state = self._load_state(part, state_path, size)
+        fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if state is None:
+                state = PartState(size=size, chunk_size=self.chunk_size, written=[0] * math.ceil(size / self.chunk_size))
+                os.ftruncate(fd, size)
+            else:
+                logger.debug(f"{part.name} :: resumed at {sum(state.written)} of {size} bytes")
+            file_chunks = asyncio.Semaphore(self.chunks_per_file)
+
+            async def run_chunk(index: int) -> None:
+                try:
+                    async with file_chunks:
+                        await self._retrying(url, lambda: self._fetch_chunk(url, fd, state, index))
+                finally:
+                    self._save_state(state_path, state)
+                if on_progress is not None:
+                    on_progress(sum(state.written), size)
+
+            pending = [index for index in range(len(state.written)) if state.written[index] < self._chunk_len(state, index)]
+            # the other chunks go on when one fails for good, so a resume has less left to fetch
+            results = await asyncio.gather(*(run_chunk(index) for index in pending), return_exceptions=True)
+        finally:
+            os.close(fd)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _download_whole(self, url: str, part: Path) -> int:
+        async with self._connections:
+            response = await self._get(url, "0-")
+            async with response:
+                if response.status not in {200, 206}:
+                    raise DownloadError(f"{url} :: answered {response.status}")
+                size = 0
+                with part.open("wb") as f:
+                    async for data in response.content.iter_chunked(READ_BYTES):
+                        await self.bandwidth.acquire(len(data))
+                        f.write(data)
+                        size += len(data)
+        if response.content_length is not None and size < response.content_length:
+            raise _Interrupted(f"ended at {size} of {response.content_length} bytes")
+        return size
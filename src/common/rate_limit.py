@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Final
+
+from src.env import settings
+
+logger: Final = logging.getLogger(__name__)
+
+
+def is_throttle_status(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+_responses_lock = threading.Lock()
+_responses: Counter[tuple[str, bool]] = Counter()
+
+
+def record_response(host: str, status: int) -> None:
+    """Counts the answers of an upstream host, the limiters and the llm client report here from any thread"""
+    with _responses_lock:
+        _responses[host, is_throttle_status(status)] += 1
+
+
+def take_response_counts() -> dict[str, tuple[int, int]]:
+    """host -> (responses, throttled) since the previous call"""
+    with _responses_lock:
+        counts = dict(_responses)
+        _responses.clear()
+    taken: dict[str, tuple[int, int]] = {}
+    for (host, throttled), count in counts.items():
+        total, throttles = taken.get(host, (0, 0))
+        taken[host] = (total + count, throttles + count if throttled else throttles)
+    return taken
+
+
+class HostRateLimiter:
+    """
+    Token bucket shared by every crawl that talks to one host.
+    The rate follows AIMD: +increase per second of successful traffic, *decrease on 429/5xx with a jittered pause.
+    Tokens are granted round-robin between keys (channels), so one channel with many pages in flight can't starve the rest.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        *,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        burst: int,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.host = host
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._throttled = 0
+        self._waiters: dict[str, deque[asyncio.Future[None]]] = {}
+        self._order: deque[str] = deque()
+        self._dispatcher: asyncio.Task[None] | None = None
+
+    @property
+    def blocked_for(self) -> float:
+        return max(0.0, self._blocked_until - time.monotonic())
+
+    async def acquire(self, key: str) -> None:
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        if key not in self._waiters:
+            self._waiters[key] = deque()
+            self._order.append(key)
+        self._waiters[key].append(fut)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await fut
+
+    def on_response(self, status: int, retry_after: float | None = None) -> None:
+        record_response(self.host, status)
+        now = time.monotonic()
+        if is_throttle_status(status):
+            if now < self._blocked_until:
+                # responses of requests sent before the pause don't count twice
+                return
+            self._throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            backoff = retry_after if retry_after is not None else min(self.max_backoff, self.base_backoff * 2 ** (self._throttled - 1))
+            self._blocked_until = now + backoff * (1 + random.random() / 2)
+            self._tokens = 0.0
+            logger.warning(f"{self.host} throttled with {status}: rate {self.rate:.2f} rps, pause {self._blocked_until - now:.1f}s")
+        elif status < 400:
+            self._throttled = 0
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _next_waiter(self) -> asyncio.Future[None] | None:
+        while self._order:
+            key = self._order.popleft()
+            waiters = self._waiters[key]
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                del self._waiters[key]
+                continue
+            fut = waiters.popleft()
+            if waiters:
+                self._order.append(key)
+            else:
+                del self._waiters[key]
+            return fut
+        return None
+
+    async def _dispatch(self) -> None:
+        while self._order:
+            now = time.monotonic()
+            self._refill(now)
+            delay = max(self._blocked_until - now, (1.0 - self._tokens) / self.rate)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            fut = self._next_waiter()
+            if fut is None:
+                return
+            self._tokens -= 1.0
+            fut.set_result(None)
+
+
+_limiters: dict[str, HostRateLimiter] = {}
+
+
+def get_host_limiter(host: str) -> HostRateLimiter:
+    limiter = _limiters.get(host)
+    if limiter is None:
+        limiter = HostRateLimiter(
+            host,
+            rate=settings.HOST_RPS,
+            min_rate=settings.HOST_RPS_MIN,
+            max_rate=settings.HOST_RPS_MAX,
+            burst=settings.HOST_BURST,
+        )
+        _limiters[host] = limiter
+    return limiter
+
+
+def reset_host_limiters() -> None:
+    """Forget the learned rates, next get_host_limiter builds limiters from the current settings."""
+    _limiters.clear()
@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+
+from src.common.disk_cache import DiskCache
+
+
+def test_disk_cache_roundtrip_and_expiry(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path, max_bytes=2**20)
+    cache.set("channel/100", b"<html>page</html>" * 100, ttl=60)
+    assert cache.get("channel/100") == b"<html>page</html>" * 100
+    assert cache.get("channel/99") is None
+    cache.set("channel/100", b"stale", ttl=-1)
+    assert cache.get("channel/100") is None
+    assert not list(tmp_path.glob("*/*"))
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path, max_bytes=3000, compress_level=0)
+    for n in range(3):
+        cache.set(f"page/{n}", os.urandom(800), ttl=60)
+        os.utime(cache._path(f"page/{n}"), (1000 + n, 1000 + n))  # noqa: SLF001
+    # page/0 is read last, page/1 is now the least recently used
+    assert cache.get("page/0") is not None
+    cache.set("page/3", os.urandom(800), ttl=60)
+    assert cache.get("page/1") is None
+    assert cache.get("page/0") is not None
+    assert cache.get("page/3") is not None
+
+
+def test_disk_cache_drops_short_and_corrupt_entries(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path, max_bytes=2**20)
+    cache.set("page/empty", b"value", ttl=60)
+    cache.set("page/corrupt", b"value", ttl=60)
+    # an entry evicted by another process and recreated empty, or cut short
+    cache._path("page/empty").write_bytes(b"")  # noqa: SLF001
+    cache._path("page/corrupt").write_bytes(cache._path("page/corrupt").read_bytes()[:-3])  # noqa: SLF001
+    assert cache.get("page/empty") is None
+    assert cache.get("page/corrupt") is None
+    assert not list(tmp_path.glob("*/*"))
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.common.async_utils import sync_to_async
+from src.common.executors import ExecutorProfile, InstrumentedExecutor, executors_snapshot
+
+
+def test_executor_reports_queue_depth_and_times() -> None:
+    executor = InstrumentedExecutor(ExecutorProfile.LLM_THREADS)
+    executor.size = 2
+    release = threading.Event()
+
+    async def main() -> None:
+        calls = [asyncio.create_task(executor.run(release.wait, 5)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert executor.active == 2
+        assert executor.queue_depth == 3
+        release.set()
+        assert await asyncio.gather(*calls) == [True] * 5
+        with pytest.raises(ZeroDivisionError):
+            await executor.run(divmod, 1, 0)
+
+    try:
+        asyncio.run(main())
+    finally:
+        executor.shutdown()
+    snapshot = executor.snapshot()
+    assert snapshot["queue_depth"] == 0
+    assert snapshot["completed"] == 5
+    assert snapshot["failed"] == 1
+    assert snapshot["run_time"]["count"] == 5
+    assert snapshot["wait_time"]["buckets"]["+Inf"] == 5
+
+
+def test_sync_to_async_runs_on_profile() -> None:
+    @sync_to_async(profile=ExecutorProfile.LLM_THREADS)
+    def thread_name(suffix: str = "") -> str:
+        return threading.current_thread().name + suffix
+
+    @sync_to_async
+    def io_thread_name() -> str:
+        return threading.current_thread().name
+
+    before = executors_snapshot()[ExecutorProfile.LLM_THREADS.value]["completed"]
+    name = asyncio.run(thread_name(suffix="!"))
+    assert name.startswith(ExecutorProfile.LLM_THREADS.value)
+    assert name.endswith("!")
+    assert asyncio.run(thread_name()).startswith(ExecutorProfile.LLM_THREADS.value)
+    assert asyncio.run(io_thread_name()).startswith(ExecutorProfile.IO_THREADS.value)
+    assert executors_snapshot()[ExecutorProfile.LLM_THREADS.value]["completed"] == before + 2
@@ -0,0 +1,29 @@
+import asyncio
+
+import aiohttp
+
+from src.common.http_utils import close_http_session, get_http_session
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    return get_http_session()
+
+
+def test_every_event_loop_keeps_its_own_session() -> None:
+    loop_a, loop_b = asyncio.new_event_loop(), asyncio.new_event_loop()
+    try:
+        session_a = loop_a.run_until_complete(_get_session())
+        session_b = loop_b.run_until_complete(_get_session())
+        assert session_b is not session_a
+        # switching back finds the session of the loop, not a new one with the old left open
+        assert loop_a.run_until_complete(_get_session()) is session_a
+        assert not session_a.closed
+
+        loop_a.run_until_complete(close_http_session())
+        assert session_a.closed
+        assert not session_b.closed
+        loop_b.run_until_complete(close_http_session())
+        assert session_b.closed
+    finally:
+        loop_a.close()
+        loop_b.close()
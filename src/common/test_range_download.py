@@ -0,0 +1,126 @@
+import os
+import re
+import time
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from src.common.range_download import BandwidthLimiter, DownloadError, PartState, RangeDownloader
+from src.common.rate_limit import reset_host_limiters
+
+BLOB = os.urandom(200_000)
+CHUNK = 32 * 1024
+
+
+class MediaServer:
+    """Serves BLOB with range support, cut_after cuts the answers to the first requests of a range start after n bytes"""
+
+    def __init__(self) -> None:
+        self.ranges: list[str] = []
+        self.cut_after: dict[int, int] = {}
+        self.runner: web.AppRunner | None = None
+
+    async def media(self, request: web.Request) -> web.StreamResponse:
+        header = request.headers.get("Range", "")
+        self.ranges.append(header)
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", header)
+        if match is None:
+            return web.Response(body=BLOB)
+        start = int(match[1])
+        end = min(int(match[2]) if match[2] else len(BLOB) - 1, len(BLOB) - 1)
+        body = BLOB[start : end + 1]
+        response = web.StreamResponse(status=206, headers={"Content-Range": f"bytes {start}-{end}/{len(BLOB)}", "Content-Length": str(len(body))})
+        await response.prepare(request)
+        cut = self.cut_after.pop(start, None)
+        await response.write(body[:cut] if cut is not None else body)
+        if cut is not None:
+            # the client sees a connection dropped mid body
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/media.webm", self.media)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}/media.webm"
+
+
+@pytest.fixture
+async def server() -> AsyncIterator[tuple[MediaServer, str]]:
+    reset_host_limiters()
+    media_server = MediaServer()
+    url = await media_server.start()
+    yield media_server, url
+    assert media_server.runner is not None
+    await media_server.runner.cleanup()
+
+
+def _downloader(session: aiohttp.ClientSession, *, max_retries: int = 3) -> RangeDownloader:
+    return RangeDownloader(session, chunk_size=CHUNK, chunks_per_file=3, connections=4, bytes_per_second=0, max_retries=max_retries, base_backoff=0.01)
+
+
+async def test_downloads_in_range_chunks(server: tuple[MediaServer, str], tmp_path: Path) -> None:
+    media_server, url = server
+    dst = tmp_path / "media" / "post.webm"
+    progress: list[tuple[int, int]] = []
+    async with aiohttp.ClientSession() as session:
+        size = await _downloader(session).download(url, dst, on_progress=lambda done, total: progress.append((done, total)))
+        assert size == len(BLOB)
+        assert dst.read_bytes() == BLOB
+        assert not dst.with_name("post.webm.part").exists()
+        assert not dst.with_name("post.webm.part.json").exists()
+        chunks = -(-len(BLOB) // CHUNK)
+        assert media_server.ranges[0] == "bytes=0-0"
+        assert len(media_server.ranges) == 1 + chunks
+        assert progress[-1] == (len(BLOB), len(BLOB))
+
+        # a file on disk is not downloaded again
+        await _downloader(session).download(url, dst)
+    assert len(media_server.ranges) == 1 + chunks
+
+
+async def test_cut_chunk_resumes_from_its_last_byte(server: tuple[MediaServer, str], tmp_path: Path) -> None:
+    media_server, url = server
+    media_server.cut_after[CHUNK] = 10_000
+    dst = tmp_path / "post.webm"
+    async with aiohttp.ClientSession() as session:
+        await _downloader(session).download(url, dst)
+    assert dst.read_bytes() == BLOB
+    assert f"bytes={CHUNK + 10_000}-{2 * CHUNK - 1}" in media_server.ranges
+
+
+async def test_failed_download_is_resumed_by_the_next_run(server: tuple[MediaServer, str], tmp_path: Path) -> None:
+    media_server, url = server
+    media_server.cut_after[2 * CHUNK] = 5_000
+    dst = tmp_path / "post.webm"
+    async with aiohttp.ClientSession() as session:
+        with pytest.raises(DownloadError):
+            await _downloader(session, max_retries=0).download(url, dst)
+        assert not dst.exists()
+        state = PartState.model_validate_json(dst.with_name("post.webm.part.json").read_bytes())
+        # the other chunks went on and are kept
+        assert state.written[2] == 5_000
+        assert sum(state.written) == len(BLOB) - CHUNK + 5_000
+
+        media_server.ranges.clear()
+        await _downloader(session).download(url, dst)
+    assert dst.read_bytes() == BLOB
+    assert media_server.ranges == ["bytes=0-0", f"bytes={2 * CHUNK + 5_000}-{3 * CHUNK - 1}"]
+
+
+async def test_bandwidth_limiter_paces_bytes() -> None:
+    limiter = BandwidthLimiter(100_000, burst=10_000)
+    started = time.monotonic()
+    for _ in range(4):
+        await limiter.acquire(10_000)
+    # the burst goes at once, the other 30 kB take 0.3 s
+    assert time.monotonic() - started >= 0.28
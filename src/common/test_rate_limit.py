@@ -0,0 +1,48 @@
+import asyncio
+
+from src.common.rate_limit import HostRateLimiter, record_response, take_response_counts
+
+
+def _limiter(rate: float = 1000.0, burst: int = 1) -> HostRateLimiter:
+    return HostRateLimiter("test.host", rate=rate, min_rate=1.0, max_rate=2000.0, burst=burst, base_backoff=0.01)
+
+
+async def test_host_rate_limiter_round_robin_between_keys() -> None:
+    limiter = _limiter()
+    granted: list[str] = []
+
+    async def crawl(key: str, pages: int) -> None:
+        for _ in range(pages):
+            await limiter.acquire(key)
+            granted.append(key)
+
+    await asyncio.gather(*(crawl("huge", 1) for _ in range(20)), crawl("small_1", 3), crawl("small_2", 3))
+    # small channels are served within the first rounds instead of after the 20 queued pages of the huge one
+    assert granted.index("small_2") < 4
+    assert len(granted) == 26
+
+
+async def test_host_rate_limiter_aimd() -> None:
+    limiter = _limiter(rate=100.0)
+    limiter.on_response(200)
+    assert limiter.rate > 100.0
+    limiter.on_response(429)
+    assert limiter.rate < 51.0
+    assert limiter.blocked_for > 0
+    # throttles that arrive during the pause don't decrease the rate again
+    rate = limiter.rate
+    limiter.on_response(503)
+    assert limiter.rate == rate
+    await asyncio.sleep(limiter.blocked_for)
+    await limiter.acquire("channel")
+
+
+def test_response_counts_are_taken_once() -> None:
+    take_response_counts()
+    limiter = _limiter()
+    limiter.on_response(200)
+    limiter.on_response(200)
+    limiter.on_response(429)
+    record_response("api.host", 200)
+    assert take_response_counts() == {"test.host": (3, 1), "api.host": (1, 0)}
+    assert take_response_counts() == {}
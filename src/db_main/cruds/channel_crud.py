@@ -1,14 +1,14 @@
 from collections.abc import Sequence
 
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.db_main.models.channel import ChannelDbMdl
-from src.dto.feed_rec_info import Channel, Source
+from src.dto.feed_rec_info import Channel, HighWaterMark, Source
 
 
 async def get_channel_by_source_by_channel_name(db: AsyncSession, source: Source, channel_name: str) -> ChannelDbMdl:
-    channels = await db.execute(select(ChannelDbMdl).where((ChannelDbMdl.source == source) and (ChannelDbMdl.channel_name == channel_name)))
+    channels = await db.execute(select(ChannelDbMdl).where(ChannelDbMdl.source == source, ChannelDbMdl.channel_name == channel_name))
     return channels.scalars().first()
 
 
@@ -33,3 +33,19 @@ async def add_channel(db: AsyncSession, channel: Channel) -> ChannelDbMdl:
     db.add(channel)
     await db.commit()
     return channel
+
+
+async def get_channel_hwm(db: AsyncSession, source: Source, channel_name: str) -> HighWaterMark | None:
+    channel = await get_channel_by_source_by_channel_name(db, source, channel_name)
+    if channel is None or channel.hwm_post_id is None or channel.hwm_pb_date is None:
+        return None
+    return HighWaterMark(post_id=channel.hwm_post_id, pb_date=channel.hwm_pb_date)
+
+
+async def update_channel_hwm(db: AsyncSession, source: Source, channel_name: str, hwm: HighWaterMark) -> None:
+    await db.execute(
+        update(ChannelDbMdl)
+        .where(ChannelDbMdl.source == source, ChannelDbMdl.channel_name == channel_name)
+        .values(hwm_post_id=hwm.post_id, hwm_pb_date=hwm.pb_date)
+    )
+    await db.commit()
@@ -1,11 +1,12 @@
 from collections.abc import Sequence
+from datetime import datetime
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.db_main.cruds import channel_crud
 from src.db_main.models.post import PostDbMdl
-from src.dto.feed_rec_info import Post
+from src.dto.feed_rec_info import Post, Source
 
 
 async def get_posts_by_channel_id(db: AsyncSession, channel_id: int) -> Sequence[PostDbMdl]:
@@ -13,6 +14,14 @@ async def get_posts_by_channel_id(db: AsyncSession, channel_id: int) -> Sequence
     return posts.scalars().all()
 
 
+async def get_post_ids_in_window(db: AsyncSession, source: Source, channel_name: str, dt_from: datetime, dt_to: datetime) -> list[str]:
+    channel = await channel_crud.get_channel_by_source_by_channel_name(db, source, channel_name)
+    if channel is None:
+        return []
+    post_ids = await db.execute(select(PostDbMdl.post_id).where(PostDbMdl.channel_id == channel.id, PostDbMdl.pb_date >= dt_from, PostDbMdl.pb_date <= dt_to))
+    return list(post_ids.scalars().all())
+
+
 async def get_post_by_id(db: AsyncSession, post_id: int) -> PostDbMdl:
     post = await db.execute(select(PostDbMdl).where(PostDbMdl.id == post_id))
     return post.scalars().first()
@@ -18,4 +18,6 @@ class ChannelDbMdl(Base):
     created_channel_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     description: Mapped[str] = mapped_column(nullable=False, default="", server_default="")
     link: Mapped[str] = mapped_column(nullable=False, default="", server_default="")
+    hwm_post_id: Mapped[str | None] = mapped_column(nullable=True, default=None)
+    hwm_pb_date: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None)
     # relationships:
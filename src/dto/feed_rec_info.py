@@ -103,11 +103,33 @@ class Post(BaseModel):
     media: RawPostMediaExt | None
 
 
+class HighWaterMark(BaseModel):
+    post_id: str
+    pb_date: datetime
+
+
+class CrawlWindow(BaseModel):
+    dt_to: datetime
+    dt_from: datetime
+    stopped: bool = False
+    # set by the crawl once it reached dt_from, the high water mark or the start of the channel
+    completed: bool = False
+
+
+class CrawlEnd(BaseModel):
+    """Last line of a streamed crawl, a stream that ends without it was cut short"""
+
+    completed: bool
+
+
 class Task(BaseModel):
     source: Source
     channel_name: str
     dt_to: datetime
     dt_from: datetime
+    incremental: bool = False
+    # ids of the window already in the db, the youtube listing skips them
+    known_post_ids: list[str] = []
 
 
 class TaskEnum(Enum):
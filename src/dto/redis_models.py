@@ -6,6 +6,16 @@ from src.dto.feed_rec_info import Source
 class RedisTask(Enum):
     channel_tasks = ("channel_tasks",)
     counter_of_workers = "cow"
+    running_tasks = "running_tasks"
+    split_parts = "split_parts"
+    started_tasks = "started_tasks"
+    sent_tasks = "sent_tasks"
+    channel_priority = "channel_priority"
+    channel_deficit = "channel_deficit"
+    channel_waiting_since = "channel_waiting_since"
+    refresh_requests = "refresh_requests"
+    autoscale_lock = "autoscale_lock"
+    autoscale_decisions = "autoscale_decisions"
 
 
 class RedisChannels(Enum):
@@ -32,3 +42,25 @@ def source_channel_name_dt_from(source: Source, channel_name: str):
 
 def source_channel_name_status(source: Source, channel_name: str):
     return f"{source.value}_{channel_name}_status"
+
+
+def source_channel_name_hwm(source: Source, channel_name: str):
+    return f"{source.value}_{channel_name}_hwm"
+
+
+def source_channel_name_control(source: Source, channel_name: str):
+    return f"{source.value}_{channel_name}_control"
+
+
+def source_channel_name_post_stage(source: Source, channel_name: str, post_id: str, kind: str, crawl_id: str | None = None):
+    if crawl_id is None:
+        return f"{source.value}_{channel_name}_{post_id}_{kind}_stage"
+    return f"{source.value}_{channel_name}_{post_id}_{kind}_{crawl_id}_stage"
+
+
+def source_channel_name_post_download(source: Source, channel_name: str, post_id: str):
+    return f"{source.value}_{channel_name}_{post_id}_download"
+
+
+def crawl_batches(crawl_id: str) -> str:
+    return f"{crawl_id}_crawl_batches"
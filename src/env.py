@@ -5,7 +5,7 @@ from enum import Enum, unique
 from pathlib import Path
 from typing import Final
 
-from pydantic import HttpUrl, PostgresDsn, SecretStr
+from pydantic import HttpUrl, PositiveFloat, PostgresDsn, SecretStr
 from pydantic_settings import BaseSettings
 
 ROOT_PATH = Path(__file__).parent.parent
@@ -36,6 +36,12 @@ class AppEnv(Enum):
     PROD = "prod"
 
 
+@unique
+class ScraperTransport(Enum):
+    IN_PROCESS = "in_process"
+    REMOTE = "remote"
+
+
 class LogLevel(Enum):
     DEBUG = "DEBUG"
     INFO = "INFO"
@@ -67,6 +73,76 @@ class Settings(BaseSettings):
     QDRANT_URL: HttpUrl
     CACHE_DB_URL: str
 
+    HTTP_LIMIT: int = 100
+    HTTP_LIMIT_PER_HOST: int = 20
+    HTTP_KEEPALIVE_TIMEOUT: float = 30.0
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_TIMEOUT_TOTAL: float = 60.0
+    HTTP_TIMEOUT_CONNECT: float = 10.0
+    HTTP_TIMEOUT_SOCK_READ: float = 30.0
+
+    HOST_RPS: float = 5.0
+    HOST_RPS_MIN: float = 0.5
+    HOST_RPS_MAX: float = 30.0
+    HOST_BURST: int = 10
+    HTTP_MAX_RETRIES: int = 5
+
+    EXECUTOR_IO_THREADS: int = 32
+    EXECUTOR_CPU_PROCESSES: int = 4
+    EXECUTOR_LLM_THREADS: int = 8
+
+    SCRAPER_TRANSPORT: ScraperTransport = ScraperTransport.IN_PROCESS
+    SCRAPER_API_URL: str = "http://localhost:50001"
+    DISPATCH_LEASE_TTL: int = 300
+    # a task that waits in the broker longer is taken as lost and its window is queued again
+    DISPATCH_START_TIMEOUT: int = 6 * 3600
+    DISPATCH_SPLIT_SPAN_DAYS: int = 31
+    DISPATCH_SPLIT_MAX_PARTS: int = 48
+    # deficit round robin divides by the weights, see scheduler
+    SCHEDULER_SOURCE_WEIGHTS: dict[str, PositiveFloat] = {"telegram": 1.0, "youtube": 1.0}
+    SCHEDULER_AGING_SECONDS: float = 600.0
+    SCHEDULER_INTERACTIVE_SLOTS: int = 2
+    AUTOSCALE_ENABLED: bool = True
+    AUTOSCALE_MIN_WORKERS: int = 1
+    AUTOSCALE_MAX_WORKERS: int = 16
+    # a bit under the period of the manager beat, so every sweep may decide once
+    AUTOSCALE_INTERVAL_SECONDS: float = 50.0
+    AUTOSCALE_WINDOW_SECONDS: float = 300.0
+    AUTOSCALE_THROTTLE_RATE: float = 0.05
+    AUTOSCALE_MIN_RESPONSES: int = 20
+    AUTOSCALE_DECREASE: float = 0.5
+    AUTOSCALE_STAGE_LATENCY_MAX: dict[str, float] = {"persist": 60.0, "archive": 60.0, "summarize": 300.0, "embed": 120.0}
+    AUTOSCALE_LATENCY_SAMPLES: int = 50
+    AUTOSCALE_DECISIONS_KEPT: int = 50
+    MEDIA_DOWNLOAD_ENABLED: bool = False
+    MEDIA_DOWNLOAD_CHUNK_MB: int = 8
+    MEDIA_DOWNLOAD_CHUNKS_PER_FILE: int = 4
+    MEDIA_DOWNLOAD_CONNECTIONS: int = 16
+    MEDIA_DOWNLOAD_FILES: int = 8
+    # 0 is unlimited
+    MEDIA_DOWNLOAD_MAX_MB_PER_SECOND: float = 0.0
+    MEDIA_DOWNLOAD_PROGRESS_TTL: int = 7 * 24 * 3600
+    INGEST_STAGE_TTL: int = 24 * 3600
+
+    CRAWL_MAX_CHANNELS: int = 32
+    STREAM_BATCH_SIZE: int = 500
+    CRAWL_ACCUMULATOR_MAX_MB: int = 64
+
+    TELEGRAM_HTML_BACKEND: str = "lxml"
+    YOUTUBE_EXTRACT_CONCURRENCY: int = 8
+    YOUTUBE_SUBTITLE_CONCURRENCY: int = 4
+    YOUTUBE_INFO_CACHE: bool = True
+    YOUTUBE_INFO_CACHE_MAX_MB: int = 256
+    YOUTUBE_INFO_META_TTL: float = 90 * 24 * 3600.0
+    YOUTUBE_INFO_FORMATS_TTL: float = 3 * 3600.0
+    YOUTUBE_INFO_FORMATS_MARGIN: float = 600.0
+    TELEGRAM_BASE_URL: str = "https://t.me"
+    TELEGRAM_PAGE_CACHE: bool = True
+    TELEGRAM_PAGE_CACHE_MAX_MB: int = 512
+    TELEGRAM_PAGE_CACHE_TTL_MIN: float = 600.0
+    TELEGRAM_PAGE_CACHE_TTL_MAX: float = 30 * 24 * 3600.0
+    TELEGRAM_PAGE_CACHE_TTL_AGE_RATIO: float = 0.1
+
     @property
     def is_local(self) -> bool:
         return self.ENV == AppEnv.LOCAL
@@ -95,6 +171,8 @@ SCRAPPER_RESULTS_DIR__YOUTUBE.mkdir(exist_ok=True, parents=True)
 SCRAPPER_RESULTS_DIR__INSTAGRAM.mkdir(exist_ok=True, parents=True)
 SCRAPPER_RESULTS_DIR__TELEGRAM.mkdir(exist_ok=True, parents=True)
 
+CACHE_DIR = settings.ROOT_PATH / ".var" / "cache"
+
 """db_config = {
     "host": os.environ.get("DB_HOST"),  # localhost
     "port": os.environ.get("DB_PORT"),  # 40438
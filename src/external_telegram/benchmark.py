@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import statistics
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+
+from src.common import rate_limit
+from src.common.http_utils import create_http_session
+from src.dto.feed_rec_info import CrawlWindow
+from src.env import settings
+from src.external_telegram import telegram_scrapy
+from src.external_telegram.replay_server import FIXTURES_DIR, ReplayConfig, ReplayServer, ReplayStats, load_corpus, synthesize_corpus
+
+logger = logging.getLogger(__name__)
+
+CORPUS_START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class BenchmarkResult:
+    pages_in_flight: int
+    channels: int
+    seconds: float
+    pages: int
+    posts: int
+    pages_per_s: float
+    posts_per_s: float
+    p50_ms: float
+    p99_ms: float
+    peak_rss_mb: float
+    throttled: int
+    empty: int
+
+
+def _rss_bytes() -> int:
+    try:
+        with Path("/proc/self/statm").open() as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is the peak of the whole process (KiB on linux), good enough where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RssSampler(threading.Thread):
+    """Samples RSS from a thread, so CPU bound parsing on the loop doesn't hide the peak"""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, _rss_bytes())
+
+
+def _latency_trace(latencies: list[float]) -> aiohttp.TraceConfig:
+    async def on_request_start(session: aiohttp.ClientSession, ctx: SimpleNamespace, params: aiohttp.TraceRequestStartParams) -> None:
+        ctx.started_at = time.perf_counter()
+
+    async def on_request_end(session: aiohttp.ClientSession, ctx: SimpleNamespace, params: aiohttp.TraceRequestEndParams) -> None:
+        latencies.append(time.perf_counter() - ctx.started_at)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+@contextmanager
+def _replay_in_thread(server: ReplayServer) -> Iterator[str]:
+    """The replay server gets its own loop, so serving pages doesn't compete with the scraper loop"""
+    loop = asyncio.new_event_loop()
+    started: Future[str] = Future()
+    stopped = asyncio.Event()
+
+    async def serve() -> None:
+        async with server.serve() as base_url:
+            started.set_result(base_url)
+            await stopped.wait()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    thread.start()
+    base_url = started.result(timeout=10)
+    try:
+        yield base_url
+    finally:
+        loop.call_soon_threadsafe(stopped.set)
+        thread.join()
+        loop.close()
+
+
+async def run_level(pages_in_flight: int, channels: int, stats: ReplayStats) -> BenchmarkResult:
+    """One benchmark run: `channels` crawls of the whole corpus at once, each with pages_in_flight pages in flight"""
+    rate_limit.reset_host_limiters()
+    latencies: list[float] = []
+    window = CrawlWindow(dt_to=datetime(2100, 1, 1, tzinfo=timezone.utc), dt_from=datetime(2000, 1, 1, tzinfo=timezone.utc))
+    throttled, empty = stats.throttled, stats.empty
+    async with create_http_session(trace_configs=[_latency_trace(latencies)]) as session:
+        sampler = _RssSampler()
+        sampler.start()
+        started_at = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                telegram_scrapy.get_channel_messages(f"bench_{n}", window, pages_in_flight=pages_in_flight, session=session, log_extra={})
+                for n in range(channels)
+            )
+        )
+        seconds = time.perf_counter() - started_at
+        peak_rss = sampler.stop()
+    posts = sum(len(posts or []) for posts in results)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99 or [0.0] * 99
+    return BenchmarkResult(
+        pages_in_flight=pages_in_flight,
+        channels=channels,
+        seconds=round(seconds, 3),
+        pages=len(latencies),
+        posts=posts,
+        pages_per_s=round(len(latencies) / seconds, 1),
+        posts_per_s=round(posts / seconds, 1),
+        p50_ms=round(quantiles[49] * 1000, 2),
+        p99_ms=round(quantiles[98] * 1000, 2),
+        peak_rss_mb=round(peak_rss / 2**20, 1),
+        throttled=stats.throttled - throttled,
+        empty=stats.empty - empty,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of telegram_scrapy.get_channel_messages against the offline replay server")
+    parser.add_argument("--corpus", type=Path, default=FIXTURES_DIR)
+    parser.add_argument("--posts", type=int, default=5000, help="synthesize a channel of that many posts from the corpus, 0 replays it as is")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="pages in flight per channel")
+    parser.add_argument("--channels", type=int, default=1, help="channels crawled at once")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--rps", type=float, default=1000.0, help="host rate limit of the scraper during the benchmark")
+    parser.add_argument("--json", action="store_true", help="print results as json lines")
+    args = parser.parse_args()
+    # per page warnings of the scraper (end of channel, empty pages) would drown the table
+    logging.getLogger(telegram_scrapy.__name__).setLevel(logging.ERROR)
+
+    corpus = load_corpus(args.corpus)
+    if args.posts:
+        corpus = synthesize_corpus(corpus, args.posts, start=CORPUS_START, step=timedelta(hours=1))
+    config = ReplayConfig(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate, empty_rate=args.empty_rate, retry_after=0)
+    server = ReplayServer(corpus, config)
+
+    settings.HOST_RPS = settings.HOST_RPS_MAX = args.rps
+    settings.HOST_BURST = max(settings.HOST_BURST, max(args.concurrency) * args.channels)
+    settings.HTTP_LIMIT_PER_HOST = max(settings.HTTP_LIMIT_PER_HOST, max(args.concurrency) * args.channels)
+    with _replay_in_thread(server) as base_url:
+        settings.TELEGRAM_BASE_URL = base_url
+        results = [asyncio.run(run_level(level, args.channels, server.stats)) for level in args.concurrency]
+
+    if args.json:
+        for result in results:
+            print(json.dumps(asdict(result)))  # noqa: T201
+        return
+    columns = list(BenchmarkResult.__dataclass_fields__)
+    print(" ".join(f"{column:>15}" for column in columns))  # noqa: T201
+    for result in results:
+        print(" ".join(f"{value!s:>15}" for value in asdict(result).values()))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
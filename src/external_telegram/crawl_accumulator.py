@@ -0,0 +1,146 @@
+import heapq
+import logging
+import pickle
+import sys
+import tempfile
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from types import TracebackType
+from typing import IO, Final
+
+from pydantic import HttpUrl
+
+from src.dto.feed_rec_info import Post, Source
+
+logger: Final = logging.getLogger(__name__)
+
+# rough python overhead of one record with its strings, on top of the text itself
+_RECORD_OVERHEAD: Final = 200
+
+# spilled runs hold (-timestamp, -post_id, content, link), so plain tuple order is newest first
+_RunItem = tuple[float, int, str | None, str]
+
+
+class IdSet:
+    """Set of positive post ids as a growable bitmap, telegram ids of a channel are dense, 1M ids take 125KB"""
+
+    __slots__ = ("_bits", "_len")
+
+    def __init__(self) -> None:
+        self._bits = bytearray()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, post_id: int) -> bool:
+        byte = post_id >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (post_id & 7)))
+
+    def add(self, post_id: int) -> bool:
+        """Adds the id, returns False if it was already there"""
+        byte = post_id >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(max(byte + 1 - len(self._bits), len(self._bits))))
+        mask = 1 << (post_id & 7)
+        if self._bits[byte] & mask:
+            return False
+        self._bits[byte] |= mask
+        self._len += 1
+        return True
+
+
+class _PostRecord:
+    __slots__ = ("content", "link", "post_id", "timestamp")
+
+    def __init__(self, post_id: int, timestamp: float, content: str | None, link: str) -> None:
+        self.post_id = post_id
+        self.timestamp = timestamp
+        self.content = content
+        self.link = link
+
+    def run_item(self) -> _RunItem:
+        return -self.timestamp, -self.post_id, self.content, self.link
+
+
+class CrawlAccumulator:
+    """
+    Posts of one channel crawl: ids are deduplicated in an IdSet and posts are kept as compact records.
+    Past max_bytes the records are sorted newest first and spilled as a run to a temp file,
+    iterating merges the runs with what is left in memory back into Posts, newest first.
+    """
+
+    def __init__(self, source: Source, channel_name: str, *, max_bytes: int) -> None:
+        self.source = source
+        self.channel_name = channel_name
+        self.max_bytes = max_bytes
+        self._ids = IdSet()
+        self._records: list[_PostRecord] = []
+        self._records_bytes = 0
+        self._runs: list[IO[bytes]] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __enter__(self) -> "CrawlAccumulator":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None) -> None:
+        self.close()
+
+    def add(self, post: Post) -> bool:
+        """Keeps the post unless its id was already added, returns whether it was new"""
+        post_id = int(post.post_id)
+        if not self._ids.add(post_id):
+            return False
+        self._records.append(_PostRecord(post_id, post.pb_date.timestamp(), post.content, str(post.link)))
+        self._records_bytes += _RECORD_OVERHEAD + (sys.getsizeof(post.content) if post.content is not None else 0)
+        if self._records_bytes > self.max_bytes:
+            self._spill()
+        return True
+
+    def extend(self, posts: Iterable[Post]) -> int:
+        return sum(self.add(post) for post in posts)
+
+    def _spill(self) -> None:
+        run = tempfile.TemporaryFile(prefix=f"crawl_{self.channel_name}_")
+        pickler = pickle.Pickler(run, protocol=pickle.HIGHEST_PROTOCOL)
+        for item in sorted(record.run_item() for record in self._records):
+            pickler.dump(item)
+            # the memo would keep every spilled string alive
+            pickler.clear_memo()
+        logger.debug(f"crawl of {self.channel_name}: spilled {len(self._records)} posts to run {len(self._runs)}")
+        self._runs.append(run)
+        self._records = []
+        self._records_bytes = 0
+
+    @staticmethod
+    def _read_run(run: IO[bytes]) -> Iterator[_RunItem]:
+        run.seek(0)
+        unpickler = pickle.Unpickler(run)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+    def __iter__(self) -> Iterator[Post]:
+        in_memory = sorted(record.run_item() for record in self._records)
+        for neg_timestamp, neg_post_id, content, link in heapq.merge(in_memory, *(self._read_run(run) for run in self._runs)):
+            yield Post(
+                source=self.source,
+                channel_name=self.channel_name,
+                post_id=str(-neg_post_id),
+                title=None,
+                description=None,
+                content=content,
+                pb_date=datetime.fromtimestamp(-neg_timestamp, tz=timezone.utc),
+                link=HttpUrl(link),
+                media=None,
+            )
+
+    def close(self) -> None:
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._records = []
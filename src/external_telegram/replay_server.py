@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import logging
+import random
+import re
+from bisect import bisect_right
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from aiohttp import web
+from lxml import etree
+
+from src.common.http_utils import close_http_session, get_http_session
+from src.external_telegram.telegram_html import _has_class
+from src.external_telegram.telegram_scrapy import PAGE_STRIDE, TELEGRAM_HOST, _fetch_page
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+_xp_message_wraps = etree.XPath(f"//{_has_class('div', 'tgme_widget_message_wrap')}")
+_xp_message_post = etree.XPath(f"string(.//{_has_class('div', 'tgme_widget_message')}/@data-post)")
+_re_data_post = re.compile(r'data-post="([^"/]+)/\d+"')
+_re_post_link = re.compile(r'(https://t\.me/[^"/]+/)\d+"')
+_re_datetime = re.compile(r'datetime="[^"]+"')
+
+PAGE_HEAD = """<!DOCTYPE html>
+<html>
+  <head><meta charset="utf-8"><title>{channel} – Telegram</title></head>
+  <body class="widget_frame_base tgme_webpage_body">
+    <main class="tgme_main">
+      <section class="tgme_channel_history js-message_history">
+"""
+PAGE_MORE = (
+    '        <div class="tgme_widget_message_centered js-messages_more_wrap">'
+    '<a href="/s/{channel}?before={before}" class="tme_messages_more js-messages_more" data-before="{before}"></a></div>\n'
+)
+PAGE_TAIL = """      </section>
+    </main>
+  </body>
+</html>
+"""
+
+
+def load_corpus(corpus_dir: Path = FIXTURES_DIR) -> dict[int, str]:
+    """
+    Message blocks of every recorded page in corpus_dir by post id, a post recorded on several pages is kept once
+    """
+    messages: dict[int, str] = {}
+    for page in sorted(corpus_dir.glob("*.html")):
+        root = etree.HTML(page.read_text())
+        if root is None:
+            continue
+        for wrap in _xp_message_wraps(root):
+            post_id = _xp_message_post(wrap).rsplit("/", 1)[-1]
+            if post_id.isdigit():
+                messages[int(post_id)] = etree.tostring(wrap, encoding="unicode", method="html", with_tail=False)
+    logger.debug(f"replay corpus {corpus_dir}: {len(messages)} posts")
+    return messages
+
+
+def synthesize_corpus(corpus: dict[int, str], n_posts: int, *, start: datetime, step: timedelta, seed: int = 0) -> dict[int, str]:
+    """
+    Channel of n_posts built from the recorded message blocks, ids get random gaps like deleted posts and dates grow with ids
+    """
+    rnd = random.Random(seed)
+    templates = [corpus[post_id] for post_id in sorted(corpus)]
+    messages: dict[int, str] = {}
+    post_id = 0
+    for n in range(n_posts):
+        post_id += 1 + (rnd.random() < 0.2)
+        block = _re_data_post.sub(rf'data-post="\1/{post_id}"', templates[n % len(templates)])
+        block = _re_post_link.sub(rf'\g<1>{post_id}"', block)
+        messages[post_id] = _re_datetime.sub(f'datetime="{(start + step * n).isoformat()}"', block)
+    return messages
+
+
+async def record_channel(channel_name: str, out_dir: Path, *, max_pages: int = 10) -> int:
+    """
+    Saves the pages of a live channel as <channel>.html and <channel>__<before>.html, returns the number of pages
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    before_id: int | None = None
+    pages = 0
+    try:
+        while pages < max_pages and (before_id is None or before_id >= 1):
+            status, html_text = await _fetch_page(get_http_session(), channel_name, before_id)
+            if status != 200 or not html_text:
+                logger.warning(f"record_channel({channel_name}) :: page {before_id} failed with {status}")
+                break
+            ids = [int(post_id) for post_id in re.findall(rf'data-post="{re.escape(channel_name)}/(\d+)"', html_text)]
+            if not ids:
+                break
+            name = f"{channel_name}.html" if before_id is None else f"{channel_name}__{before_id}.html"
+            (out_dir / name).write_text(html_text)
+            pages += 1
+            before_id = min(ids) - 1
+    finally:
+        await close_http_session()
+    return pages
+
+
+@dataclass
+class ReplayConfig:
+    """
+    latency/jitter are seconds per page, throttle_rate/empty_rate the share of pages answered with 429 or without posts.
+    Post ids in throttle_pages/empty_pages fail once on demand, the next request for that page is served normally.
+    """
+
+    page_size: int = PAGE_STRIDE
+    latency: float = 0.0
+    jitter: float = 0.0
+    throttle_rate: float = 0.0
+    empty_rate: float = 0.0
+    retry_after: int | None = 1
+    throttle_pages: set[int] = field(default_factory=set)
+    empty_pages: set[int] = field(default_factory=set)
+    seed: int = 0
+
+
+@dataclass
+class ReplayStats:
+    pages: int = 0
+    throttled: int = 0
+    empty: int = 0
+
+
+class ReplayServer:
+    """
+    Serves a corpus as t.me/s/<channel> pages: /s/<channel> is the newest page, /s/<channel>/<id> ends at post id
+    and /s/<channel>?before=<id> ends right below it. Every channel name gets the same corpus.
+    """
+
+    def __init__(self, corpus: dict[int, str], config: ReplayConfig | None = None) -> None:
+        self.config = config or ReplayConfig()
+        self.stats = ReplayStats()
+        self._ids = sorted(corpus)
+        self._blocks = [corpus[post_id] for post_id in self._ids]
+        self._random = random.Random(self.config.seed)
+
+    def _page_html(self, channel: str, last_id: int | None) -> str:
+        end = len(self._ids) if last_id is None else bisect_right(self._ids, last_id)
+        begin = max(0, end - self.config.page_size)
+        if begin >= end:
+            return PAGE_HEAD.format(channel=channel) + PAGE_TAIL
+        more = PAGE_MORE.format(channel=channel, before=self._ids[begin]) if begin > 0 else ""
+        return PAGE_HEAD.format(channel=channel) + more + "\n".join(self._blocks[begin:end]) + "\n" + PAGE_TAIL
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        config = self.config
+        last_id: int | None = None
+        if "post_id" in request.match_info:
+            last_id = int(request.match_info["post_id"])
+        elif request.query.get("before", "").isdigit():
+            last_id = int(request.query["before"]) - 1
+        self.stats.pages += 1
+        if config.latency or config.jitter:
+            await asyncio.sleep(max(0.0, config.latency + self._random.uniform(-config.jitter, config.jitter)))
+        if last_id in config.throttle_pages or self._random.random() < config.throttle_rate:
+            config.throttle_pages.discard(last_id)
+            self.stats.throttled += 1
+            headers = {} if config.retry_after is None else {"Retry-After": str(config.retry_after)}
+            return web.Response(status=429, headers=headers)
+        channel = request.match_info["channel"]
+        if last_id in config.empty_pages or self._random.random() < config.empty_rate:
+            config.empty_pages.discard(last_id)
+            self.stats.empty += 1
+            return web.Response(text=PAGE_HEAD.format(channel=channel) + PAGE_TAIL, content_type="text/html")
+        return web.Response(text=self._page_html(channel, last_id), content_type="text/html")
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/s/{channel}", self._handle)
+        app.router.add_get(r"/s/{channel}/{post_id:\d+}", self._handle)
+        return app
+
+    @asynccontextmanager
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> AsyncIterator[str]:
+        """Runs the server on the current loop and yields its base url, to be put in TELEGRAM_BASE_URL"""
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        try:
+            _, bound_port = runner.addresses[0][:2]
+            yield f"http://{host}:{bound_port}"
+        finally:
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=f"Offline replay of {TELEGRAM_HOST}/s/<channel> pages")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="serve a recorded corpus")
+    serve.add_argument("--corpus", type=Path, default=FIXTURES_DIR)
+    serve.add_argument("--posts", type=int, default=0, help="synthesize a channel of that many posts from the corpus")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=50080)
+    serve.add_argument("--latency", type=float, default=0.0)
+    serve.add_argument("--jitter", type=float, default=0.0)
+    serve.add_argument("--throttle-rate", type=float, default=0.0)
+    serve.add_argument("--empty-rate", type=float, default=0.0)
+    record = sub.add_parser("record", help="record pages of a live channel into a corpus")
+    record.add_argument("channel")
+    record.add_argument("--out", type=Path, default=FIXTURES_DIR)
+    record.add_argument("--pages", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        pages = asyncio.run(record_channel(args.channel, args.out, max_pages=args.pages))
+        logger.info(f"recorded {pages} pages of {args.channel} into {args.out}")
+        return
+
+    corpus = load_corpus(args.corpus)
+    if args.posts:
+        corpus = synthesize_corpus(corpus, args.posts, start=datetime.fromisoformat("2020-01-01T00:00:00+00:00"), step=timedelta(hours=1))
+    config = ReplayConfig(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate, empty_rate=args.empty_rate)
+    web.run_app(ReplayServer(corpus, config).make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import logging
+from collections.abc import Callable
+from datetime import datetime
+from enum import Enum, unique
+
+from bs4 import BeautifulSoup
+from lxml import etree
+from pydantic import HttpUrl
+
+from src.common.moment import as_utc
+from src.dto.feed_rec_info import Post, Source
+from src.env import settings
+
+logger = logging.getLogger(__name__)
+
+
+@unique
+class HtmlBackend(Enum):
+    BS4 = "bs4"
+    LXML = "lxml"
+
+
+def _make_post(channel_id: str, channel_name: str, message_id: str, utc_dt: datetime, text: str) -> Post:
+    return Post(
+        source=Source.TELEGRAM,
+        channel_name=channel_id,
+        post_id=str(int(message_id) if message_id.isdigit() else None),
+        title=None,
+        description=None,
+        content=text,
+        pb_date=utc_dt,
+        link=HttpUrl(f"https://t.me/{channel_name}/{message_id}"),
+        media=None,
+    )
+
+
+def extract_messages_bs4(html_content: str, channel_id: str, *, log_extra: dict[str, str]) -> list[Post]:
+    """
+    Extract messages from HTML content using BeautifulSoup, reference implementation
+    """
+    soup = BeautifulSoup(html_content, "html.parser")
+    messages: list[Post] = []
+    for message_div in soup.find_all("div", class_="tgme_widget_message"):
+        try:
+            # Get message ID and channel name
+            post_data = message_div.get("data-post", "").split("/")
+            if len(post_data) >= 2:
+                channel_name, message_id = post_data[-2:]
+            else:
+                continue
+
+            # Get date
+            date_elem = message_div.find("time", class_="time")
+            utc_dt = as_utc(datetime.fromisoformat(date_elem["datetime"]) if date_elem else datetime.utcnow())
+            # Get text
+            text_elem = message_div.find("div", class_="tgme_widget_message_text")
+            text = text_elem.get_text(strip=True) if text_elem else ""
+
+            messages.append(_make_post(channel_id, channel_name, message_id, utc_dt, text))
+
+        except Exception as e:
+            logger.warning(f"Error processing message: {e!s}", extra=log_extra)
+            continue
+
+    messages.reverse()
+    return messages
+
+
+def _has_class(tag: str, class_name: str) -> str:
+    return f'{tag}[contains(concat(" ", normalize-space(@class), " "), " {class_name} ")]'
+
+
+_xp_messages = etree.XPath(f"//{_has_class('div', 'tgme_widget_message')}")
+_xp_time = etree.XPath(f"(.//{_has_class('time', 'time')})[1]")
+_xp_text = etree.XPath(f"(.//{_has_class('div', 'tgme_widget_message_text')})[1]")
+
+# BeautifulSoup get_text() skips the content of these tags
+_NO_TEXT_TAGS = ("script", "style", "template", "rt", "rp")
+
+
+def _text_lxml(text_elem: etree._Element) -> str:
+    etree.strip_elements(text_elem, *_NO_TEXT_TAGS, with_tail=False)
+    return "".join(s.strip() for s in text_elem.itertext())
+
+
+def extract_messages_lxml(html_content: str, channel_id: str, *, log_extra: dict[str, str]) -> list[Post]:
+    """
+    Extract messages from HTML content using lxml, same output as extract_messages_bs4
+    """
+    root = etree.HTML(html_content) if html_content.strip() else None
+    if root is None:
+        return []
+    messages: list[Post] = []
+    for message_div in _xp_messages(root):
+        try:
+            post_data = message_div.get("data-post", "").split("/")
+            if len(post_data) >= 2:
+                channel_name, message_id = post_data[-2:]
+            else:
+                continue
+
+            date_elems = _xp_time(message_div)
+            utc_dt = as_utc(datetime.fromisoformat(date_elems[0].get("datetime")) if date_elems else datetime.utcnow())
+            text_elems = _xp_text(message_div)
+            text = _text_lxml(text_elems[0]) if text_elems else ""
+
+            messages.append(_make_post(channel_id, channel_name, message_id, utc_dt, text))
+
+        except Exception as e:
+            logger.warning(f"Error processing message: {e!s}", extra=log_extra)
+            continue
+
+    messages.reverse()
+    return messages
+
+
+EXTRACTORS: dict[HtmlBackend, Callable[..., list[Post]]] = {
+    HtmlBackend.BS4: extract_messages_bs4,
+    HtmlBackend.LXML: extract_messages_lxml,
+}
+
+
+def extract_messages(html_content: str, channel_id: str, *, backend: HtmlBackend | None = None, log_extra: dict[str, str]) -> list[Post]:
+    """
+    Extract messages of a t.me/s page, newest first
+    """
+    extractor = EXTRACTORS[backend or HtmlBackend(settings.TELEGRAM_HTML_BACKEND)]
+    return extractor(html_content, channel_id, log_extra=log_extra)
@@ -1,15 +1,23 @@
 import asyncio
 import logging
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 from datetime import datetime, timezone
 
 import aiohttp
-from bs4 import BeautifulSoup
-from pydantic import HttpUrl
 from redis.asyncio import Redis
 
+from src.common.async_utils import sync_to_async
+from src.common.disk_cache import DiskCache
+from src.common.http_utils import get_http_session
 from src.common.moment import as_utc
+from src.common.rate_limit import get_host_limiter, is_throttle_status
 from src.dto import redis_models
-from src.dto.feed_rec_info import Post, Source, TaskStatus
+from src.dto.feed_rec_info import CrawlWindow, Post, Source, TaskStatus
+from src.env import CACHE_DIR, settings
+from src.external_telegram.crawl_accumulator import CrawlAccumulator
+from src.external_telegram.telegram_html import extract_messages
 
 logger = logging.getLogger(__name__)
 
@@ -19,192 +27,335 @@ END_OF_EPOCH = datetime(2100, 1, 1, tzinfo=timezone.utc)
 rds = Redis(host="localhost", port=60379)
 
 
-async def get_all_messages(
-    utc_dt_to: datetime,
-    utc_dt_from: datetime,
-    consecutive_empty_responses,
-    all_messages,
-    session,
-    channel_name: str,
-    current_id,
-    max_empty_responses,
-    *,
-    log_extra,
-) -> list[Post]:
-    url = f"https://t.me/s/{channel_name}/{current_id}"
+TELEGRAM_HOST = "t.me"
+PAGES_IN_FLIGHT = 4
+PAGE_STRIDE = 20
+SEEK_MAX_PROBES = 40
 
-    response = await session.get(url)
 
-    if response.status != 200:
-        logger.warning(f"Failed to fetch messages. Status code: {response.status}", extra=log_extra)
-        return all_messages
-    dt_to = await rds.get(redis_models.source_channel_name_dt_to(Source.TELEGRAM, channel_name))
-    dt_from = await rds.get(redis_models.source_channel_name_dt_from(Source.TELEGRAM, channel_name))
-    utc_dt_to = datetime.fromisoformat(dt_to.decode("utf-8"))
-    utc_dt_from = datetime.fromisoformat(dt_from.decode("utf-8"))
-    messages = extract_messages(await response.text(), channel_name, log_extra=log_extra)
+def _retry_after(response: aiohttp.ClientResponse) -> float | None:
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else None
 
-    if not messages:
-        consecutive_empty_responses += 1
-        logger.warning(f"No messages found for ID {current_id}. Empty responses: {consecutive_empty_responses}", extra=log_extra)
-        if consecutive_empty_responses >= max_empty_responses:
-            logger.warning("Reached maximum number of consecutive empty responses. Stopping.", extra=log_extra)
-            return all_messages
-    else:
-        consecutive_empty_responses = 0
-        new_messages: list[Post] = []
-        for msg in messages:
-            if msg.pb_date > utc_dt_to:
-                logger.debug(f"get_posts_list_channel({channel_name}):: dt({msg.pb_date}) not fit to dt_to({utc_dt_to})", extra=log_extra)
-                continue
-            if msg.pb_date < utc_dt_from:
-                logger.debug(f"get_posts_list_channel({channel_name}) :: dt({msg.pb_date}) not fit to dt_from({utc_dt_from})", extra=log_extra)
-                all_messages.extend(new_messages)
-                return all_messages
-            if msg.post_id not in [m.post_id for m in all_messages]:
-                new_messages.append(msg)
-        # new_messages = [msg for msg in messages if msg.post_id not in [m.post_id for m in all_messages]]
-        new_id = min(int(msg.post_id) for msg in messages if msg.post_id is not None) - 1
-
-        if int(new_id) >= int(current_id):
-            return all_messages
-        current_id = new_id
-        all_messages.extend(new_messages)
-        # logger.debug(f"Fetched {len(new_messages)} new messages. Total: {len(all_messages)} -- {channel_name}", extra=log_extra)
-
-    if int(current_id) <= 1:
-        logger.warning("Reached the beginning of the channel. Stopping.", extra=log_extra)
-        return all_messages
 
-    await asyncio.sleep(0.0001)
-    return await get_all_messages(
-        utc_dt_to, utc_dt_from, consecutive_empty_responses, all_messages, session, channel_name, current_id, max_empty_responses, log_extra=log_extra
-    )
+_page_cache: DiskCache | None = None
 
 
-async def get_channel_messages(channel_name: str, *, log_extra: dict[str, str]) -> list[Post] | None:
+def _get_page_cache() -> DiskCache:
+    global _page_cache  # noqa: PLW0603
+    if _page_cache is None:
+        _page_cache = DiskCache(CACHE_DIR / "telegram_pages", max_bytes=settings.TELEGRAM_PAGE_CACHE_MAX_MB * 2**20)
+    return _page_cache
+
+
+def page_cache_ttl(html_text: str, now: datetime) -> float | None:
     """
-    Parse messages from a Telegram channel and save them to a JSON file
+    Pages of old posts hardly change, so a page is kept for a share of the age of its newest post.
+    Pages without posts aren't cached.
     """
-    dt_to = await rds.get(redis_models.source_channel_name_dt_to(Source.TELEGRAM, channel_name))
-    if not dt_to:
-        await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
+    # posts go oldest to newest on the page
+    start = html_text.rfind('datetime="')
+    if start < 0:
         return None
-    dt_from = await rds.get(redis_models.source_channel_name_dt_from(Source.TELEGRAM, channel_name))
-    if not dt_from:
-        await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
+    start += len('datetime="')
+    try:
+        newest = as_utc(datetime.fromisoformat(html_text[start : html_text.index('"', start)]))
+    except ValueError:
         return None
-
-    utc_dt_to = datetime.fromisoformat(dt_to.decode("utf-8"))
-    utc_dt_from = datetime.fromisoformat(dt_from.decode("utf-8"))
-    all_messages = []
+    age = (now - newest).total_seconds()
+    return min(settings.TELEGRAM_PAGE_CACHE_TTL_MAX, max(settings.TELEGRAM_PAGE_CACHE_TTL_MIN, age * settings.TELEGRAM_PAGE_CACHE_TTL_AGE_RATIO))
+
+
+async def _fetch_page(session: aiohttp.ClientSession, channel_name: str, before_id: int | None) -> tuple[int, str]:
+    # the newest page changes with every post, only pages below a post id are cached
+    use_cache = settings.TELEGRAM_PAGE_CACHE and before_id is not None
+    cache_key = f"{channel_name}/{before_id}"
+    if use_cache:
+        cached = await sync_to_async(_get_page_cache().get)(cache_key)
+        if cached is not None:
+            return 200, cached.decode()
+
+    url = f"{settings.TELEGRAM_BASE_URL}/s/{channel_name}" if before_id is None else f"{settings.TELEGRAM_BASE_URL}/s/{channel_name}/{before_id}"
+    limiter = get_host_limiter(TELEGRAM_HOST)
+    attempt = 0
+    while True:
+        await limiter.acquire(channel_name)
+        async with session.get(url) as response:
+            limiter.on_response(response.status, _retry_after(response))
+            status = response.status
+            html_text = await response.text() if status == 200 else ""
+        if status == 200 or not is_throttle_status(status) or attempt >= settings.HTTP_MAX_RETRIES:
+            break
+        attempt += 1
+
+    if use_cache and status == 200:
+        ttl = page_cache_ttl(html_text, datetime.now(timezone.utc))
+        if ttl is not None:
+            await sync_to_async(_get_page_cache().set)(cache_key, html_text.encode(), ttl)
+    return status, html_text
+
+
+def _cancel_pages(in_flight: deque[tuple[int, asyncio.Task[tuple[int, str]]]]) -> None:
+    for _, page in in_flight:
+        page.cancel()
+    in_flight.clear()
+
+
+def _new_accumulator(channel_name: str) -> CrawlAccumulator:
+    return CrawlAccumulator(Source.TELEGRAM, channel_name, max_bytes=settings.CRAWL_ACCUMULATOR_MAX_MB * 2**20)
+
+
+async def iter_all_messages(  # noqa: C901, PLR0915
+    window: CrawlWindow,
+    session: aiohttp.ClientSession,
+    channel_name: str,
+    current_id: int,
+    max_empty_responses: int,
+    *,
+    stop_post_id: int | None = None,
+    pages_in_flight: int = PAGES_IN_FLIGHT,
+    log_extra: dict[str, str],
+) -> AsyncIterator[list[Post]]:
+    """
+    Walk the channel down from current_id keeping a window of pages in flight, yields the new posts of every page.
+    Next pages are predicted from the page stride, every post above the cursor is already processed.
+    With stop_post_id the walk ends at that post (the high water mark of the previous crawl).
+    The window is read on every page, so changes published to a running crawl apply to the next page.
+    A predicted page that fails is dropped with the ones after it and the window is refilled from the cursor,
+    only a failed page at the cursor ends the walk.
+    window.completed is set once the walk reaches its end, a failed page at the cursor or too many empty ones leave it unset.
+    """
     consecutive_empty_responses = 0
-    max_empty_responses = 3
-    session = aiohttp.ClientSession()
+    stride = PAGE_STRIDE
+    cursor = current_id
+    next_before = cursor
+    in_flight: deque[tuple[int, asyncio.Task[tuple[int, str]]]] = deque()
     try:
-        # First request to get the latest messages and the first message ID
-        url = f"https://t.me/s/{channel_name}"
-
-        response = await session.get(url)
+        while cursor >= 1:
+            if window.stopped:
+                logger.warning("Crawl stopped.", extra=log_extra)
+                return
+            if not in_flight:
+                next_before = cursor
+            while len(in_flight) < pages_in_flight and next_before >= 1:
+                in_flight.append((next_before, asyncio.create_task(_fetch_page(session, channel_name, next_before))))
+                next_before -= stride
+            before_id, page = in_flight.popleft()
+            status, html_text = await page
+
+            if before_id < cursor:
+                # prediction overshot the real page: posts between before_id and cursor would be lost
+                logger.debug(f"get_all_messages({channel_name}) :: page {before_id} below cursor {cursor}, refilling window", extra=log_extra)
+                _cancel_pages(in_flight)
+                next_before = cursor
+                continue
+            if status != 200:
+                if before_id != cursor:
+                    # only a predicted page failed, the walk goes on from the confirmed cursor
+                    logger.debug(f"get_all_messages({channel_name}) :: page {before_id} failed with {status}, refilling window", extra=log_extra)
+                    _cancel_pages(in_flight)
+                    next_before = cursor
+                    continue
+                logger.warning(f"Failed to fetch messages. Status code: {status}", extra=log_extra)
+                return
+
+            utc_dt_to = as_utc(window.dt_to)
+            utc_dt_from = as_utc(window.dt_from)
+            messages = [msg for msg in extract_messages(html_text, channel_name, log_extra=log_extra) if msg.post_id.isdigit()]
+
+            if not messages:
+                consecutive_empty_responses += 1
+                logger.warning(f"No messages found for ID {before_id}. Empty responses: {consecutive_empty_responses}", extra=log_extra)
+                if consecutive_empty_responses >= max_empty_responses:
+                    logger.warning("Reached maximum number of consecutive empty responses. Stopping.", extra=log_extra)
+                    return
+                _cancel_pages(in_flight)
+                next_before = cursor
+                continue
+            consecutive_empty_responses = 0
+
+            new_cursor = min(int(msg.post_id) for msg in messages) - 1
+            if new_cursor >= cursor:
+                if before_id == cursor:
+                    # nothing older than the cursor
+                    window.completed = True
+                    return
+                # speculative page overlaps posts that are already processed
+                continue
 
-        if response.status != 200:
-            await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
-            logger.warning(f"Failed to access channel. Status code: {response.status}", extra=log_extra)
-            await session.close()
-            return None
-        # Get messages from the first response
-        html_text = await response.text()
-        messages = extract_messages(html_text, channel_name, log_extra=log_extra)
+            page_posts: list[Post] = []
+            finished = False
+            for msg in messages:
+                if int(msg.post_id) > cursor:
+                    continue
+                if stop_post_id is not None and int(msg.post_id) <= stop_post_id:
+                    logger.debug(f"get_posts_list_channel({channel_name}) :: reached high water mark {stop_post_id}", extra=log_extra)
+                    finished = True
+                    break
+                if msg.pb_date > utc_dt_to:
+                    logger.debug(f"get_posts_list_channel({channel_name}):: dt({msg.pb_date}) not fit to dt_to({utc_dt_to})", extra=log_extra)
+                    continue
+                if msg.pb_date < utc_dt_from:
+                    logger.debug(f"get_posts_list_channel({channel_name}) :: dt({msg.pb_date}) not fit to dt_from({utc_dt_from})", extra=log_extra)
+                    finished = True
+                    break
+                page_posts.append(msg)
+            if page_posts:
+                yield page_posts
+            if finished:
+                window.completed = True
+                return
+            cursor = new_cursor
+            stride = len(messages)
 
-        if not messages:
-            await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
-            logger.debug("No messages found in the channel", extra=log_extra)
-            await session.close()
-            return None
-        logger.debug(f"Found {len(messages)} --- {messages[0].pb_date}", extra=log_extra)
-        # Get the highest message ID as our starting point
-        current_id = max(msg.post_id for msg in messages if msg.post_id is not None)
-        logger.debug(f"Found initial {len(messages)} messages", extra=log_extra)
-
-        # Continue fetching older messages
-        # while True:
-        await get_all_messages(
-            as_utc(utc_dt_to),
-            as_utc(utc_dt_from),
-            consecutive_empty_responses,
-            all_messages,
-            session,
-            channel_name,
-            current_id,
-            max_empty_responses,
-            log_extra=log_extra,
-        )
-        await session.close()
-        # Save messages to file
+        logger.warning("Reached the beginning of the channel. Stopping.", extra=log_extra)
+        window.completed = True
+    finally:
+        _cancel_pages(in_flight)
 
-        if all_messages:
-            for message in all_messages:
-                logger.debug(f"{message.pb_date} --- {message.post_id}", extra=log_extra)
-            return all_messages
-        await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
-        return None
 
-    except Exception as e:
-        logger.warning(f"Error occurred: {e!s}", extra=log_extra)
-        await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
-        await session.close()
-        return None
+async def get_all_messages(
+    window: CrawlWindow,
+    session: aiohttp.ClientSession,
+    channel_name: str,
+    current_id: int,
+    max_empty_responses: int,
+    *,
+    stop_post_id: int | None = None,
+    pages_in_flight: int = PAGES_IN_FLIGHT,
+    log_extra: dict[str, str],
+) -> list[Post]:
+    batches = iter_all_messages(
+        window,
+        session,
+        channel_name,
+        current_id,
+        max_empty_responses,
+        stop_post_id=stop_post_id,
+        pages_in_flight=pages_in_flight,
+        log_extra=log_extra,
+    )
+    with _new_accumulator(channel_name) as accumulator:
+        async with aclosing(batches):
+            async for batch in batches:
+                accumulator.extend(batch)
+        return list(accumulator)
 
 
-def extract_messages(html_content: str, channel_id: str, *, log_extra: dict[str, str]) -> list[Post]:
+async def seek_post_id(
+    session: aiohttp.ClientSession, channel_name: str, dt_to: datetime, newest_id: int, *, max_probes: int = SEEK_MAX_PROBES, log_extra: dict[str, str]
+) -> int:
     """
-    Extract messages from HTML content using BeautifulSoup
+    Bisects post ids for the newest post not after dt_to, so a crawl of an old window starts there instead of the top of the channel.
+    Every probe reads the dates of one page, posts above the returned id are all newer than dt_to.
     """
-    soup = BeautifulSoup(html_content, "html.parser")
-    messages: list[Post] = []
-    # logger.debug("start searching messages", extra=log_extra)
-    for message_div in soup.find_all("div", class_="tgme_widget_message"):
-        try:
-            # Get message ID and channel name
-            post_data = message_div.get("data-post", "").split("/")
-            if len(post_data) >= 2:
-                channel_name, message_id = post_data[-2:]
-            else:
-                continue
-
-            # Get date
-            date_elem = message_div.find("time", class_="time")
-            utc_dt = as_utc(datetime.fromisoformat(date_elem["datetime"]) if date_elem else datetime.utcnow())
-            # logger.debug(f"{utc_dt} ++++++++++++++++++", extra=log_extra)
-            print(f"yes dt({utc_dt})")
-            # Get text
-            text_elem = message_div.find("div", class_="tgme_widget_message_text")
-            text = text_elem.get_text(strip=True) if text_elem else ""
-
-            # Get views
-            """views_elem = message_div.find('span', class_='tgme_widget_message_views')
-            views = views_elem.get_text(strip=True) if views_elem else '0'"""
-
-            # Create message object
-            message = Post(
-                source=Source.TELEGRAM,
-                channel_name=channel_id,
-                post_id=str(int(message_id) if message_id.isdigit() else None),
-                title=None,
-                description=None,
-                content=text,
-                pb_date=utc_dt,
-                link=HttpUrl(f"https://t.me/{channel_name}/{message_id}"),
-                media=None,
-            )
+    utc_dt_to = as_utc(dt_to)
+    lo, hi = 0, newest_id
+    for _ in range(max_probes):
+        if hi - lo <= PAGE_STRIDE:
+            break
+        mid = (lo + hi + 1) // 2
+        status, html_text = await _fetch_page(session, channel_name, mid)
+        if status != 200:
+            logger.warning(f"seek_post_id({channel_name}) :: probe {mid} failed with {status}, starting from {hi}", extra=log_extra)
+            break
+        messages = sorted(
+            (msg for msg in extract_messages(html_text, channel_name, log_extra=log_extra) if msg.post_id.isdigit()), key=lambda msg: int(msg.post_id)
+        )
+        if not messages:
+            # nothing at or below mid, window posts if any are above
+            lo = mid
+            continue
+        oldest, newest = messages[0], messages[-1]
+        if oldest.pb_date > utc_dt_to:
+            hi = min(int(oldest.post_id), mid) - 1
+        elif newest.pb_date <= utc_dt_to:
+            lo = max(int(newest.post_id), mid)
+        else:
+            # dt_to falls inside the page
+            hi = min(int(msg.post_id) for msg in messages if msg.pb_date > utc_dt_to) - 1
+            break
+    logger.debug(f"seek_post_id({channel_name}) :: {dt_to} is below post {hi}", extra=log_extra)
+    return hi
+
+
+async def iter_channel_messages(
+    channel_name: str,
+    window: CrawlWindow,
+    *,
+    stop_post_id: int | None = None,
+    pages_in_flight: int = PAGES_IN_FLIGHT,
+    session: aiohttp.ClientSession | None = None,
+    log_extra: dict[str, str],
+) -> AsyncIterator[list[Post]]:
+    """
+    Parse messages from a Telegram channel within the crawl window, yields them page by page, newest first
+    """
+    max_empty_responses = 3
+    session = session or get_http_session()
+    # First request to get the latest messages and the first message ID
+    status, html_text = await _fetch_page(session, channel_name, None)
+    if status != 200:
+        logger.warning(f"Failed to access channel. Status code: {status}", extra=log_extra)
+        return
+    messages = extract_messages(html_text, channel_name, log_extra=log_extra)
+    if not messages:
+        logger.debug("No messages found in the channel", extra=log_extra)
+        return
+    # Get the highest message ID as our starting point
+    current_id = max(int(msg.post_id) for msg in messages if msg.post_id.isdigit())
+    logger.debug(f"Found initial {len(messages)} messages, newest {current_id} at {messages[0].pb_date}", extra=log_extra)
+    if min(msg.pb_date for msg in messages) > as_utc(window.dt_to):
+        # the whole first page is newer than the window, skip the posts in between
+        current_id = await seek_post_id(session, channel_name, window.dt_to, current_id, log_extra=log_extra)
+
+    # Continue fetching older messages
+    batches = iter_all_messages(
+        window,
+        session,
+        channel_name,
+        current_id,
+        max_empty_responses,
+        stop_post_id=stop_post_id,
+        pages_in_flight=pages_in_flight,
+        log_extra=log_extra,
+    )
+    async with aclosing(batches):
+        async for batch in batches:
+            yield batch
 
-            messages.insert(0, message)
 
-        except Exception as e:
-            logger.warning(f"Error processing message: {e!s}", extra=log_extra)
-            continue
+async def get_channel_messages(
+    channel_name: str,
+    window: CrawlWindow,
+    *,
+    stop_post_id: int | None = None,
+    pages_in_flight: int = PAGES_IN_FLIGHT,
+    session: aiohttp.ClientSession | None = None,
+    log_extra: dict[str, str],
+) -> list[Post] | None:
+    """
+    Parse messages from a Telegram channel within the crawl window
+    """
+    all_messages: list[Post] = []
+    try:
+        with _new_accumulator(channel_name) as accumulator:
+            batches = iter_channel_messages(
+                channel_name, window, stop_post_id=stop_post_id, pages_in_flight=pages_in_flight, session=session, log_extra=log_extra
+            )
+            async with aclosing(batches):
+                async for batch in batches:
+                    accumulator.extend(batch)
+            # posts become pydantic models again only for the hand over
+            all_messages = list(accumulator)
+    except Exception as e:
+        logger.warning(f"Error occurred: {e!s}", extra=log_extra)
+        all_messages = []
 
-    return messages
+    if window.stopped or not all_messages:
+        await rds.set(redis_models.source_channel_name_status(Source.TELEGRAM, channel_name), TaskStatus.free.value)
+        return None
+    return all_messages
 
 
 async def main() -> None:
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from src.dto.feed_rec_info import Post, Source
+from src.external_telegram.crawl_accumulator import CrawlAccumulator, IdSet
+from src.external_telegram.telegram_html import extract_messages
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+def test_id_set() -> None:
+    ids = IdSet()
+    assert ids.add(1)
+    assert ids.add(1_000_000)
+    assert not ids.add(1)
+    assert 1_000_000 in ids
+    assert 999_999 not in ids
+    assert 5_000_000 not in ids
+    assert len(ids) == 2
+
+
+def test_crawl_accumulator_dedups_and_merges_spilled_runs() -> None:
+    pages = [extract_messages(page.read_text(), "tg_parser_demo", log_extra={}) for page in sorted(FIXTURES_DIR.glob("*.html"))]
+    posts: dict[str, Post] = {}
+    for post in (post for page in pages for post in page):
+        # the first copy of a post wins
+        posts.setdefault(post.post_id, post)
+    # a tiny limit spills a run every couple of posts
+    with CrawlAccumulator(Source.TELEGRAM, "tg_parser_demo", max_bytes=1000) as accumulator:
+        added = sum(accumulator.extend(page) for page in pages + pages)
+        merged = list(accumulator)
+        assert len(accumulator._runs) > 10  # noqa: SLF001
+    assert added == len(posts) == len(accumulator)
+    assert merged == sorted(posts.values(), key=lambda post: (post.pb_date, int(post.post_id)), reverse=True)
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from src.common import rate_limit
+from src.common.http_utils import close_http_session
+from src.dto.feed_rec_info import CrawlWindow
+from src.env import settings
+from src.external_telegram import telegram_scrapy
+from src.external_telegram.replay_server import ReplayConfig, ReplayServer, load_corpus
+
+WINDOW = CrawlWindow(dt_to=datetime(2100, 1, 1, tzinfo=timezone.utc), dt_from=datetime(2000, 1, 1, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize("pages_in_flight", [1, 4])
+async def test_get_channel_messages_replays_whole_corpus(pages_in_flight: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = load_corpus()
+    server = ReplayServer(corpus)
+    rate_limit.reset_host_limiters()
+    async with server.serve() as base_url:
+        monkeypatch.setattr(settings, "TELEGRAM_BASE_URL", base_url)
+        posts = await telegram_scrapy.get_channel_messages("tg_parser_demo", WINDOW, pages_in_flight=pages_in_flight, log_extra={})
+        await close_http_session()
+    assert posts is not None
+    assert [int(post.post_id) for post in posts] == sorted(corpus, reverse=True)
+
+
+async def test_get_channel_messages_survives_throttled_and_empty_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = load_corpus()
+    newest = max(corpus)
+    server = ReplayServer(corpus, ReplayConfig(page_size=10, retry_after=0, throttle_pages={newest}, empty_pages={newest}))
+    rate_limit.reset_host_limiters()
+    async with server.serve() as base_url:
+        monkeypatch.setattr(settings, "TELEGRAM_BASE_URL", base_url)
+        posts = await telegram_scrapy.get_channel_messages("tg_parser_demo", WINDOW, pages_in_flight=1, log_extra={})
+        await close_http_session()
+    assert server.stats.throttled == 1
+    assert server.stats.empty == 1
+    assert posts is not None
+    assert [int(post.post_id) for post in posts] == sorted(corpus, reverse=True)
@@ -0,0 +1,27 @@
+from pathlib import Path
+
+import pytest
+
+from src.external_telegram.telegram_html import HtmlBackend, extract_messages
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+@pytest.mark.parametrize("page", sorted(FIXTURES_DIR.glob("*.html")), ids=lambda p: p.name)
+def test_extract_messages_backends_are_identical(page: Path) -> None:
+    html_content = page.read_text()
+    reference = extract_messages(html_content, "tg_parser_demo", backend=HtmlBackend.BS4, log_extra={})
+    assert len(reference) > 0
+    assert extract_messages(html_content, "tg_parser_demo", backend=HtmlBackend.LXML, log_extra={}) == reference
+
+
+def test_extract_messages_newest_first() -> None:
+    html_content = (FIXTURES_DIR / "tg_parser_demo.html").read_text()
+    posts = extract_messages(html_content, "tg_parser_demo", log_extra={})
+    assert [int(p.post_id) for p in posts] == sorted((int(p.post_id) for p in posts), reverse=True)
+    assert all(p.pb_date.tzinfo is not None for p in posts)
+
+
+def test_extract_messages_empty_page() -> None:
+    for backend in HtmlBackend:
+        assert extract_messages("", "tg_parser_demo", backend=backend, log_extra={}) == []
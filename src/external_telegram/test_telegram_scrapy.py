@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+from itertools import pairwise
+from pathlib import Path
+
+import pytest
+
+from src.common import rate_limit
+from src.common.disk_cache import DiskCache
+from src.common.http_utils import close_http_session
+from src.dto.feed_rec_info import CrawlWindow
+from src.env import settings
+from src.external_telegram import telegram_scrapy
+from src.external_telegram.replay_server import ReplayConfig, ReplayServer, load_corpus, synthesize_corpus
+from src.external_telegram.telegram_scrapy import PAGE_STRIDE
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+async def test_get_channel_messages_seeks_old_window(monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = synthesize_corpus(load_corpus(), 4000, start=START, step=timedelta(hours=1))
+    server = ReplayServer(corpus)
+    window = CrawlWindow(dt_to=START + timedelta(hours=1000, minutes=30), dt_from=START + timedelta(hours=900))
+    rate_limit.reset_host_limiters()
+    monkeypatch.setattr(settings, "HOST_BURST", 1000)
+    monkeypatch.setattr(settings, "HOST_RPS", 1000.0)
+    async with server.serve() as base_url:
+        monkeypatch.setattr(settings, "TELEGRAM_BASE_URL", base_url)
+        posts = await telegram_scrapy.get_channel_messages("tg_parser_demo", window, log_extra={})
+        await close_http_session()
+    # synthesized dates are START + n hours for the n-th post
+    expected = [post_id for n, post_id in enumerate(sorted(corpus)) if 900 <= n <= 1000]
+    assert posts is not None
+    assert [int(post.post_id) for post in posts] == sorted(expected, reverse=True)
+    # a walk from the top would read ~150 pages to get there
+    assert server.stats.pages < 40
+
+
+async def test_get_channel_messages_reads_old_pages_from_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = synthesize_corpus(load_corpus(), 200, start=START, step=timedelta(hours=1))
+    server = ReplayServer(corpus)
+    window = CrawlWindow(dt_to=START + timedelta(days=365), dt_from=START)
+    rate_limit.reset_host_limiters()
+    monkeypatch.setattr(settings, "TELEGRAM_PAGE_CACHE", True)
+    monkeypatch.setattr(telegram_scrapy, "_page_cache", DiskCache(tmp_path, max_bytes=2**24))
+    async with server.serve() as base_url:
+        monkeypatch.setattr(settings, "TELEGRAM_BASE_URL", base_url)
+        first = await telegram_scrapy.get_channel_messages("tg_parser_demo", window, log_extra={})
+        pages = server.stats.pages
+        second = await telegram_scrapy.get_channel_messages("tg_parser_demo", window, log_extra={})
+        await close_http_session()
+    assert first is not None
+    assert second == first
+    # only the newest page goes to the network again
+    assert server.stats.pages == pages + 1
+
+
+@pytest.mark.parametrize("fail", [False, True])
+async def test_window_completed_only_when_the_walk_got_to_its_end(fail: bool, monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = synthesize_corpus(load_corpus(), 100, start=START, step=timedelta(hours=1))
+    # pages below the middle of the channel answer 429 and no retry is left
+    server = ReplayServer(corpus, ReplayConfig(retry_after=0, throttle_pages=set(range(sorted(corpus)[50])) if fail else set()))
+    window = CrawlWindow(dt_to=START + timedelta(days=365), dt_from=START)
+    rate_limit.reset_host_limiters()
+    monkeypatch.setattr(settings, "HTTP_MAX_RETRIES", 0)
+    async with server.serve() as base_url:
+        monkeypatch.setattr(settings, "TELEGRAM_BASE_URL", base_url)
+        batches = telegram_scrapy.iter_channel_messages("tg_parser_demo", window, pages_in_flight=1, log_extra={})
+        posts = [post async for batch in batches for post in batch]
+        await close_http_session()
+    assert window.completed is not fail
+    assert len(posts) < len(corpus) if fail else len(posts) == len(corpus)
+
+
+async def _walk(server: ReplayServer, window: CrawlWindow, monkeypatch: pytest.MonkeyPatch, **kwargs: int) -> list[list[int]]:
+    rate_limit.reset_host_limiters()
+    monkeypatch.setattr(settings, "HOST_BURST", 1000)
+    monkeypatch.setattr(settings, "HOST_RPS", 1000.0)
+    async with server.serve() as base_url:
+        monkeypatch.setattr(settings, "TELEGRAM_BASE_URL", base_url)
+        batches = telegram_scrapy.iter_channel_messages("tg_parser_demo", window, log_extra={}, **kwargs)
+        pages = [[int(post.post_id) for post in batch] async for batch in batches]
+        await close_http_session()
+    return pages
+
+
+@pytest.mark.parametrize(
+    "page_size",
+    [
+        # pages longer than the predicted stride overlap posts below the cursor
+        PAGE_STRIDE + 7,
+        # shorter ones skip posts, the window is refilled from the cursor
+        PAGE_STRIDE - 7,
+    ],
+)
+async def test_pages_in_flight_yield_every_post_once_below_the_cursor(page_size: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = synthesize_corpus(load_corpus(), 300, start=START, step=timedelta(hours=1))
+    window = CrawlWindow(dt_to=START + timedelta(days=365), dt_from=START)
+    pages = await _walk(ReplayServer(corpus, ReplayConfig(page_size=page_size)), window, monkeypatch, pages_in_flight=4)
+    post_ids = [post_id for page in pages for post_id in page]
+    assert post_ids == sorted(corpus, reverse=True)
+    # every page starts below the cursor left by the one before
+    assert all(page[0] < previous[-1] for previous, page in pairwise(pages))
+    assert window.completed
+
+
+async def test_failed_predicted_page_is_fetched_again_from_the_cursor(monkeypatch: pytest.MonkeyPatch) -> None:
+    corpus = synthesize_corpus(load_corpus(), 300, start=START, step=timedelta(hours=1))
+    newest = max(corpus)
+    # the second predicted page of the first window answers 429 and no retry is left
+    server = ReplayServer(corpus, ReplayConfig(retry_after=0, throttle_pages={newest - 2 * PAGE_STRIDE}))
+    window = CrawlWindow(dt_to=START + timedelta(days=365), dt_from=START)
+    monkeypatch.setattr(settings, "HTTP_MAX_RETRIES", 0)
+    pages = await _walk(server, window, monkeypatch, pages_in_flight=4)
+    assert server.stats.throttled == 1
+    assert [post_id for page in pages for post_id in page] == sorted(corpus, reverse=True)
+    assert window.completed
@@ -0,0 +1,73 @@
+import json
+import logging
+import re
+import time
+from typing import Any, Final
+
+from src.common.disk_cache import DiskCache
+from src.dto.feed_rec_info import MediaFormat, MediaResolution
+from src.env import CACHE_DIR, settings
+
+logger: Final = logging.getLogger(__name__)
+
+# the info dict fields read by _video_info_from_info_dict, they don't change once a video is published
+META_FIELDS: Final = ("id", "fulltitle", "description", "upload_date", "uploader_url")
+# format fields read by _audio_only_formats, the urls are signed and expire within hours
+FORMAT_FIELDS: Final = ("resolution", "audio_ext", "url")
+
+_re_expire = re.compile(r"[/?&]expire[/=](\d+)")
+
+_cache: DiskCache | None = None
+
+
+def _get_cache() -> DiskCache:
+    global _cache  # noqa: PLW0603
+    if _cache is None:
+        _cache = DiskCache(CACHE_DIR / "youtube_info", max_bytes=settings.YOUTUBE_INFO_CACHE_MAX_MB * 2**20)
+    return _cache
+
+
+def _normalized_formats(info: dict[str, Any]) -> list[dict[str, Any]]:
+    return [
+        {field: f.get(field) for field in FORMAT_FIELDS}
+        for f in info.get("formats") or []
+        if f.get("resolution") == MediaResolution.AUDIO_ONLY.value and f.get("audio_ext") == MediaFormat.WEBM.value and f.get("url")
+    ]
+
+
+def _formats_ttl(formats: list[dict[str, Any]], now: float) -> float:
+    """Until the first signed url expires (with a margin for the download), YOUTUBE_INFO_FORMATS_TTL when urls carry no expiry"""
+    expires = [int(m.group(1)) for f in formats if (m := _re_expire.search(f["url"]))]
+    if not expires:
+        return settings.YOUTUBE_INFO_FORMATS_TTL
+    return min(settings.YOUTUBE_INFO_FORMATS_TTL, min(expires) - now - settings.YOUTUBE_INFO_FORMATS_MARGIN)
+
+
+def put_info(info: dict[str, Any]) -> None:
+    if not settings.YOUTUBE_INFO_CACHE or not info.get("id"):
+        return
+    cache = _get_cache()
+    video_id = info["id"]
+    cache.set(f"meta/{video_id}", json.dumps({field: info.get(field) for field in META_FIELDS}).encode(), settings.YOUTUBE_INFO_META_TTL)
+    formats = _normalized_formats(info)
+    ttl = _formats_ttl(formats, time.time())
+    if ttl > 0:
+        cache.set(f"formats/{video_id}", json.dumps(formats).encode(), ttl)
+
+
+def get_meta(video_id: str) -> dict[str, Any] | None:
+    if not settings.YOUTUBE_INFO_CACHE:
+        return None
+    raw = _get_cache().get(f"meta/{video_id}")
+    return json.loads(raw) if raw is not None else None
+
+
+def get_info(video_id: str) -> dict[str, Any] | None:
+    """Info dict with the cached fields only, None unless both the metadata and fresh format urls are cached"""
+    meta = get_meta(video_id)
+    if meta is None:
+        return None
+    raw_formats = _get_cache().get(f"formats/{video_id}")
+    if raw_formats is None:
+        return None
+    return {**meta, "formats": json.loads(raw_formats)}
@@ -1,28 +1,146 @@
+import argparse
+import codecs
+import json
+import logging
+import os
 import re
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import Final
 
+logger: Final = logging.getLogger(__name__)
+
+VTT_HEADERS = ("WEBVTT", "Kind:", "Language:", "NOTE")
+SUBTITLE_SUFFIXES: Final = (".srt", ".vtt")
+
+# bytes read to pick the encoding, the rest of the file is decoded as it streams
+SNIFF_BYTES: Final = 64 * 1024
+
+_re_brackets = re.compile(r"\[.*?\]")
+# webvtt subtitles: inline timing and style tags
+_re_tags = re.compile(r"<[^>]+>")
+_re_spaces = re.compile(r"\s+")
+# 00:01:02,003 (srt), 00:01:02.003 or 01:02.003 (vtt)
+_re_timing = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{1,2})[,.](\d{1,3})")
+
+
+@dataclass(frozen=True, slots=True)
+class Segment:
+    start: float
+    end: float
+    text: str
 
-def extract_clean_text_from_srt(srt_path: Path) -> str:
 
+def sniff_encoding(path: Path) -> str:
+    """utf-8-sig with a BOM, utf-8 when the head of the file decodes, latin-1 otherwise"""
+    with path.open("rb") as f:
+        head = f.read(SNIFF_BYTES)
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
     try:
-        content = srt_path.read_text(encoding='utf-8')
+        # not final, the head may end inside a multibyte character
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
     except UnicodeDecodeError:
-        try:
-            content = srt_path.read_text(encoding='utf-8-sig')
-        except UnicodeDecodeError:
-            content = srt_path.read_text(encoding='latin-1')
+        return "latin-1"
+    return "utf-8"
+
+
+def _seconds(hours: str | None, minutes: str, seconds: str, millis: str) -> float:
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, "0")) / 1000
+
+
+def _clean_line(line: str) -> str | None:
+    line = _re_tags.sub("", _re_brackets.sub("", line)).strip()
+    if not line or line.isdigit() or "-->" in line or line.startswith(VTT_HEADERS):
+        return None
+    return _re_spaces.sub(" ", line)
+
+
+def iter_segments(path: Path) -> Iterator[Segment]:
+    """Cues of an srt or vtt file with their cleaned text, read line by line, cues without text are skipped"""
+    start = end = 0.0
+    texts: list[str] = []
+    # a bad byte past the sniffed head must not fail a whole transcript
+    with path.open(encoding=sniff_encoding(path), errors="replace", newline=None) as f:
+        for line in f:
+            timing = _re_timing.search(line)
+            if timing is not None:
+                if texts:
+                    yield Segment(start, end, " ".join(texts))
+                    texts = []
+                start, end = _seconds(*timing.groups()[:4]), _seconds(*timing.groups()[4:])
+                continue
+            text = _clean_line(line)
+            if text is not None:
+                texts.append(text)
+    if texts:
+        yield Segment(start, end, " ".join(texts))
+
+
+def iter_clean_text(path: Path) -> Iterator[str]:
+    for segment in iter_segments(path):
+        yield segment.text
+
+
+def extract_clean_text_from_srt(srt_path: Path) -> str:
+    return " ".join(iter_clean_text(srt_path))
+
+
+def convert_file(src: Path, dst: Path, *, segments: bool = False) -> Path:
+    """
+    Streams the cleaned text of a subtitle file into dst, in constant memory.
+    With segments, also writes <dst>.segments.jsonl with one {"start", "end", "text"} line per cue
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    segments_path = dst.with_name(f"{dst.name}.segments.jsonl")
+    with dst.open("w", encoding="utf-8") as text_file, ExitStack() as stack:
+        segments_file = stack.enter_context(segments_path.open("w", encoding="utf-8")) if segments else None
+        separator = ""
+        for segment in iter_segments(src):
+            text_file.write(separator + segment.text)
+            separator = " "
+            if segments_file is not None:
+                segments_file.write(json.dumps(asdict(segment), ensure_ascii=False) + "\n")
+    return dst
+
+
+def _convert_job(job: tuple[Path, Path, bool]) -> Path:
+    src, dst, segments = job
+    return convert_file(src, dst, segments=segments)
+
+
+def convert_directory(src_dir: Path, dst_dir: Path, *, processes: int | None = None, segments: bool = False) -> list[Path]:
+    """Converts every subtitle file under src_dir into <dst_dir>/<relative path>.txt across a process pool"""
+    jobs = [
+        (src, (dst_dir / src.relative_to(src_dir)).with_suffix(".txt"), segments)
+        for src in sorted(src_dir.rglob("*"))
+        if src.suffix in SUBTITLE_SUFFIXES and src.is_file()
+    ]
+    if not jobs:
+        return []
+    processes = min(processes or os.cpu_count() or 1, len(jobs))
+    if processes == 1:
+        return [_convert_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_convert_job, jobs, chunksize=max(1, len(jobs) // (processes * 4))))
 
-    content = re.sub(r'\[.*?\]', '', content)
 
-    lines = content.split('\n')
-    text_lines = []
+def main() -> None:
+    parser = argparse.ArgumentParser(description="srt/vtt subtitles to clean text")
+    parser.add_argument("src", type=Path, help="subtitle file or directory")
+    parser.add_argument("dst", type=Path, help="text file or directory")
+    parser.add_argument("--processes", type=int, default=None, help="default: cpu count")
+    parser.add_argument("--segments", action="store_true", help="also write timestamp aligned segments as jsonl")
+    args = parser.parse_args()
+    if args.src.is_dir():
+        converted = convert_directory(args.src, args.dst, processes=args.processes, segments=args.segments)
+        print(f"converted {len(converted)} subtitle files into {args.dst}")  # noqa: T201
+    else:
+        convert_file(args.src, args.dst, segments=args.segments)
 
-    for line in lines:
-        line = line.strip()
-        if not line or line.isdigit() or '-->' in line:
-            continue
-        text_lines.append(line)
-    clean_text = ' '.join(text_lines)
-    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-    return clean_text
 
+if __name__ == "__main__":
+    main()
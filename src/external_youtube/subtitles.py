@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import logging
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+from typing import Final
+
+import yt_dlp
+
+from src.common.executors import ExecutorProfile, run_in_profile
+from src.dto.feed_rec_info import FeedRecPostTranscription, Lang, Post, RawPostMediaExt
+from src.env import SCRAPPER_RESULTS_DIR, settings
+from src.external_youtube.serializer_for_srt_subtitles import extract_clean_text_from_srt
+
+logger: Final = logging.getLogger(__name__)
+
+SUBTITLES_DIR: Final = SCRAPPER_RESULTS_DIR / "youtube" / "subtitles"
+SUBTITLE_EXTS: Final = ("srt", "vtt")
+
+
+class SubtitleStore:
+    """
+    Content addressed subtitle files: blobs/<sha256[:2]>/<sha256>.<ext> hold the text,
+    index/<video_id>.json maps every language of a video to its blob, a video with an index is never fetched again
+    """
+
+    def __init__(self, root: Path = SUBTITLES_DIR) -> None:
+        self.root = root
+
+    def _index_path(self, video_id: str) -> Path:
+        return self.root / "index" / f"{video_id}.json"
+
+    def blob_path(self, digest: str, ext: str) -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest}.{ext}"
+
+    def get_index(self, video_id: str) -> dict[str, str] | None:
+        try:
+            return json.loads(self._index_path(video_id).read_text())
+        except FileNotFoundError:
+            return None
+
+    def put(self, video_id: str, files: dict[str, Path]) -> dict[str, str]:
+        """Moves the downloaded files of a video into the store, returns lang -> blob name"""
+        index: dict[str, str] = {}
+        for lang, path in files.items():
+            raw = path.read_bytes()
+            blob = self.blob_path(hashlib.sha256(raw).hexdigest(), path.suffix.lstrip("."))
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                path.replace(blob)
+            index[lang] = blob.name
+        index_path = self._index_path(video_id)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index_path.write_text(json.dumps(index))
+        return index
+
+    def read(self, blob_name: str) -> Path:
+        return self.root / "blobs" / blob_name[:2] / blob_name
+
+
+def _build_ydl_opts_for_subtitles(out_dir: Path) -> dict:
+    return {
+        "quiet": True,
+        "no_warnings": True,
+        "skip_download": True,
+        "ignoreerrors": True,
+        "writesubtitles": True,
+        "writeautomaticsub": True,
+        "subtitleslangs": [lang.value for lang in Lang],
+        "subtitlesformat": "/".join(SUBTITLE_EXTS),
+        "outtmpl": {"default": str(out_dir / "%(id)s.%(ext)s")},
+    }
+
+
+_local = threading.local()
+# the slots and the downloads in flight are bound to their event loop, every celery task runs its own loop
+_slots: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+_in_flight: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Task[dict[str, str]]]] = weakref.WeakKeyDictionary()
+
+
+def _get_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(settings.YOUTUBE_SUBTITLE_CONCURRENCY)
+    return slots
+
+
+async def _download_in_slot(store: SubtitleStore, video_id: str) -> dict[str, str]:
+    async with _get_slots():
+        return await run_in_profile(ExecutorProfile.IO_THREADS, _download_subtitles, store, video_id)
+
+
+def _download_subtitles(store: SubtitleStore, video_id: str) -> dict[str, str]:
+    """Runs in an io-threads worker, each thread keeps one YoutubeDL writing into its own temp dir"""
+    if getattr(_local, "ydl", None) is None:
+        _local.out_dir = Path(tempfile.mkdtemp(prefix="subtitles_"))
+        _local.ydl = yt_dlp.YoutubeDL(_build_ydl_opts_for_subtitles(_local.out_dir))
+    retcode = _local.ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+    files: dict[str, Path] = {}
+    for path in _local.out_dir.glob(f"{video_id}.*"):
+        # <video_id>.<lang>.<ext>
+        lang, _, ext = path.name.removeprefix(f"{video_id}.").rpartition(".")
+        if ext in SUBTITLE_EXTS and lang:
+            files[lang] = path
+    if retcode and not files:
+        # a failed download is retried next time, a video without subtitles gets an empty index
+        raise RuntimeError(f"subtitles of {video_id} failed with {retcode}")
+    index = store.put(video_id, files)
+    for path in files.values():
+        path.unlink(missing_ok=True)
+    return index
+
+
+async def fetch_subtitles(video_id: str, *, store: SubtitleStore | None = None) -> dict[str, str]:
+    """lang -> blob of the video subtitles, downloaded once: later and concurrent calls share the stored result"""
+    store = store or SubtitleStore()
+    index = store.get_index(video_id)
+    if index is not None:
+        return index
+    in_flight = _in_flight.setdefault(asyncio.get_running_loop(), {})
+    future = in_flight.get(video_id)
+    if future is None:
+        future = asyncio.create_task(_download_in_slot(store, video_id))
+        in_flight[video_id] = future
+        future.add_done_callback(lambda _: in_flight.pop(video_id, None))
+    return await asyncio.shield(future)
+
+
+def _transcriptions(store: SubtitleStore, index: dict[str, str]) -> list[FeedRecPostTranscription]:
+    transcriptions: list[FeedRecPostTranscription] = []
+    for lang, blob in sorted(index.items()):
+        try:
+            post_lang = Lang(lang)
+        except ValueError:
+            continue
+        path = store.read(blob)
+        transcriptions.append(
+            FeedRecPostTranscription(lang=post_lang, raw=path.read_text(encoding="utf-8", errors="replace"), parsed=extract_clean_text_from_srt(path))
+        )
+    return transcriptions
+
+
+async def attach_subtitles(post: Post, *, store: SubtitleStore | None = None, log_extra: dict[str, str]) -> Post:
+    """Subtitle stage of a youtube post: fetches the subtitles once and attaches them as transcriptions"""
+    store = store or SubtitleStore()
+    try:
+        index = await fetch_subtitles(post.post_id, store=store)
+        transcriptions = await run_in_profile(ExecutorProfile.IO_THREADS, _transcriptions, store, index)
+    except Exception as e:
+        logger.warning(f"attach_subtitles({post.post_id}) :: {e!s}", extra=log_extra)
+        return post
+    if not transcriptions:
+        return post
+    media = post.media or RawPostMediaExt(preview=None, transcription=[])
+    return post.model_copy(update={"media": media.model_copy(update={"transcription": transcriptions})})
@@ -0,0 +1,44 @@
+import json
+import re
+import time
+from pathlib import Path
+
+import pytest
+
+from src.common.disk_cache import DiskCache
+from src.env import settings
+from src.external_youtube import info_cache
+from src.external_youtube.youtube_scrapy import _video_info_from_info_dict
+
+VIDEO_INFO = Path(__file__).parent / "video_info.json"
+
+
+@pytest.fixture
+def cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> DiskCache:
+    monkeypatch.setattr(settings, "YOUTUBE_INFO_CACHE", True)
+    disk_cache = DiskCache(tmp_path, max_bytes=2**24)
+    monkeypatch.setattr(info_cache, "_cache", disk_cache)
+    return disk_cache
+
+
+def test_info_cache_builds_the_same_post(cache: DiskCache) -> None:
+    info = json.loads(VIDEO_INFO.read_text())
+    # the recorded urls have long expired, sign them for the next day
+    expire = int(time.time()) + 24 * 3600
+    for f in info["formats"]:
+        if f.get("url"):
+            f["url"] = re.sub(r"([/?&]expire[/=])\d+", rf"\g<1>{expire}", f["url"])
+    info_cache.put_info(info)
+    cached = info_cache.get_info(info["id"])
+    assert cached is not None
+    assert set(cached) == {*info_cache.META_FIELDS, "formats"}
+    assert _video_info_from_info_dict("MrBeast", cached) == _video_info_from_info_dict("MrBeast", info)
+
+
+def test_info_cache_drops_expired_format_urls(cache: DiskCache) -> None:
+    info = json.loads(VIDEO_INFO.read_text())
+    info_cache.put_info(info)
+    assert info_cache.get_info(info["id"]) is None
+    meta = info_cache.get_meta(info["id"])
+    assert meta is not None
+    assert meta["upload_date"] == info["upload_date"]
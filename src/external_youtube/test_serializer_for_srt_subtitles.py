@@ -0,0 +1,44 @@
+import codecs
+import json
+from pathlib import Path
+
+from src.external_youtube.serializer_for_srt_subtitles import Segment, convert_directory, extract_clean_text_from_srt, iter_segments
+
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00.500 --> 00:02.000 align:start position:0%
+<c>hello</c><00:00:01.000><c> there</c>
+
+01:00:02.000 --> 01:00:04.250
+[Music]
+
+01:00:04.250 --> 01:00:05.000
+general   kenobi
+"""
+
+
+def test_iter_segments_keeps_timestamps(tmp_path: Path) -> None:
+    path = tmp_path / "video.en.vtt"
+    path.write_text(VTT)
+    assert list(iter_segments(path)) == [Segment(0.5, 2.0, "hello there"), Segment(3604.25, 3605.0, "general kenobi")]
+
+
+def test_extract_clean_text_sniffs_encoding(tmp_path: Path) -> None:
+    srt = "1\n00:00:00,000 --> 00:00:02,000\n[Music] café\n\n2\n00:00:02,000 --> 00:00:04,000\nsí\n"
+    for name, raw in (("bom.srt", codecs.BOM_UTF8 + srt.encode()), ("latin.srt", srt.encode("latin-1")), ("crlf.srt", srt.replace("\n", "\r\n").encode())):
+        (tmp_path / name).write_bytes(raw)
+        assert extract_clean_text_from_srt(tmp_path / name) == "café sí"
+
+
+def test_convert_directory(tmp_path: Path) -> None:
+    for n in range(3):
+        path = tmp_path / "subtitles" / f"channel_{n}" / f"video_{n}.en.vtt"
+        path.parent.mkdir(parents=True)
+        path.write_text(VTT)
+    converted = convert_directory(tmp_path / "subtitles", tmp_path / "text", processes=2, segments=True)
+    assert sorted(path.relative_to(tmp_path / "text").as_posix() for path in converted) == [f"channel_{n}/video_{n}.en.txt" for n in range(3)]
+    assert converted[0].read_text() == "hello there general kenobi"
+    segments = converted[0].with_name(f"{converted[0].name}.segments.jsonl").read_text().splitlines()
+    assert json.loads(segments[1]) == {"start": 3604.25, "end": 3605.0, "text": "general kenobi"}
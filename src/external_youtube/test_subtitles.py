@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pydantic import HttpUrl
+
+from src.dto.feed_rec_info import Lang, Post, Source
+from src.external_youtube.subtitles import SubtitleStore, attach_subtitles
+
+SRT = """1
+00:00:00,000 --> 00:00:02,000
+[Music] hello there
+
+2
+00:00:02,000 --> 00:00:04,000
+general kenobi
+"""
+
+
+def _post(video_id: str) -> Post:
+    return Post(
+        source=Source.YOUTUBE,
+        channel_name="channel",
+        post_id=video_id,
+        title="title",
+        description=None,
+        content=None,
+        pb_date=datetime(2025, 1, 1, tzinfo=timezone.utc),
+        link=HttpUrl("https://www.youtube.com/@channel"),
+        media=None,
+    )
+
+
+async def test_attach_subtitles_from_store(tmp_path: Path) -> None:
+    store = SubtitleStore(tmp_path / "store")
+    for video_id in ("video_1", "video_2"):
+        downloaded = tmp_path / f"{video_id}.en.srt"
+        downloaded.write_text(SRT)
+        store.put(video_id, {"en": downloaded})
+    # the same text is stored once
+    assert len(list((tmp_path / "store" / "blobs").glob("*/*"))) == 1
+    store.put("video_3", {})
+
+    post = await attach_subtitles(_post("video_1"), store=store, log_extra={})
+    assert post.media is not None
+    assert [(t.lang, t.parsed) for t in post.media.transcription] == [(Lang.EN, "hello there general kenobi")]
+    assert post.media.transcription[0].raw == SRT
+    # a video without subtitles keeps its media untouched and is not fetched again
+    assert store.get_index("video_3") == {}
+    assert (await attach_subtitles(_post("video_3"), store=store, log_extra={})).media is None
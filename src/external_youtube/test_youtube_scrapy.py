@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import billiard
+import pytest
+from pydantic import HttpUrl
+
+from src.dto.feed_rec_info import CrawlWindow, HighWaterMark, Post, Source
+from src.external_youtube import youtube_scrapy
+from src.external_youtube.youtube_scrapy import prune_listing
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+def _entry(video_id: str, days_ago: int) -> dict:
+    return {"id": video_id, "timestamp": (NOW - timedelta(days=days_ago)).timestamp()}
+
+
+ENTRIES = [_entry("v1", 1), _entry("v7", 7), _entry("v30", 30), {"id": "no_date"}, _entry("v60", 60), _entry("v365", 365), _entry("v730", 730)]
+
+
+def test_prune_listing_window() -> None:
+    # "30 days ago" may really be up to 60 days ago, so it stays; "7 days ago" is surely after dt_to
+    ids = prune_listing(ENTRIES, NOW, dt_to=NOW - timedelta(days=40), dt_from=NOW - timedelta(days=100))
+    assert ids == ["v30", "no_date", "v60"]
+
+
+def test_prune_listing_stops_at_high_water_mark() -> None:
+    hwm = HighWaterMark(post_id="v60", pb_date=NOW - timedelta(days=60))
+    assert prune_listing(ENTRIES, NOW, dt_to=NOW, dt_from=NOW - timedelta(days=1000), hwm=hwm) == ["v1", "v7", "v30", "no_date"]
+    # a listing without the marked video stops at its date
+    hwm = HighWaterMark(post_id="deleted", pb_date=NOW - timedelta(days=50))
+    assert prune_listing(ENTRIES, NOW, dt_to=NOW, dt_from=NOW - timedelta(days=1000), hwm=hwm) == ["v1", "v7", "v30", "no_date"]
+
+
+def test_prune_listing_skips_videos_in_the_db() -> None:
+    # without a high water mark the ingested videos of the window are left out, the listing goes on past them
+    ids = prune_listing(ENTRIES, NOW, dt_to=NOW, dt_from=NOW - timedelta(days=100), known_post_ids={"v1", "v30"})
+    assert ids == ["v7", "no_date", "v60"]
+
+
+def test_prune_listing_exact_dates() -> None:
+    # cached exact dates are not widened like the approximate ones
+    entries = [{**_entry("v7", 7), "exact_date": True}, {**_entry("v30", 30), "exact_date": True}]
+    assert prune_listing(entries, NOW, dt_to=NOW - timedelta(days=20), dt_from=NOW - timedelta(days=100)) == ["v30"]
+
+
+def _extracted(channel_name: str, video_id: str) -> Post:
+    return Post(
+        source=Source.YOUTUBE,
+        channel_name=channel_name,
+        post_id=video_id,
+        title=None,
+        description=None,
+        content=None,
+        pb_date=NOW,
+        link=HttpUrl(f"https://www.youtube.com/watch?v={video_id}"),
+        media=None,
+    )
+
+
+def _crawl_in_daemon(results: "billiard.Queue[list[str]]") -> None:
+    # stand in for yt-dlp, the rest of the path is the one the in-process scraper client takes
+    async def list_video_ids(*args: object) -> list[str]:
+        return ["v1", "v2", "v3"]
+
+    async def attach_subtitles(post: Post, *, log_extra: dict[str, str]) -> Post:
+        return post
+
+    youtube_scrapy.list_channel_video_ids = list_video_ids
+    youtube_scrapy._extract_post = _extracted  # noqa: SLF001
+    youtube_scrapy.subtitles.attach_subtitles = attach_subtitles
+
+    async def crawl() -> list[str]:
+        window = CrawlWindow(dt_to=NOW, dt_from=NOW - timedelta(days=1))
+        batches = youtube_scrapy.iter_channel_posts_list("channel", window, log_extra={})
+        return [post.post_id async for batch in batches for post in batch]
+
+    results.put(asyncio.run(crawl()))
+
+
+def test_extraction_runs_in_a_daemon_child() -> None:
+    # celery prefork children are daemonic and may not start a process pool
+    results: billiard.Queue[list[str]] = billiard.Queue()
+    child = billiard.Process(target=_crawl_in_daemon, args=(results,), daemon=True)
+    child.start()
+    try:
+        assert results.get(timeout=30) == ["v1", "v2", "v3"]
+    finally:
+        child.join(timeout=10)
+
+
+@pytest.mark.parametrize("failing", [None, "v3"])
+async def test_posts_stream_in_listing_order(failing: str | None, monkeypatch: pytest.MonkeyPatch) -> None:
+    delays = {"v1": 0.0, "v2": 0.03, "v3": 0.0, "v4": 0.2}
+
+    async def list_video_ids(*args: object) -> list[str]:
+        return list(delays)
+
+    async def extract(profile: object, func: object, channel_name: str, video_id: str) -> Post | None:
+        await asyncio.sleep(delays[video_id])
+        return None if video_id == failing else _extracted(channel_name, video_id)
+
+    async def attach_subtitles(post: Post, *, log_extra: dict[str, str]) -> Post:
+        return post
+
+    monkeypatch.setattr(youtube_scrapy, "list_channel_video_ids", list_video_ids)
+    monkeypatch.setattr(youtube_scrapy, "run_in_profile", extract)
+    monkeypatch.setattr(youtube_scrapy.subtitles, "attach_subtitles", attach_subtitles)
+    window = CrawlWindow(dt_to=NOW, dt_from=NOW - timedelta(days=1))
+    batches = [[post.post_id for post in batch] async for batch in youtube_scrapy.iter_channel_posts_list("channel", window, concurrency=4, log_extra={})]
+    # newest first whatever order the extractions end in, the first posts don't wait for the slow last one
+    assert [post_id for batch in batches for post_id in batch] == [video_id for video_id in delays if video_id != failing]
+    assert "v4" not in batches[0]
+    assert window.completed is (failing is None)
@@ -1,15 +1,24 @@
 from __future__ import annotations
 
+import asyncio
+import itertools
 import logging
+import threading
+from collections import deque
+from collections.abc import AsyncIterator, Container, Iterable
+from contextlib import aclosing
 from datetime import date, datetime, timezone
 
 import yt_dlp
 from pydantic import HttpUrl
 from redis.asyncio import Redis
 
-from src.common.async_utils import run_on_loop, sync_to_async
-from src.dto import redis_models
-from src.dto.feed_rec_info import Channel, MediaFormat, Post, RawPostMedia, Source, TaskStatus, MediaResolution, RawPostMediaExt
+from src.common.async_utils import sync_to_async
+from src.common.executors import ExecutorProfile, run_in_profile
+from src.common.moment import as_utc
+from src.dto.feed_rec_info import Channel, CrawlWindow, HighWaterMark, MediaFormat, MediaResolution, Post, RawPostMedia, RawPostMediaExt, Source
+from src.env import settings
+from src.external_youtube import info_cache, subtitles
 
 logger = logging.getLogger(__name__)
 
@@ -20,27 +29,15 @@ END_OF_EPOCH = datetime(2100, 1, 1, tzinfo=timezone.utc)
 
 rds = Redis(host="localhost", port=60379)
 
-def _build_ydl_opts_for_video_subtitle() -> dict:
-    base = {
-        "quiet": True,
-        "no_warnings": True,
-        "skip_download": True,
-        "extract_flat": False,
-        "ignoreerrors": True,
-        "subtitlesformat": "srt",
-        "writeautomaticsub": True,
-    }
-    return base
 
 def _build_ydl_opts_for_videos() -> dict:
-    base = {
+    return {
         "quiet": True,
         "no_warnings": True,
         "skip_download": True,
         "extract_flat": False,
         "ignoreerrors": True,
     }
-    return base
 
 
 def _parse_upload_date(s: str | None) -> datetime | None:
@@ -53,29 +50,22 @@ def _parse_upload_date(s: str | None) -> datetime | None:
 
 
 def _audio_only_formats(formats: list[dict]) -> RawPostMediaExt | None:
-
     for f in formats:
         if f["resolution"] != MediaResolution.AUDIO_ONLY.value:
             continue
         if f["audio_ext"] == MediaFormat.WEBM.value and f["url"]:
-
             preview = RawPostMedia(
                 url=HttpUrl(f["url"]),
                 resolution=MediaResolution.AUDIO_ONLY,
                 audio_ext=MediaFormat.WEBM,
                 downloaded_file=None,
             )
-            return RawPostMediaExt(
-                preview=preview,
-                transcription=[]
-            )
+            return RawPostMediaExt(preview=preview, transcription=[])
 
 
 def _video_info_from_info_dict(channel_name: str, data: dict) -> Post:
     post_id = data["id"]
-    with yt_dlp.YoutubeDL(_build_ydl_opts_for_video_subtitle()) as ydl:
-        ydl.download(f"https://www.youtube.com/watch?v={post_id}")
-    post = Post(
+    return Post(
         source=Source.YOUTUBE,
         channel_name=channel_name,
         title=data["fulltitle"],
@@ -86,13 +76,98 @@ def _video_info_from_info_dict(channel_name: str, data: dict) -> Post:
         link=HttpUrl(data["uploader_url"]),
         media=_audio_only_formats(data["formats"] or []),
     )
-    print("geeeeet")
-    return post
+
+
+# warmed YoutubeDL of an extraction worker, built by its first video and reused after.
+# YoutubeDL is not thread-safe and in a celery prefork child the cpu-processes workers are threads, one each
+_local = threading.local()
+
+
+def _extract_post(channel_name: str, video_id: str) -> Post | None:
+    """Runs in a cpu-processes worker, subtitles are left to the subtitle stage"""
+    info = info_cache.get_info(video_id)
+    if info is None:
+        if getattr(_local, "ydl", None) is None:
+            _local.ydl = yt_dlp.YoutubeDL(_build_ydl_opts_for_videos())
+        info = _local.ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        if not info:
+            return None
+        info_cache.put_info(info)
+    return _video_info_from_info_dict(channel_name, info)
+
+
+def _entry_date(entry: dict) -> datetime | None:
+    if entry.get("timestamp"):
+        return datetime.fromtimestamp(entry["timestamp"], tz=timezone.utc)
+    return _parse_upload_date(entry.get("upload_date"))
+
+
+def prune_listing(
+    entries: Iterable[dict | None],
+    now: datetime,
+    dt_to: datetime,
+    dt_from: datetime,
+    hwm: HighWaterMark | None = None,
+    known_post_ids: Container[str] = frozenset(),
+) -> list[str]:
+    """
+    Ids of the flat listing entries (newest first, approximate upload dates like "3 weeks ago" unless exact_date is set)
+    that may be in the window.
+    An approximate date is never older than the real one and is off by less than its age, so videos that surely are newer
+    than dt_to are skipped and the listing stops at the first video older than dt_from or than the high water mark.
+    Videos already in the db are skipped too, a crawl without a high water mark doesn't extract them again
+    """
+    utc_dt_to, utc_dt_from = as_utc(dt_to), as_utc(dt_from)
+    video_ids: list[str] = []
+    for entry in entries:
+        if not entry or not entry.get("id"):
+            continue
+        if hwm is not None and entry["id"] == hwm.post_id:
+            break
+        if entry["id"] in known_post_ids:
+            continue
+        approx = _entry_date(entry)
+        if approx is not None:
+            if approx < utc_dt_from or (hwm is not None and approx < as_utc(hwm.pb_date)):
+                break
+            if (approx if entry.get("exact_date") else approx - (now - approx)) > utc_dt_to:
+                continue
+        video_ids.append(entry["id"])
+    return video_ids
+
+
+def _with_cached_date(entry: dict | None) -> dict | None:
+    """Videos extracted before have their exact upload date in the info cache"""
+    meta = info_cache.get_meta(entry["id"]) if entry and entry.get("id") else None
+    if meta is None or not meta.get("upload_date"):
+        return entry
+    return {**entry, "timestamp": None, "upload_date": meta["upload_date"], "exact_date": True}
+
+
+@sync_to_async
+def list_channel_video_ids(
+    channel_name: str,
+    dt_to: datetime = END_OF_EPOCH,
+    dt_from: datetime = START_OF_EPOCH,
+    hwm: HighWaterMark | None = None,
+    known_post_ids: Container[str] = frozenset(),
+) -> list[str]:
+    """Phase 1 of a channel crawl: lazy flat listing of the videos, pruned by prune_listing, no per-video extraction"""
+    opts = {
+        **_build_ydl_opts_for_videos(),
+        "extract_flat": "in_playlist",
+        "lazy_playlist": True,
+        "extractor_args": {"youtubetab": {"approximate_date": ["true"]}},
+    }
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        listing = ydl.extract_info(f"https://www.youtube.com/@{channel_name}/videos", download=False, process=False)
+        entries = (_with_cached_date(entry) for entry in (listing or {}).get("entries") or [])
+        return prune_listing(entries, datetime.now(timezone.utc), dt_to, dt_from, hwm, known_post_ids)
 
 
 @sync_to_async
 def get_channel_info(channel_url: str) -> Channel:
-    with yt_dlp.YoutubeDL(_build_ydl_opts()) as ydl:
+    with yt_dlp.YoutubeDL(_build_ydl_opts_for_videos()) as ydl:
         info = ydl.extract_info(channel_url, download=False)
         title = info["title"] or info["channel"] or info["uploader"]
         description = info["description"]
@@ -115,21 +190,6 @@ def get_channel_info(channel_url: str) -> Channel:
         )
 
 
-@sync_to_async
-def get_channel_posts_info(channel_name: str) -> list[Post]:
-    with yt_dlp.YoutubeDL(_build_ydl_opts_for_videos()) as ydl:
-        listing = ydl.extract_info(f"https://www.youtube.com/@{channel_name}", download=False)
-        entries = listing["entries"] or []
-        out: list[Post] = []
-        for e in entries:
-            try:
-                out.append(_video_info_from_info_dict(channel_name, e))
-
-            except Exception:
-                continue
-        return out
-
-
 """@sync_to_async
 def get_all_videos(channel_name: str) -> list[Post]:
     video_ids = run_on_loop(iter_channel_video_ids(channel_name))
@@ -146,19 +206,86 @@ def get_all_videos(channel_name: str) -> list[Post]:
     return out"""
 
 
-async def get_channel_posts_list(channel_name: str, *, log_extra: dict[str, str]) -> list[Post] | None:
-    """dt_to = await rds.get(redis_models.source_channel_name_dt_to(Source.YOUTUBE, channel_name))
-    if not dt_to:
-        dt_to = END_OF_EPOCH
-    dt_from = await rds.get(redis_models.source_channel_name_dt_from(Source.YOUTUBE, channel_name))
-    if not dt_from:
-        dt_from = START_OF_EPOCH
-    utc_dt_to = datetime.fromisoformat(dt_to.decode("utf-8"))
-    utc_dt_from = datetime.fromisoformat(dt_from.decode("utf-8"))"""
+def _in_window(post: Post, window: CrawlWindow, hwm: HighWaterMark | None) -> bool:
+    return as_utc(window.dt_from) <= post.pb_date <= as_utc(window.dt_to) and (hwm is None or post.post_id != hwm.post_id)
+
+
+def _pop_extracted(channel_name: str, extracting: deque[tuple[str, asyncio.Task[Post | None]]], *, log_extra: dict[str, str]) -> tuple[list[Post], int]:
+    """Posts of the extractions done at the head of the queue, and the count of the ones that failed"""
+    posts: list[Post] = []
+    failed = 0
+    while extracting and extracting[0][1].done():
+        video_id, task = extracting.popleft()
+        try:
+            post = task.result()
+        except Exception as e:
+            logger.warning(f"iter_channel_posts_list({channel_name}) :: {video_id} failed: {e!s}", extra=log_extra)
+            post = None
+        if post is None:
+            failed += 1
+        else:
+            posts.append(post)
+    return posts, failed
+
+
+async def iter_channel_posts_list(
+    channel_name: str,
+    window: CrawlWindow,
+    *,
+    hwm: HighWaterMark | None = None,
+    known_post_ids: Container[str] = frozenset(),
+    concurrency: int | None = None,
+    log_extra: dict[str, str],
+) -> AsyncIterator[list[Post]]:
+    """
+    Two phases: a flat listing prunes videos by their approximate dates, only the survivors are fully extracted
+    and then filtered by their real upload dates.
+    Posts are yielded in listing order, newest first, as soon as they and the ones before them are done,
+    with at most `concurrency` videos extracting while the subtitles of the extracted ones are fetched.
+    window.completed is set once every listed video was extracted
+    """
+    concurrency = concurrency or settings.YOUTUBE_EXTRACT_CONCURRENCY
+    video_ids = await list_channel_video_ids(channel_name, window.dt_to, window.dt_from, hwm, known_post_ids)
+    logger.debug(f"iter_channel_posts_list({channel_name}) :: {len(video_ids)} videos left after listing", extra=log_extra)
+    ids = iter(video_ids)
+    extracting: deque[tuple[str, asyncio.Task[Post | None]]] = deque()
+    # the subtitle stage runs next to the extraction, so subtitle latency doesn't hold back the extraction
+    with_subtitles: deque[asyncio.Task[Post]] = deque()
+    failed = 0
+    try:
+        while True:
+            if window.stopped:
+                logger.warning("Crawl stopped.", extra=log_extra)
+                return
+            for video_id in itertools.islice(ids, concurrency - len(extracting)):
+                extracting.append((video_id, asyncio.create_task(run_in_profile(ExecutorProfile.CPU_PROCESSES, _extract_post, channel_name, video_id))))
+            heads = ([extracting[0][1]] if extracting else []) + ([with_subtitles[0]] if with_subtitles else [])
+            if not heads:
+                break
+            await asyncio.wait(heads, return_when=asyncio.FIRST_COMPLETED)
+            posts, failures = _pop_extracted(channel_name, extracting, log_extra=log_extra)
+            failed += failures
+            with_subtitles.extend(asyncio.create_task(subtitles.attach_subtitles(post, log_extra=log_extra)) for post in posts if _in_window(post, window, hwm))
+            batch: list[Post] = []
+            while with_subtitles and with_subtitles[0].done():
+                batch.append(with_subtitles.popleft().result())
+            if batch:
+                yield batch
+        # a video that failed to extract may be newer than the ones that made it
+        window.completed = not failed
+    finally:
+        for _, task in extracting:
+            task.cancel()
+        for task in with_subtitles:
+            task.cancel()
+
+
+async def get_channel_posts_list(channel_name: str, window: CrawlWindow, *, hwm: HighWaterMark | None = None, log_extra: dict[str, str]) -> list[Post] | None:
+    """All the posts of iter_channel_posts_list at once"""
     logger.debug("get_channel_posts_list :: start to finding yt posts", extra=log_extra)
-    all_videos = await get_channel_posts_info(channel_name)
-    logger.debug(f"get_channel_posts_list :: found {len(all_videos)} videos", extra=log_extra)
+    batches = iter_channel_posts_list(channel_name, window, hwm=hwm, log_extra=log_extra)
+    async with aclosing(batches):
+        in_range = [post async for batch in batches for post in batch]
     logger.debug(f"get_channel_posts_list :: found in_range {len(in_range)} videos", extra=log_extra)
     in_range.sort(key=lambda v: v.pb_date or date.min, reverse=True)
-    logger.debug("get_channel_posts_list :: finish finding posts --> start to download subtitles", extra=log_extra)
     return in_range
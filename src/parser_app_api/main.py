@@ -1,20 +1,35 @@
+import contextlib
 import logging
+from collections.abc import AsyncIterator
 
 from fastapi import FastAPI
 
+from src.common import executors, http_utils
 from src.errors import ApiError, api_error_handler
 from src.parser_app_api.middlewares import log_extra_middleware
+from src.parser_app_api.routes.metrics_router import metrics_router
 from src.parser_app_api.routes.parser_router import parser_router
 
 logger = logging.getLogger(__name__)
 
 
+@contextlib.asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    http_utils.get_http_session()
+    try:
+        yield
+    finally:
+        await http_utils.close_http_session()
+        executors.shutdown_executors()
+
+
 def get_app() -> FastAPI:
     # init
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     # routes
     app.include_router(parser_router)
+    app.include_router(metrics_router)
 
     # middlewares
     app.middleware("http")(log_extra_middleware)
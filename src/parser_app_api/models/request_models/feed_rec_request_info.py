@@ -10,6 +10,9 @@ class ParsingParametersApiMdl(BaseModel):
     channel_name: str
     dt_to: datetime
     dt_from: datetime
+    incremental: bool = False
+    # ids of the window already in the db, the youtube listing skips them
+    known_post_ids: list[str] = []
 
 
 class InfoParsingParametersApiMdl(BaseModel):
@@ -0,0 +1,14 @@
+from typing import Any
+
+from fastapi import APIRouter
+
+from src.common.executors import executors_snapshot
+
+metrics_router = APIRouter(
+    tags=["metrics router"],
+)
+
+
+@metrics_router.get("/metrics/executors")
+async def get_executors_metrics() -> dict[str, dict[str, Any]]:
+    return executors_snapshot()
@@ -1,21 +1,41 @@
 import logging
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 
 from src.cli_scrapper import scrapy_manager
+from src.dto.feed_rec_info import CrawlEnd, CrawlWindow, Post
 from src.parser_app_api.middlewares import get_log_extra
 from src.parser_app_api.models.request_models.feed_rec_request_info import InfoParsingParametersApiMdl, ParsingParametersApiMdl
 
 logger = logging.getLogger(__name__)
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 
 parser_router = APIRouter(
     tags=["parser router"],
 )
 
 
-@parser_router.post("/start_parser")
-async def start_parser(parsing_parameters: ParsingParametersApiMdl, log_extra: dict[str, str] = Depends(get_log_extra)):
+async def _ndjson_batches(parsing_parameters: ParsingParametersApiMdl, *, log_extra: dict[str, str]) -> AsyncIterator[str]:
+    """One post per line, the last line is the CrawlEnd of the crawl"""
+    window = CrawlWindow(dt_to=parsing_parameters.dt_to, dt_from=parsing_parameters.dt_from)
+    batches = scrapy_manager.stream_parsing(parsing_parameters, window=window, log_extra=log_extra)
+    async with aclosing(batches):
+        async for batch in batches:
+            yield "".join(f"{post.model_dump_json()}\n" for post in batch)
+    yield f"{CrawlEnd(completed=window.completed).model_dump_json()}\n"
+
+
+@parser_router.post("/start_parser", response_model=None)
+async def start_parser(
+    parsing_parameters: ParsingParametersApiMdl, stream: bool = False, log_extra: dict[str, str] = Depends(get_log_extra)
+) -> list[Post] | StreamingResponse | None:
+    if stream:
+        return StreamingResponse(_ndjson_batches(parsing_parameters, log_extra=log_extra), media_type=NDJSON_MEDIA_TYPE)
     return await scrapy_manager.start_parsing(parsing_parameters, log_extra=log_extra)
 
 
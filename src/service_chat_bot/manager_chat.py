@@ -11,6 +11,8 @@ from langchain import OpenAI
 """
 
 import asyncio
+import functools
+import logging
 import uuid
 from collections.abc import Iterator
 from datetime import datetime
@@ -33,6 +35,8 @@ from src.dto.qdrant_models import PayloadChunk, PayloadPost
 from src.env import settings
 from src.service_deepseek import deepseek, prompts
 
+logger = logging.getLogger(__name__)
+
 
 def json_loader(text_doc) -> Post:
     page_content_doc = text_doc.metadata
@@ -48,9 +52,17 @@ def json_loader(text_doc) -> Post:
     )
 
 
-def serialize_post(llm_client: OpenAI, embedder_model: str, embedder: CacheBackedEmbeddings, post: Post) -> models.PointStruct:
-    summary = asyncio.run(deepseek.prompt(llm_client, prompt=prompts.realtime_summary(post.content)))
-    embedding_vector = embedder.embed_documents(summary)
+EMBEDDER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+COLLECTIONS = ("posts", "chunks")
+
+
+def post_point_id(post: Post) -> str:
+    """Stable per post, so a retried stage overwrites its points instead of adding new ones"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{post.source.value}/{post.channel_name}/{post.post_id}"))
+
+
+def embed_post(embedder_model: str, embedder: CacheBackedEmbeddings, post: Post, summary: str, point_id: str | None = None) -> models.PointStruct:
+    embedding_vector = embedder.embed_documents([summary])
     payload = PayloadPost(
         source=post.source.value,
         channel_name=post.channel_name,
@@ -61,12 +73,17 @@ def serialize_post(llm_client: OpenAI, embedder_model: str, embedder: CacheBacke
         page_content=summary,
     )
     return models.PointStruct(
-        id=str(uuid.uuid4()),
+        id=point_id or str(uuid.uuid4()),
         vector=embedding_vector[-1],
         payload=payload.model_dump(),
     )
 
 
+def serialize_post(llm_client: OpenAI, embedder_model: str, embedder: CacheBackedEmbeddings, post: Post) -> models.PointStruct:
+    summary = asyncio.run(deepseek.prompt(llm_client, prompt=prompts.realtime_summary(post.content)))
+    return embed_post(embedder_model, embedder, post, summary)
+
+
 def serialize_chunks(
     embedder_model: str, embedder: CacheBackedEmbeddings, text_splitter: CharacterTextSplitter, post_id: uuid.UUID, source: Source, channel_name: str, text: str
 ) -> Iterator[models.PointStruct]:
@@ -83,7 +100,7 @@ def serialize_chunks(
             embedding_model=embedder_model,
             page_content=chunk,
         )
-        yield models.PointStruct(id=str(uuid.uuid4()), vector=embedding_vectors[chunk_id], payload=payload.model_dump())
+        yield models.PointStruct(id=str(uuid.uuid5(uuid.UUID(str(post_id)), str(chunk_id))), vector=embedding_vectors[chunk_id], payload=payload.model_dump())
 
 
 def add_post_to_qdrant(path: Path, embedder_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
@@ -159,6 +176,86 @@ def add_post_to_qdrant(path: Path, embedder_model: str = "sentence-transformers/
         )
 
 
+@functools.cache
+def _get_llm_client() -> OpenAI:
+    return OpenAI(api_key=settings.DEEP_SEEK_API_KEY.get_secret_value(), base_url="https://api.deepseek.com")
+
+
+@functools.cache
+def _get_embedder(embedder_model: str = EMBEDDER_MODEL) -> CacheBackedEmbeddings:
+    store = RedisStore(
+        redis_url=str(settings.CACHE_DB_URL),
+        client_kwargs={"db": 2},
+        namespace="embedding_caches",
+    )
+    underlying_embeddings = HuggingFaceEmbeddings(model_name=embedder_model)
+    return CacheBackedEmbeddings.from_bytes_store(underlying_embeddings, store, namespace=underlying_embeddings.model_name)
+
+
+@functools.cache
+def _get_qdrant() -> QdrantClient:
+    qdrant = QdrantClient(
+        url=str(settings.QDRANT_URL),
+        prefer_grpc=True,
+    )
+    for collection_name in COLLECTIONS:
+        if not qdrant.collection_exists(collection_name=collection_name):
+            qdrant.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(size=384, distance=models.Distance.COSINE),
+            )
+    return qdrant
+
+
+async def summarize_posts(posts: list[Post]) -> dict[str, str]:
+    """post_id -> summary, the prompts run side by side on the llm executor, the posts whose prompt failed are left out"""
+    llm_client = _get_llm_client()
+    summaries = await asyncio.gather(
+        *(deepseek.prompt(llm_client, prompt=prompts.realtime_summary(post.content)) for post in posts), return_exceptions=True
+    )
+    summarized: dict[str, str] = {}
+    for post, summary in zip(posts, summaries, strict=True):
+        if isinstance(summary, BaseException):
+            logger.warning(f"summarize_posts({post.channel_name}/{post.post_id}) :: {summary!r}")
+            continue
+        summarized[post.post_id] = summary
+    return summarized
+
+
+def upsert_posts(posts: list[Post], summaries: dict[str, str], embedder_model: str = EMBEDDER_MODEL) -> None:
+    """Embeds the summarized posts with their chunks, kept by the worker process between batches"""
+    qdrant = _get_qdrant()
+    embedder = _get_embedder(embedder_model)
+    text_splitter = CharacterTextSplitter(
+        separator="\n",
+        chunk_size=1000,
+        chunk_overlap=100,
+        length_function=len,
+    )
+    post_points: list[models.PointStruct] = []
+    chunk_points: list[models.PointStruct] = []
+    for post in posts:
+        if not isinstance(post.content, str) or post.post_id not in summaries:
+            continue
+        point = embed_post(embedder_model, embedder, post, summaries[post.post_id], point_id=post_point_id(post))
+        post_points.append(point)
+        chunk_points.extend(
+            serialize_chunks(
+                embedder_model=embedder_model,
+                embedder=embedder,
+                text_splitter=text_splitter,
+                source=post.source,
+                channel_name=post.channel_name,
+                post_id=uuid.UUID(str(point.id)),
+                text=post.content,
+            )
+        )
+    if post_points:
+        qdrant.upsert(points=post_points, collection_name="posts")
+    if chunk_points:
+        qdrant.upsert(points=chunk_points, collection_name="chunks")
+
+
 def initialize_retriever(source: Source, channel_name: str):
     store = RedisStore(redis_url=settings.CACHE_DB_URL, client_kwargs={"db": 2}, namespace="embedding_caches")
 
@@ -1,19 +1,28 @@
-from openai import OpenAI
+from openai import APIStatusError, OpenAI
 
 from src.common.async_utils import sync_to_async
+from src.common.executors import ExecutorProfile
+from src.common.rate_limit import record_response
 from src.env import settings
 
+DEEPSEEK_HOST = "api.deepseek.com"
 
-@sync_to_async
+
+@sync_to_async(profile=ExecutorProfile.LLM_THREADS)
 def prompt(client: OpenAI, prompt: str) -> str:
-    client_s = OpenAI(api_key=settings.DEEP_SEEK_API_KEY.get_secret_value(), base_url="https://api.deepseek.com")
-    response = client_s.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "user", "content": prompt},
-        ],
-        stream=False,
-    )
+    client_s = OpenAI(api_key=settings.DEEP_SEEK_API_KEY.get_secret_value(), base_url=f"https://{DEEPSEEK_HOST}")
+    try:
+        response = client_s.chat.completions.create(
+            model="deepseek-chat",
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+            stream=False,
+        )
+    except APIStatusError as e:
+        record_response(DEEPSEEK_HOST, e.status_code)
+        raise
+    record_response(DEEPSEEK_HOST, 200)
     text = response.choices[0].message.content
     if isinstance(text, str):
         return text